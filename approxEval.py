@@ -0,0 +1,173 @@
+"""
+Measures what the approximate index (IvfIndex) and the reduced precisions of the points (see precision.py)
+cost in accuracy.
+
+The recall doesn't say much by itself: what matters is if the bot takes different positions.
+So for every setting it reports:
+	- recall@k: how many of the exact k nn are found by the approximate index
+	- direction changes: on how many sim klines the predicted direction (long, short or none) is different
+	  (the directions are the ones of getPosition, calculated for all the klines at once with getSignals)
+	- the time of the knn queries of the two indexes
+"""
+
+import time
+import numpy as np
+
+from config import knnConfig
+from dataGetter import getCryptoDataBinance
+from decisionMaker import Knn
+from indicators import extractFeatures
+
+
+def recallAtK(exactIndexes, approxIndexes):
+	"""
+	Mean fraction of the exact nn that were found by the approximate search,
+	over the dataPoints that have exact nn (the ones without approximate nn count as 0)
+
+	:param exactIndexes:	(m, k) array, -1 for the rows without nn
+	:param approxIndexes:	(m, k) array, -1 for the rows without nn
+	"""
+
+	rows = exactIndexes[:, 0] != -1
+
+	if not rows.any():
+		return 1.0
+
+	exact = np.sort(exactIndexes[rows], axis=1)
+	approx = approxIndexes[rows]
+
+	# for each approximate nn, is it in the exact ones?
+	found = np.zeros(approx.shape, dtype=bool)
+	for column in range(approx.shape[1]):
+		position = np.minimum(np.sum(exact < approx[:, column, None], axis=1), exact.shape[1] - 1)
+		found[:, column] = exact[np.arange(len(exact)), position] == approx[:, column]
+
+	found &= approx != -1
+
+	return float(found.sum(axis=1).mean() / exact.shape[1])
+
+
+def knnDecisions(trainKlines, simKlines, knnParams, features):
+	"""
+	Runs the knn of all the sim klines with the given params
+
+	:param features:	(trainFeatures, simFeatures)
+	:return:			{"indexes": (m, k) nn indexes, "signals": (m,) directions, "seconds": time of the queries,
+						"bytes": memory of the points of the index (None if they are not in this process)}
+	"""
+
+	trainFeatures, simFeatures = features
+
+	with Knn(trainKlines, simKlines, knnParams=knnParams, trainFeatures=trainFeatures, simFeatures=simFeatures) as knn:
+		start = time.time()
+		knn.simKnn = knn.getKnnBatch(knn.simDataPoints)
+		seconds = time.time() - start
+
+		return {
+			"indexes": knn.simKnn[0],
+			"signals": knn.getSignals(simKlines),
+			"seconds": seconds,
+			"bytes": knn.index.points.nbytes if knn.index.points is not None else None
+		}
+
+
+def evaluateApproximate(trainKlines, simKlines, approxParams, exactParams=None, features=None, exact=None):
+	"""
+	Compares the knn with the approximate index to the one with an exact index, on the same klines
+
+	:param approxParams:	knn params with the approximate index (for example {..., "index": "ivf", "probes": 4})
+	:param exactParams:		knn params of the reference (default: the approxParams with the brute force index)
+	:param features:		already calculated (trainFeatures, simFeatures), so they are shared between the calls
+	:param exact:			already calculated knnDecisions of the reference
+	:return:				{"recall": ..., "directionChanges": ..., "changeRate": ..., "exactSeconds": ..., ...}
+	"""
+
+	if exactParams is None:
+		exactParams = dict(approxParams, index="brute")
+
+	if features is None:
+		features = (extractFeatures(trainKlines), extractFeatures(simKlines))
+
+	if exact is None:
+		exact = knnDecisions(trainKlines, simKlines, exactParams, features)
+	approx = knnDecisions(trainKlines, simKlines, approxParams, features)
+
+	changed = exact["signals"] != approx["signals"]
+	taken = (exact["signals"] != 0) | (approx["signals"] != 0)
+
+	return {
+		"recall": recallAtK(exact["indexes"], approx["indexes"]),
+		"exactSignals": int((exact["signals"] != 0).sum()),
+		"approxSignals": int((approx["signals"] != 0).sum()),
+		"directionChanges": int(changed.sum()),
+		# the changes over the klines where at least one of the two takes a position
+		"changeRate": float(changed.sum() / taken.sum()) if taken.any() else 0.0,
+		"exactSeconds": exact["seconds"],
+		"approxSeconds": approx["seconds"],
+		"speedup": exact["seconds"] / max(approx["seconds"], 1e-9),
+		"exactBytes": exact["bytes"],
+		"approxBytes": approx["bytes"]
+	}
+
+
+def compareProbes(trainKlines, simKlines, probes=(1, 2, 4, 8, 16, 32), knnParams=knnConfig, lists=None):
+	"""
+	Evaluates the approximate index for every number of probed lists, to choose the accuracy knob.
+	The exact knn is calculated only once.
+
+	:return:	[results of evaluateApproximate with "probes"], also printed as a table
+	"""
+
+	features = (extractFeatures(trainKlines), extractFeatures(simKlines))
+	exact = knnDecisions(trainKlines, simKlines, dict(knnParams, index="brute"), features)
+
+	rows = []
+	for probeCount in probes:
+		approxParams = dict(knnParams, index="ivf", probes=probeCount, lists=lists)
+		results = evaluateApproximate(trainKlines, simKlines, approxParams, features=features, exact=exact)
+		results["probes"] = probeCount
+		rows.append(results)
+
+	print(f"\n{'probes':>6} {'recall@k':>9} {'changes':>8} {'change rate':>12} {'speedup':>8}")
+	for row in rows:
+		print(f"{row['probes']:>6} {row['recall']:>9.4f} {row['directionChanges']:>8} {row['changeRate']:>12.4f} {row['speedup']:>8.2f}")
+
+	return rows
+
+
+def comparePrecisions(trainKlines, simKlines, precisions=("float32", "int16"), knnParams=knnConfig):
+	"""
+	Verification of the reduced precisions: compares the knn with the points stored in each precision to the one
+	with the float64 points (same index, same klines), so it's known how many positions change before using it.
+	The float64 knn is calculated only once.
+
+	:return:	[results of evaluateApproximate with "precision"], also printed as a table
+	"""
+
+	features = (extractFeatures(trainKlines), extractFeatures(simKlines))
+	exactParams = dict(knnParams, precision="float64")
+	exact = knnDecisions(trainKlines, simKlines, exactParams, features)
+
+	rows = []
+	for precision in precisions:
+		results = evaluateApproximate(
+			trainKlines, simKlines, dict(knnParams, precision=precision), exactParams, features=features, exact=exact
+		)
+		results["precision"] = precision
+		rows.append(results)
+
+	# the sharded index has its points in the shards
+	megabytes = lambda bytes: f"{bytes / 2 ** 20:.2f}" if bytes is not None else "-"
+
+	print(f"\n{'precision':>9} {'MB':>8} {'recall@k':>9} {'changes':>8} {'change rate':>12}")
+	print(f"{'float64':>9} {megabytes(exact['bytes']):>8} {1:>9.4f} {0:>8} {0:>12.4f}")
+	for row in rows:
+		print(f"{row['precision']:>9} {megabytes(row['approxBytes']):>8} {row['recall']:>9.4f} {row['directionChanges']:>8} {row['changeRate']:>12.4f}")
+
+	return rows
+
+
+if __name__ == '__main__':
+	klines = getCryptoDataBinance()
+
+	compareProbes(klines[:500000], klines[509200:519280])
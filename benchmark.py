@@ -0,0 +1,246 @@
+"""
+Benchmark of every stage of a backtest, on synthetic klines (see getSyntheticData), so it can be run anywhere
+and always on the same data.
+
+For every size it times:
+    loadCsv             parsing the klines csv (a synthetic one in the Binance format)
+    loadCache           loading the same klines from the binary cache
+    extractDataPoints   the features of the training klines
+    placeDpInGrid       building the grid (and "build <index>" for the other chosen indexes)
+    queries             the knn of the sim dataPoints, in one batch (one "queries <index>" for each index)
+    simulateOutcomes    the outcome table of the training klines
+    simulatePosition    looking up the simulated position of the knn of the sim dataPoints
+    runBacktest         the vectorized backtest of the sim klines
+    runBacktestLoop     the kline by kline backtest (on fewer sim klines, it's slow)
+
+The results are written as json, so two revisions can be compared:
+    python benchmark.py --sizes 10000 100000 1000000 --output before.json
+    python benchmark.py --sizes 10000 100000 1000000 --output after.json
+    python benchmark.py --compare before.json after.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from config import knnConfig, positionSimConfig
+from dataGetter import getSyntheticData, getCryptoDataBinance
+from decisionMaker import Knn
+from outcomeTable import simulateOutcomes
+from spatialIndex import buildIndex
+from tradingClasses import Backtest
+from vectorBacktest import VectorBacktest
+
+
+def writeBinanceCsv(klines, filePath):
+    """
+    Writes the klines in the Binance csv format (with a header, like the files loaded by getCryptoDataBinance)
+    """
+
+    data = np.column_stack([klines.timestamp, klines.open, klines.high, klines.low, klines.close, klines.volume])
+    np.savetxt(filePath, data, delimiter=",", fmt=["%d", "%.8f", "%.8f", "%.8f", "%.8f", "%.8f"],
+               header="open_time,open,high,low,close,volume", comments="")
+
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # the stages print their progress, which is not wanted in the results
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        self.stages[name] = round(time.perf_counter() - start, 6)
+
+        print(f"    {name:<24} {self.stages[name]:>10.4f}s")
+
+
+def benchmarkSize(numOfKlines, seed=0, indexes=("grid",), simKlines=20000, loopBacktestKlines=2000, withCsv=True,
+                  knnParams=knnConfig, positionParams=positionSimConfig):
+    """
+    Times every stage on numOfKlines synthetic klines.
+    The last simKlines (at most a tenth of them) are the sim klines, the rest are the training ones.
+
+    :return:    {"klines": ..., "stages": {stage: seconds}, "perItem": {stage: microseconds per item}}
+    """
+
+    print(f"\n{numOfKlines} klines:")
+
+    timer = Timer()
+    perItem = {}
+
+    klines = getSyntheticData(numOfKlines, seed)
+
+    if withCsv:
+        with tempfile.TemporaryDirectory() as tmpDir:
+            csvPath = os.path.join(tmpDir, "synthetic-1m.csv")
+            writeBinanceCsv(klines, csvPath)
+
+            with timer.stage("loadCsv"):
+                getCryptoDataBinance(csvPath, useCache=False)
+
+            # the first cached load writes the cache, the second one is the one that gets timed
+            with contextlib.redirect_stdout(io.StringIO()):
+                getCryptoDataBinance(csvPath)
+            with timer.stage("loadCache"):
+                getCryptoDataBinance(csvPath)
+
+    numOfSim = min(simKlines, numOfKlines // 10)
+    trainKlines = klines[:numOfKlines - numOfSim]
+    simKlinesStore = klines[numOfKlines - numOfSim:]
+
+    with timer.stage("extractDataPoints"):
+        trainFeatures = Knn.extractDataPoints(trainKlines)
+    simFeatures = Knn.extractDataPoints(simKlinesStore)
+
+    for indexName in indexes:
+        params = dict(knnParams, index=indexName)
+
+        with timer.stage("placeDpInGrid" if indexName == "grid" else f"build {indexName}"):
+            index = buildIndex(trainFeatures[0], trainFeatures[1], params)
+
+        with index, timer.stage(f"queries {indexName}" if indexName != "grid" else "queries"):
+            index.queryBatch(simFeatures[0], params["k"], params.get("blockSize"))
+
+        queryStage = f"queries {indexName}" if indexName != "grid" else "queries"
+        perItem[queryStage] = round(timer.stages[queryStage] / max(numOfSim, 1) * 1e6, 3)
+
+    with timer.stage("simulateOutcomes"):
+        simulateOutcomes(trainKlines, positionParams)
+
+    # the outcome table gets cached in ./klineData, so the knn is built in a temporary folder
+    with tempfile.TemporaryDirectory() as tmpDir, contextlib.redirect_stdout(io.StringIO()):
+        currentDir = os.getcwd()
+        os.chdir(tmpDir)
+        try:
+            knn = Knn(trainKlines, simKlinesStore, knnParams=knnParams, positionParams=positionParams,
+                      trainFeatures=trainFeatures, simFeatures=simFeatures)
+            knn.simKnn = knn.getKnnBatch(knn.simDataPoints)
+        finally:
+            os.chdir(currentDir)
+
+    try:
+        neighbours = knn.simKnn[0][knn.simKnn[0] != -1].tolist()
+        with timer.stage("simulatePosition"):
+            for index in neighbours:
+                knn.simulatePosition({"index": index, "distance": 0})
+        perItem["simulatePosition"] = round(timer.stages["simulatePosition"] / max(len(neighbours), 1) * 1e6, 3)
+
+        with timer.stage("runBacktest"):
+            VectorBacktest(simKlinesStore, knn)
+        perItem["runBacktest"] = round(timer.stages["runBacktest"] / max(numOfSim, 1) * 1e6, 3)
+
+        loopKlines = simKlinesStore[:loopBacktestKlines]
+        with timer.stage("runBacktestLoop"):
+            Backtest(loopKlines, knn)
+        perItem["runBacktestLoop"] = round(timer.stages["runBacktestLoop"] / max(len(loopKlines), 1) * 1e6, 3)
+    finally:
+        # the sharded index has processes to stop
+        knn.close()
+
+    return {
+        "klines": numOfKlines,
+        "trainKlines": len(trainKlines),
+        "simKlines": numOfSim,
+        "loopBacktestKlines": len(loopKlines),
+        "stages": timer.stages,
+        "perItem": perItem
+    }
+
+
+def getRevision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmark(sizes=(10000, 100000, 1000000), seed=0, outputPath="benchmarkResults.json", **kwargs):
+    """
+    Runs benchmarkSize for every size and writes the results (with the info of the machine) in a json file
+
+    :param kwargs:  passed to benchmarkSize
+    :return:        the results
+    """
+
+    results = {
+        "revision": getRevision(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": seed,
+        "knnConfig": knnConfig,
+        "positionSimConfig": positionSimConfig,
+        "runs": [benchmarkSize(size, seed, **kwargs) for size in sizes]
+    }
+
+    with open(outputPath, "w") as outputFile:
+        json.dump(results, outputFile, indent=2)
+
+    print(f"\nResults written to {outputPath}")
+
+    return results
+
+
+def compareResults(oldPath, newPath):
+    """
+    Prints the time of every stage of two benchmark results side by side (new / old, lower is better)
+    """
+
+    with open(oldPath) as oldFile, open(newPath) as newFile:
+        old = json.load(oldFile)
+        new = json.load(newFile)
+
+    print(f"{old['revision']} -> {new['revision']}")
+
+    oldRuns = {run["klines"]: run for run in old["runs"]}
+    for newRun in new["runs"]:
+        oldRun = oldRuns.get(newRun["klines"])
+        if oldRun is None:
+            continue
+
+        print(f"\n{newRun['klines']} klines:")
+        for stage, seconds in newRun["stages"].items():
+            if stage not in oldRun["stages"]:
+                continue
+
+            ratio = seconds / oldRun["stages"][stage] if oldRun["stages"][stage] else float("inf")
+            print(f"    {stage:<24} {oldRun['stages'][stage]:>10.4f}s {seconds:>10.4f}s {ratio:>8.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of every stage of a backtest on synthetic klines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="numbers of klines (10k up to 10M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--indexes", nargs="+", default=["grid"], help="spatial indexes to time")
+    parser.add_argument("--sim-klines", type=int, default=20000, help="max number of sim klines")
+    parser.add_argument("--loop-klines", type=int, default=2000, help="sim klines of the kline by kline backtest")
+    parser.add_argument("--no-csv", action="store_true", help="don't time the csv loading (slow on big sizes)")
+    parser.add_argument("--output", default="benchmarkResults.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results instead")
+    args = parser.parse_args()
+
+    if args.compare:
+        compareResults(*args.compare)
+    else:
+        runBenchmark(
+            args.sizes, args.seed, args.output, indexes=args.indexes, simKlines=args.sim_klines,
+            loopBacktestKlines=args.loop_klines, withCsv=not args.no_csv
+        )
@@ -3,11 +3,11 @@ The main body of the bot, where everything will be run from
 """
 
 import matplotlib.pyplot as plt
-import pickle
 
 from decisionMaker import Knn
 from dataGetter import getCryptoDataBinance
 from tradingClasses import Backtest
+from tradeLog import saveBacktest
 
 
 def plotChart(chart, extraSeries=(), dataPoints=((),)):
@@ -57,8 +57,8 @@ if __name__ == '__main__':
     brain = Knn(trainKlines, simKlines)
     backtest = Backtest(simKlines, brain, maxOpenPositions=1)
 
-    with open("backtest.pickle", "wb") as pickleFile:
-        pickle.dump(backtest, pickleFile)
+    # only the results (trade log, equity curve, stats and sim klines), load them back with tradeLog.loadBacktest
+    saveBacktest(backtest, "backtest.npz")
 
     print(backtest)
     backtest.plot()
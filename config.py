@@ -19,8 +19,17 @@ knnConfig = {
     "k": 5,
     # "threshold": 0.000001,    # forex
     "threshold": 1,
-    "sameDirectionRatio": 1
+    "sameDirectionRatio": 1,
     # "sameDirectionRatio": 1
+    "index": "grid",    # the spatial index used to find the nn: "grid", "kdtree", "brute", "ivf" (approximate) or "sharded"
+    "shards": None,     # only for "sharded": number of shard processes (None: one per cpu)
+    "shardIndex": "kdtree",     # only for "sharded": the index of each shard
+    "probes": 8,    # only for "ivf": how many lists are compared for each query (more = more accurate but slower)
+    "precision": "float64",     # how the index stores the training dataPoints: "float64", "float32" or "int16" (fixed point)
+    "normalization": None,     # None, "zscore" or "quantile": fitted on the train dataPoints (the threshold is in its unit)
+    "cellSize": "threshold",    # only for "grid": "threshold" or "adaptive" (smaller cells where the dataPoints are dense)
+    "metric": "euclidean",  # "euclidean", "squaredEuclidean", "manhattan" or "lorentzian" (the threshold is in its unit)
+    "blockSize": 2 ** 22    # max number of distances calculated at once by the batch queries
 }
 
 
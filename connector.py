@@ -0,0 +1,415 @@
+"""
+Asyncio kline stream connector, with a local replay server to test it.
+
+The messages are json lines over tcp, with the kline in the same fields as the Binance kline stream
+({"e": "kline", "E": event time, "k": {"t": open time, "o": ..., "h": ..., "l": ..., "c": ..., "v": ..., "x": closed}}),
+so a connector for the real stream only has to change the transport.
+
+	requests (client -> server):	{"method": "subscribe"}
+									{"method": "klines", "startTime": ..., "endTime": ...}	(backfill, both included)
+	responses (server -> client):	a kline message per kline, {"result": [klines]} for a backfill
+
+KlineConnector reads the stream, reconnects when the connection drops, backfills the klines that were missed
+(the gaps in the open times) and hands the closed klines, in order and without duplicates, to a handler
+(for example LiveKnn.onKline). The handler runs in a worker thread, so a slow decision never blocks the reading.
+
+ReplayServer streams a stored kline file (csv or .klines) at any speed, and can drop klines or connections
+on purpose. replayBenchmark runs both, to measure the throughput and the end to end latency offline:
+	python connector.py --file ./klineData/binanceData/BTCUSDT-1m-2023.csv --train 500000 --speed 0
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from dataGetter import getCryptoDataBinance
+
+
+# the short names of the kline values in the messages
+messageKeys = {"timestamp": "t", "open": "o", "high": "h", "low": "l", "close": "c", "volume": "v"}
+
+
+def klineToMessage(kline, eventTime=None, closed=True):
+	"""
+	:param kline:		dict or Kline
+	:param eventTime:	time the message is sent (time.time()), used to measure the latency
+	"""
+
+	message = {key: kline[column] for column, key in messageKeys.items()}
+	message["t"] = int(message["t"])
+	message["x"] = closed
+
+	return {"e": "kline", "E": time.time() if eventTime is None else eventTime, "k": message}
+
+
+def messageToKline(message):
+	"""
+	:return:	kline dict (with the klineColumns keys)
+	"""
+
+	return {column: message[key] for column, key in messageKeys.items()}
+
+
+class ReplayServer:
+	def __init__(self, klines, speed=1.0, interval=None, host="127.0.0.1", port=0, dropRate=0.0,
+				 disconnectEvery=None, backfillLimit=1000, seed=0):
+		"""
+		Streams the klines to every subscriber as if they were closing live (a local stand-in for an exchange)
+
+		:param klines:			KlineStore with the klines to replay
+		:param speed:			replay speed (1: real time, 60: a 1m kline every second, 0: as fast as possible)
+		:param interval:		kline length in the unit of the timestamps (default: the first step)
+		:param port:			0 picks a free port (see self.port once started)
+		:param dropRate:		fraction of klines that are not sent to a subscriber (to test the backfill)
+		:param disconnectEvery:	the subscribers are disconnected after this many klines (to test the reconnects)
+		:param backfillLimit:	max klines sent for a backfill request (like the 1000 of the Binance api)
+		"""
+
+		self.klines = klines
+		self.speed = speed
+		self.interval = interval or int(klines.timestamp[1] - klines.timestamp[0])
+		self.host = host
+		self.port = port
+		self.dropRate = dropRate
+		self.disconnectEvery = disconnectEvery
+		self.backfillLimit = backfillLimit
+		self.random = random.Random(seed)
+
+		self.server = None
+		# index of the next kline to close, shared by every subscriber
+		self.clock = 0
+		self.clockTask = None
+		self.clockChanged = asyncio.Event()
+
+	@staticmethod
+	def fromFile(filePath, **kwargs):
+		"""
+		ReplayServer of a stored kline file (Binance csv or .klines store)
+		"""
+
+		return ReplayServer(getCryptoDataBinance(filePath), **kwargs)
+
+	async def start(self):
+		self.server = await asyncio.start_server(self.handleClient, self.host, self.port)
+		self.port = self.server.sockets[0].getsockname()[1]
+		self.clockTask = asyncio.create_task(self.runClock())
+
+	async def stop(self):
+		self.clockTask.cancel()
+		self.server.close()
+		await self.server.wait_closed()
+
+	async def runClock(self):
+		"""
+		Closes the klines one after the other, at the replay speed
+		"""
+
+		start = time.perf_counter()
+		secondsPerKline = self.interval / 1000 / self.speed if self.speed else 0
+
+		while self.clock < len(self.klines):
+			if secondsPerKline:
+				await asyncio.sleep(max(0.0, start + (self.clock + 1) * secondsPerKline - time.perf_counter()))
+				self.clock += 1
+			else:
+				# as fast as possible, but still letting the subscribers keep up
+				self.clock = min(self.clock + 64, len(self.klines))
+				await asyncio.sleep(0)
+
+			self.clockChanged.set()
+			self.clockChanged = asyncio.Event()
+
+	async def handleClient(self, reader, writer):
+		try:
+			request = json.loads(await reader.readline())
+
+			if request.get("method") == "klines":
+				await self.sendBackfill(writer, request["startTime"], request["endTime"])
+			elif request.get("method") == "subscribe":
+				await self.sendStream(reader, writer)
+		except (ConnectionError, json.JSONDecodeError):
+			pass
+		finally:
+			writer.close()
+
+	async def sendBackfill(self, writer, startTime, endTime):
+		# only the klines that are already closed
+		timestamps = self.klines.timestamp[:self.clock]
+		start = int(np.searchsorted(timestamps, startTime, side="left"))
+		end = min(int(np.searchsorted(timestamps, endTime, side="right")), start + self.backfillLimit)
+
+		result = [klineToMessage(self.klines[i])["k"] for i in range(start, end)]
+		writer.write(json.dumps({"result": result}).encode() + b"\n")
+		await writer.drain()
+
+	async def sendStream(self, reader, writer):
+		# a new subscriber gets the last closed kline right away, so it knows what it missed
+		position = max(self.clock - 1, 0)
+		sent = 0
+
+		while position < len(self.klines):
+			if position >= self.clock:
+				await self.clockChanged.wait()
+				continue
+
+			lines = []
+			for i in range(position, self.clock):
+				# the last kline is always sent, a gap is only noticed with the kline after it
+				if self.dropRate and i < len(self.klines) - 1 and self.random.random() < self.dropRate:
+					continue
+				lines.append(json.dumps(klineToMessage(self.klines[i])).encode() + b"\n")
+
+				sent += 1
+				if self.disconnectEvery and sent >= self.disconnectEvery:
+					break
+
+			position = i + 1
+
+			writer.writelines(lines)
+			await writer.drain()
+
+			if self.disconnectEvery and sent >= self.disconnectEvery:
+				return
+
+		# the replay is over, but the stream stays open (until the subscriber leaves), like a live one would
+		await reader.read()
+
+
+class KlineConnector:
+	def __init__(self, host, port, onKline, interval, lastTimestamp=None, reconnectDelay=0.1, maxReconnectDelay=10,
+				 queueSize=10000):
+		"""
+		:param onKline:			function called with every closed kline (dict), in order, in a worker thread
+		:param interval:		kline length in the unit of the timestamps, to find the gaps
+		:param lastTimestamp:	open time of the last kline the handler already has (the gap after it gets backfilled)
+		:param reconnectDelay:	seconds before the first reconnect, doubled after every failed one
+		:param queueSize:		max closed klines waiting for the handler, the reading waits when it's full
+		"""
+
+		self.host = host
+		self.port = port
+		self.onKline = onKline
+		self.interval = interval
+		self.lastTimestamp = lastTimestamp
+		self.reconnectDelay = reconnectDelay
+		self.maxReconnectDelay = maxReconnectDelay
+
+		self.queue = asyncio.Queue(queueSize)
+		self.stopped = False
+
+		self.stats = {
+			"klines": 0,
+			"backfilled": 0,
+			"duplicates": 0,
+			"reconnects": 0,
+			"latencies": []
+		}
+
+	async def run(self, numOfKlines=None):
+		"""
+		Reads the stream and handles the klines, until stop() is called or numOfKlines klines have been handled
+		"""
+
+		handling = asyncio.create_task(self.handleKlines(numOfKlines))
+		reading = asyncio.create_task(self.readStream())
+
+		try:
+			await asyncio.wait((handling, reading), return_when=asyncio.FIRST_COMPLETED)
+
+			# the reading only ends by itself with an error
+			if reading.done():
+				handling.cancel()
+				reading.result()
+
+			await handling
+		finally:
+			self.stopped = True
+			reading.cancel()
+			await asyncio.gather(reading, return_exceptions=True)
+
+	def stop(self):
+		self.stopped = True
+
+		# the klines that are still queued are dropped, so there is always room for the None that ends the handling
+		while not self.queue.empty():
+			self.queue.get_nowait()
+		self.queue.put_nowait(None)
+
+	async def readStream(self):
+		delay = self.reconnectDelay
+
+		while not self.stopped:
+			try:
+				reader, writer = await asyncio.open_connection(self.host, self.port)
+			except OSError:
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, self.maxReconnectDelay)
+				continue
+
+			delay = self.reconnectDelay
+
+			try:
+				writer.write(json.dumps({"method": "subscribe"}).encode() + b"\n")
+				await writer.drain()
+
+				while not self.stopped:
+					line = await reader.readline()
+					if not line:
+						break
+
+					message = json.loads(line)
+					if message.get("e") == "kline" and message["k"]["x"]:
+						await self.addKline(messageToKline(message["k"]), message["E"])
+			except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError):
+				# a broken line is handled like a dropped connection, the reconnection backfills what it had
+				pass
+			finally:
+				writer.close()
+
+			if not self.stopped:
+				self.stats["reconnects"] += 1
+				await asyncio.sleep(delay)
+
+	async def addKline(self, kline, eventTime):
+		"""
+		Queues the kline for the handler, after backfilling the klines missing before it
+		"""
+
+		timestamp = kline["timestamp"]
+
+		if self.lastTimestamp is not None:
+			if timestamp <= self.lastTimestamp:
+				self.stats["duplicates"] += 1
+				return
+
+			if timestamp > self.lastTimestamp + self.interval:
+				for missing in await self.backfill(self.lastTimestamp + self.interval, timestamp - self.interval):
+					if missing["timestamp"] > self.lastTimestamp:
+						self.stats["backfilled"] += 1
+						self.lastTimestamp = missing["timestamp"]
+						await self.queue.put((missing, None))
+
+		self.lastTimestamp = timestamp
+		await self.queue.put((kline, eventTime))
+
+	async def backfill(self, startTime, endTime):
+		"""
+		:return:	the closed klines from startTime to endTime (open times, both included)
+		"""
+
+		klines = []
+
+		# the server sends at most backfillLimit klines per request
+		while startTime <= endTime:
+			reader, writer = await asyncio.open_connection(self.host, self.port, limit=2 ** 24)
+			try:
+				writer.write(json.dumps({"method": "klines", "startTime": startTime, "endTime": endTime}).encode() + b"\n")
+				await writer.drain()
+
+				result = json.loads(await reader.readline())["result"]
+			finally:
+				writer.close()
+
+			if not result:
+				break
+
+			klines.extend(messageToKline(message) for message in result)
+			startTime = klines[-1]["timestamp"] + self.interval
+
+		return klines
+
+	async def handleKlines(self, numOfKlines=None):
+		loop = asyncio.get_running_loop()
+
+		while numOfKlines is None or self.stats["klines"] < numOfKlines:
+			item = await self.queue.get()
+			if item is None:
+				return
+
+			kline, eventTime = item
+			await loop.run_in_executor(None, self.onKline, kline)
+
+			self.stats["klines"] += 1
+			# the backfilled klines have no event time, their latency doesn't say much
+			if eventTime is not None:
+				self.stats["latencies"].append(time.time() - eventTime)
+
+	def report(self, seconds):
+		latencies = np.array(self.stats["latencies"]) * 1000
+
+		lines = [
+			"",
+			"CONNECTOR",
+			"",
+			f"klines:         {self.stats['klines']}",
+			f"backfilled:     {self.stats['backfilled']}",
+			f"duplicates:     {self.stats['duplicates']}",
+			f"reconnects:     {self.stats['reconnects']}",
+			f"throughput:     {self.stats['klines'] / max(seconds, 1e-9):.1f} klines/s"
+		]
+
+		if len(latencies):
+			lines.append(f"latency:        mean {latencies.mean():.3f} ms, p50 {np.percentile(latencies, 50):.3f} ms, "
+						 f"p99 {np.percentile(latencies, 99):.3f} ms, max {latencies.max():.3f} ms")
+
+		return "\n".join(lines) + "\n"
+
+
+async def replayBenchmark(klines, onKline, speed=0, lastTimestamp=None, **serverParams):
+	"""
+	Replays the klines with a local ReplayServer into a KlineConnector, and measures the throughput and the latency
+	(from the moment a kline is sent to the moment the handler is done with it)
+
+	:param onKline:			the handler of the klines (for example LiveKnn(...).onKline)
+	:param lastTimestamp:	open time of the kline before the first one (the first kline isn't a gap)
+	:param serverParams:	passed to ReplayServer (dropRate, disconnectEvery, ...)
+	:return:				the connector (with its stats)
+	"""
+
+	server = ReplayServer(klines, speed, **serverParams)
+	await server.start()
+
+	connector = KlineConnector(server.host, server.port, onKline, server.interval, lastTimestamp)
+
+	start = time.perf_counter()
+	try:
+		await connector.run(len(klines))
+	finally:
+		await server.stop()
+	seconds = time.perf_counter() - start
+
+	print(connector.report(seconds))
+
+	return connector
+
+
+if __name__ == '__main__':
+	from decisionMaker import Knn
+	from liveMode import LiveKnn
+
+	parser = argparse.ArgumentParser(description="Replays a kline file through the connector into LiveKnn")
+	parser.add_argument("--file", default="./klineData/binanceData/BTCUSDT-1m-2023.csv", help="csv or .klines file")
+	parser.add_argument("--train", type=int, default=500000, help="number of training klines (the rest are replayed)")
+	parser.add_argument("--klines", type=int, default=None, help="max number of replayed klines")
+	parser.add_argument("--speed", type=float, default=0, help="1: real time, 0: as fast as possible")
+	parser.add_argument("--drop-rate", type=float, default=0, help="fraction of klines the server doesn't send")
+	parser.add_argument("--disconnect-every", type=int, default=None, help="klines before the server disconnects")
+	args = parser.parse_args()
+
+	allKlines = getCryptoDataBinance(args.file)
+	trainKlines = allKlines[:args.train]
+	replayKlines = allKlines[args.train:] if args.klines is None else allKlines[args.train:args.train + args.klines]
+
+	live = LiveKnn(Knn(trainKlines))
+	live.warmUp(trainKlines[-10:])
+
+	asyncio.run(replayBenchmark(
+		replayKlines, live.onKline, args.speed, int(trainKlines.timestamp[-1]),
+		dropRate=args.drop_rate, disconnectEvery=args.disconnect_every
+	))
+
+	print(live)
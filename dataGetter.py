@@ -1,67 +1,156 @@
 """
 This file will contain only functions that get data from their data source and return
-the usable JSON format
+the usable columnar format (KlineStore)
+
+The parsed files are cached in a binary format next to the source file (see klineStore.py),
+so only the first load of a file has to parse it. The same goes for the klines resampled to another timeframe
+(see resample.py).
 
 swiss site link: 	https://www.dukascopy.com/swiss/english/fx-market-tools/historical-data/
 binance link:		https://www.binance.com/en/landing/data
 """
 
-import csv
-from datetime import datetime, timezone, timedelta
+import numpy as np
 
+from klineStore import KlineStore, parseKlineCsv, loadCached, loadKlineCache, cacheExtension
+from resample import loadTimeframe
 
-def getForexDataSwissSite(filePath="./klineData/swissSiteData/EURUSD_Candlestick_15_M_BID_01.01.2022-01.01.2023.csv"):
-	print(f"Getting data from {filePath}")
 
-	klines = []
+def getForexDataSwissSite(filePath="./klineData/swissSiteData/EURUSD_Candlestick_15_M_BID_01.01.2022-01.01.2023.csv", useCache=True, timeframe=None):
+	"""
+	:param timeframe:	resample the klines to this timeframe ("1h", "4h", ...), None for the one of the file
+	"""
 
-	with open(filePath, "r") as csvFile:
-		csvReader = csv.reader(csvFile)
-		# skip first row
-		next(csvReader)
-		# time, Open, High, Low, Close, Volume
-		for row in csvReader:
-			dt = datetime.strptime(row[0], "%d.%m.%Y %H:%M:%S.%f %Z%z")
-			timestamp = (dt - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(seconds=1)
+	print(f"Getting data from {filePath}")
 
-			kline = {
-				"timestamp": timestamp,
-				"open": float(row[1]),
-				"high": float(row[2]),
-				"low": float(row[3]),
-				"close": float(row[4]),
-				"volume": float(row[5])
-			}
+	def loadBase():
+		return loadCached(filePath, parseSwissSiteCsv, useCache)
 
-			klines.append(kline)
+	# the timestamps are in seconds
+	klines = loadBase() if timeframe is None else loadTimeframe(filePath, loadBase, timeframe, 1, useCache)
 
 	print("Done!\n")
 
 	return klines
 
 
-def getCryptoDataBinance(filePath="./klineData/binanceData/BTCUSDT-1m-2023.csv"):
+def getCryptoDataBinance(filePath="./klineData/binanceData/BTCUSDT-1m-2023.csv", useCache=True, timeframe=None):
+	"""
+	:param filePath:	a Binance csv, or a store written by ingest.py (.klines)
+	:param timeframe:	resample the klines to this timeframe ("5m", "15m", "1h", "4h", ...), None for the one of the file
+	"""
+
 	print(f"Getting data from {filePath}")
 
-	klines = []
+	def loadBase():
+		if filePath.endswith(cacheExtension):
+			# a store written by ingest.py
+			klines = loadKlineCache(filePath)
+			if klines is None:
+				raise Exception(f"{filePath} is not a kline store!")
+
+			return klines
 
-	with open(filePath, "r") as csvFile:
-		csvReader = csv.reader(csvFile)
-		# skip first row
-		next(csvReader)
 		# time, Open, High, Low, Close, Volume
-		for row in csvReader:
-			kline = {
-				"timestamp": int(row[0]),
-				"open": float(row[1]),
-				"high": float(row[2]),
-				"low": float(row[3]),
-				"close": float(row[4]),
-				"volume": float(row[5])
-			}
-
-			klines.append(kline)
+		return loadCached(filePath, parseKlineCsv, useCache)
+
+	klines = loadBase() if timeframe is None else loadTimeframe(filePath, loadBase, timeframe, 1000, useCache)
 
 	print("Done!\n")
 
 	return klines
+
+
+def getSyntheticData(numOfKlines, seed=0, startPrice=30000, volatility=0.0008, interval=60000, startTimestamp=1672531200000):
+	"""
+	Generates random walk klines (for benchmarks and tests, when there's no real data at hand).
+	The same seed always gives the same klines.
+
+	:param numOfKlines:		number of klines
+	:param volatility:		standard deviation of the log return of each kline
+	:param interval:		milliseconds between the klines (default: 1m)
+	:param startTimestamp:	timestamp of the first kline (default: 2023-01-01)
+	:return:				KlineStore
+	"""
+
+	rng = np.random.default_rng(seed)
+
+	close = startPrice * np.exp(np.cumsum(rng.normal(0, volatility, numOfKlines)))
+	openPrice = np.concatenate(([startPrice], close[:-1]))
+
+	# the wicks go a bit further than the body
+	high = np.maximum(openPrice, close) * (1 + np.abs(rng.normal(0, volatility / 2, numOfKlines)))
+	low = np.minimum(openPrice, close) * (1 - np.abs(rng.normal(0, volatility / 2, numOfKlines)))
+
+	return KlineStore({
+		"timestamp": startTimestamp + interval * np.arange(numOfKlines, dtype=np.int64),
+		"open": openPrice,
+		"high": high,
+		"low": low,
+		"close": close,
+		"volume": rng.gamma(2, 10, numOfKlines)
+	})
+
+
+def parseDukascopyDates(dates):
+	"""
+	Converts the Dukascopy dates to epoch seconds, all at once.
+	The dates are "DD.MM.YYYY HH:MM:SS.fff GMT+hhmm" (the offset of the local time), or the same without
+	the timezone for the files in GMT. The milliseconds are dropped.
+
+	:param dates:	array of the dates (str or bytes)
+	:return:		int64 array of epoch seconds
+	"""
+
+	dates = np.asarray(dates).astype("S32")
+	if not len(dates):
+		return np.zeros(0, dtype=np.int64)
+
+	# one row of characters per date, as numbers (digit - "0")
+	chars = dates.view(np.uint8).reshape(len(dates), 32).astype(np.int64)
+	digits = chars - ord("0")
+
+	def number(start, end):
+		value = np.zeros(len(dates), dtype=np.int64)
+		for column in range(start, end):
+			value = value * 10 + digits[:, column]
+		return value
+
+	digitColumns = [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]
+	if not ((digits[:, digitColumns] >= 0) & (digits[:, digitColumns] <= 9)).all():
+		raise Exception(f"Unknown date format: {dates[0].decode()} (should be DD.MM.YYYY HH:MM:SS.fff GMT+hhmm)")
+
+	day = number(0, 2)
+	month = number(3, 5)
+	year = number(6, 10)
+	seconds = number(11, 13) * 3600 + number(14, 16) * 60 + number(17, 19)
+
+	# days since 1970-01-01 of the proleptic gregorian date (H. Hinnant's days_from_civil)
+	year = year - (month <= 2)
+	era = year // 400
+	yearOfEra = year - era * 400
+	dayOfYear = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+	dayOfEra = yearOfEra * 365 + yearOfEra // 4 - yearOfEra // 100 + dayOfYear
+	days = era * 146097 + dayOfEra - 719468
+
+	# the "+hhmm" after "GMT", the dates without it are already in GMT
+	hasOffset = chars[:, 27] != 0
+	sign = np.where(chars[:, 27] == ord("-"), -1, 1)
+	offset = np.where(hasOffset, sign * (number(28, 30) * 3600 + number(30, 32) * 60), 0)
+
+	return days * 86400 + seconds - offset
+
+
+def parseSwissSiteCsv(filePath):
+	# time, Open, High, Low, Close, Volume
+	rows = np.loadtxt(filePath, delimiter=",", skiprows=1, dtype="S32", ndmin=2)
+	values = rows[:, 1:6].astype(np.float64)
+
+	return KlineStore({
+		"timestamp": parseDukascopyDates(rows[:, 0]),
+		"open": values[:, 0],
+		"high": values[:, 1],
+		"low": values[:, 2],
+		"close": values[:, 3],
+		"volume": values[:, 4]
+	})
@@ -3,10 +3,18 @@ The "brains" of the bot, where the decision-making will be made
 Every decisionMaker is a child class od DecisionMaker and must implement the abstract methods.
 """
 
+import time
 import numpy as np
 from abc import abstractmethod
 
 from config import positionSimConfig, knnConfig, actualPositionConfig
+from indicators import extractFeatures
+from instrumentation import instruments
+from klineStore import KlineStore, GrowableArray, klineColumns
+from metrics import metrics
+from normalization import fitNormalization
+from outcomeTable import OutcomeTable, getOutcomeTable, simulateOutcomes, INCONCLUSIVE
+from spatialIndex import buildIndex, SlidingWindowIndex
 from tradingClasses import Position
 
 
@@ -19,6 +27,27 @@ class DecisionMaker:
 		:return:
 		"""
 
+	def getSignals(self, currentKlines):
+		"""
+		Returns the direction of the predicted position for every kline at once (used by the vectorized backtest).
+		The default just calls getPosition for every kline, decision makers can override it with something faster.
+
+		:param currentKlines:	the simulation klines
+		:return:				(n,) int8 array: 1 (long), -1 (short) or 0 (no position), the position would be
+								entered at the open of the next kline
+		"""
+
+		signals = np.zeros(len(currentKlines), dtype=np.int8)
+
+		# the last kline has no next kline to enter the position in
+		for klineIndex in range(len(currentKlines) - 1):
+			predictedPos = self.getPosition(currentKlines, klineIndex)["predicted"]
+
+			if predictedPos is not None:
+				signals[klineIndex] = predictedPos.direction
+
+		return signals
+
 
 def sma(klines, index, interval, klineValue="close"):
 	"""
@@ -62,20 +91,35 @@ def cci(klines, index, interval=20):
 	if index < interval - 1:
 		return None
 
-	typicalPriceTot = 0
-	movingAverage = 0
-	meanDeviation = 0
+	typicalPrices = []
 	for i in range(interval):
-		typicalPrice = (klines[index - i]["high"] + klines[index - i]["low"] + klines[index - i]["close"]) / 3
-		typicalPriceTot += typicalPrice
+		typicalPrices.append((klines[index - i]["high"] + klines[index - i]["low"] + klines[index - i]["close"]) / 3)
+
+	movingAverage = sum(typicalPrices) / interval
+	meanDeviation = sum([abs(typicalPrice - movingAverage) for typicalPrice in typicalPrices]) / interval
 
-	return (typicalPriceTot - movingAverage) / (0.015 * meanDeviation)
+	if meanDeviation == 0:
+		return 0
+
+	return (typicalPrices[0] - movingAverage) / (0.015 * meanDeviation)
 
 
 def rsi(klines, index, interval=14):
 	pass
 
 
+def pointDistance(metricName, a, b):
+	"""
+	Distance of two points with one of the metrics of metrics.py
+	(to compare many points at once, use the metric directly)
+	"""
+
+	if len(a) != len(b):
+		raise Exception("The two points must have the same length")
+
+	return float(metrics[metricName].fromDifferences(np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64))))
+
+
 def euclideanDistance(a, b):
 	"""
 	Returns the Euclidean distance of the two given points.
@@ -85,15 +129,7 @@ def euclideanDistance(a, b):
 	:return:
 	"""
 
-	if len(a) != len(b):
-		raise Exception("The two points must have the same length")
-
-	dist = 0
-
-	for i in range(len(a)):
-		dist += (a[i] - b[i]) ** 2
-
-	return np.sqrt(dist)
+	return pointDistance("euclidean", a, b)
 
 
 def euclideanSquaredDist(a, b):
@@ -107,15 +143,7 @@ def euclideanSquaredDist(a, b):
 	:return:
 	"""
 
-	if len(a) != len(b):
-		raise Exception("The two points must have the same length")
-
-	dist = 0
-
-	for i in range(len(a)):
-		dist += (a[i] - b[i]) ** 2
-
-	return dist
+	return pointDistance("squaredEuclidean", a, b)
 
 
 def lorentzianDistStolen(a, b):
@@ -128,17 +156,21 @@ def lorentzianDistStolen(a, b):
 	:return:
 	"""
 
-	A = np.array(a)
-	B = np.array(b)
-
-	tmp = np.sum(np.log(1 + np.abs(A - B)))
-	return tmp
+	return pointDistance("lorentzian", a, b)
 
 
 class Knn(DecisionMaker):
-	def __init__(self, trainKlines: list, simKlines: list, knnParams=knnConfig, positionParams=positionSimConfig):
+	def __init__(self, trainKlines: list, simKlines: list = None, knnParams=knnConfig, positionParams=positionSimConfig,
+				 actualPositionParams=actualPositionConfig, trainFeatures=None, simFeatures=None, intrabar=None):
 		"""
 		:param trainKlines:
+		:param simKlines: the klines of the backtest, None in live mode (see liveMode.py)
+		:param knnParams: the parameters of the knn (see knnConfig)
+		:param actualPositionParams: sl and tp of the predicted positions
+		:param trainFeatures: already calculated (dataPoints, valid) of the train klines (optional)
+		:param simFeatures: already calculated (dataPoints, valid) of the sim klines (optional)
+		:param intrabar: IntrabarResolver of the train klines, to resolve the simulated positions that hit
+			two levels in the same kline with the lower timeframe (optional, see intrabar.py)
 		:param positionParams: the parameters of the simulated positions
 			"sl": stop loss of the position
 			"tp": take profit of the position
@@ -158,14 +190,59 @@ class Knn(DecisionMaker):
 				This of course would limit the number of positions, but maybe the profit factor would increase.
 		"""
 
+		self.knnParams = knnParams
+		self.positionParams = positionParams
+		self.actualPositionParams = actualPositionParams
+
+		if not isinstance(trainKlines, KlineStore):
+			trainKlines = KlineStore.fromRows(trainKlines)
+
 		self.trainKlines = trainKlines
-		self.trainDataPoints = self.extractDataPoints(self.trainKlines)
-		self.gridDataPoints = self.placeDpInGrid(self.trainDataPoints)
+		ownFeatures = trainFeatures is None
+		if ownFeatures:
+			trainFeatures = self.extractDataPoints(self.trainKlines)
+		self.trainDataPoints, self.trainValid = trainFeatures
+		self.normalization = fitNormalization(
+			self.knnParams.get("normalization"), self.trainDataPoints[self.trainValid]
+		)
+		self.index = buildIndex(self.normalize(self.trainDataPoints), self.trainValid, self.knnParams)
 
-		self.simDataPoints = self.extractDataPoints(simKlines)
+		if ownFeatures and self.knnParams.get("precision", "float64") != "float64":
+			# the index has its own copy of the points, this one doesn't need more precision than that
+			self.trainDataPoints = self.trainDataPoints.astype(np.float32)
 
-		self.knnParams = knnParams
-		self.positionParams = positionParams
+		self.outcomes = getOutcomeTable(self.trainKlines, self.positionParams, intrabar=intrabar)
+
+		self.setSimKlines(simKlines, simFeatures)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+	def close(self):
+		"""
+		Frees the index, with the sharded index it stops its processes and frees the shared memory
+		"""
+
+		if self.index is not None:
+			self.index.close()
+
+	def setSimKlines(self, simKlines, simFeatures=None):
+		"""
+		Sets the simulation klines, so the same knn can be backtested on different klines (see walkForward.py)
+
+		:param simKlines:	the klines of the backtest, None in live mode
+		:param simFeatures:	already calculated (dataPoints, valid) of the sim klines (optional)
+		"""
+
+		if simFeatures is None and simKlines is not None:
+			simFeatures = self.extractDataPoints(simKlines)
+		self.simDataPoints, self.simValid = simFeatures if simFeatures is not None else (None, None)
+
+		# the knn of every sim dataPoint, calculated in one batch the first time they are needed
+		self.simKnn = None
 
 	def getPosition(self, currentKlines, currentKlineIndex):
 		"""
@@ -176,8 +253,27 @@ class Knn(DecisionMaker):
 		:return: 					{"predicted": position, "considered": []}
 		"""
 
+		if currentKlineIndex + 1 >= len(currentKlines):
+			# there is no next kline to enter the position in
+			return {"predicted": None, "considered": None}
+
 		# get the knn for the last kline
-		knn = self.getKnnGrid(self.simDataPoints[currentKlineIndex])
+		knn = self.getSimKnn(currentKlineIndex)
+
+		return self.predictPosition(knn, currentKlineIndex + 1, currentKlines[currentKlineIndex + 1]["open"])
+
+	def predictPosition(self, knn, entryIndex, entryPrice):
+		"""
+		Decides the position from the knn of a dataPoint (shared by the backtest and the live mode)
+
+		:param knn:			the knn of the dataPoint (see getKnn)
+		:param entryIndex:	index of the kline where the position would be entered
+		:param entryPrice:	price the position would be entered at
+		:return:			{"predicted": position, "considered": []}
+		"""
+
+		if instruments.enabled:
+			instruments.count("position predictions")
 
 		if not knn:
 			# the knn list is empty
@@ -227,15 +323,15 @@ class Knn(DecisionMaker):
 		else:
 			return {"predicted": None, "considered": consideredPos}
 
-		if ratio >= knnConfig["sameDirectionRatio"]:
+		if ratio >= self.knnParams["sameDirectionRatio"]:
 			# print("Got a position!")
 			predictedPos = Position(
-				entryIndex=currentKlineIndex + 1, 	# +1 because it's a prediction for the future kline
-				exitIndex=None, 					# we don't know
-				entryPrice=currentKlines[currentKlineIndex + 1]["open"],
+				entryIndex=entryIndex, 	# it's a prediction for the future kline
+				exitIndex=None, 		# we don't know
+				entryPrice=entryPrice,
 				direction=direction,
-				sl=actualPositionConfig["sl"],
-				tp=actualPositionConfig["tp"],
+				sl=self.actualPositionParams["sl"],
+				tp=self.actualPositionParams["tp"],
 				slPrice=None,
 				tpPrice=None,
 				exitPrice=None
@@ -246,6 +342,55 @@ class Knn(DecisionMaker):
 
 		return {"predicted": predictedPos, "considered": consideredPos}
 
+	def getSignals(self, currentKlines):
+		"""
+		Same decisions as getPosition, but for all the sim klines at once, using the batch knn and the outcome table
+
+		:param currentKlines:	the simulation klines (the ones the sim dataPoints were calculated on)
+		:return:				(n,) int8 array: 1 (long), -1 (short) or 0 (no position)
+		"""
+
+		if self.simKnn is None:
+			self.simKnn = self.getKnnBatch(self.simDataPoints)
+
+		if instruments.enabled:
+			start = time.perf_counter()
+
+		indexes, distances = self.simKnn
+		signals = np.zeros(len(indexes), dtype=np.int8)
+
+		found = indexes[:, 0] != -1
+
+		# mean distance, summed in the same order as in getPosition
+		totDistance = np.zeros(len(distances))
+		for column in range(distances.shape[1]):
+			totDistance = totDistance + distances[:, column]
+		acceptable = found & (totDistance / distances.shape[1] <= self.knnParams["threshold"])
+
+		# the outcome of the simulated position of each nn
+		directions = self.outcomes.direction[np.where(acceptable[:, None], indexes, 0)]
+		if instruments.enabled:
+			instruments.count("position simulations", acceptable.sum() * indexes.shape[1])
+		acceptable &= (directions != INCONCLUSIVE).all(axis=1)
+
+		longPosCount = (directions == 1).sum(axis=1)
+		shortPosCount = (directions == -1).sum(axis=1)
+		direction = np.sign(longPosCount - shortPosCount)
+
+		with np.errstate(divide="ignore", invalid="ignore"):
+			ratio = np.maximum(longPosCount, shortPosCount) / (longPosCount + shortPosCount)
+
+		taken = acceptable & (direction != 0) & (ratio >= self.knnParams["sameDirectionRatio"])
+		signals[taken] = direction[taken]
+
+		# the last kline has no next kline to enter the position in
+		signals[len(currentKlines) - 1:] = 0
+
+		if instruments.enabled:
+			instruments.addTime("signals", start)
+
+		return signals
+
 	@staticmethod
 	def extractDataPoints(klines):
 		"""
@@ -284,298 +429,260 @@ class Knn(DecisionMaker):
 				This means that we shouldn't use any data values that can go to infinity as it will fuck up all the
 				nice normalisation that we want.
 
-		:return:
+		The dataPoints are calculated by the vectorized indicators (see indicators.py), for all the klines at once:
+			[price change, sma5 change, smat5 change]
+		Instead of None, the dataPoints that can't be calculated are marked in the valid mask.
+
+		:return:	(dataPoints, valid): (n, d) float matrix and (n,) bool mask
 		"""
-		dataPoints = []
 
-		for i in range(len(klines)):
-			kline = klines[i]
+		return extractFeatures(klines)
 
-			sma5open = sma(klines, i, 5, "open")
-			sma5close = sma(klines, i, 5, "close")
-			smat5open = smaTypical(klines, i, 5)
-			smat5close = smaTypical(klines, i, 5)
+	def normalize(self, dataPoints):
+		"""
+		Applies the normalization fitted on the training dataPoints (see normalization.py), if there is one.
+		The index has the normalized training dataPoints, so every query goes through here.
 
-			try:
-				sma5diff = sma5close - sma5open
-				smat5diff = smat5close - smat5open
-			except TypeError:
-				# the sma is None since there is not enough data
-				sma5diff = None
-				smat5diff = None
+		:param dataPoints:	(d,) or (m, d) float array of features
+		"""
 
-			dp = [
-				kline["close"] - kline["open"], 	# price change
-				sma5diff,  							# sma5 change
-				smat5diff							# smat5 change
-			]
+		if self.normalization is None:
+			return dataPoints
 
-			dataPoints.append(dp)
+		return self.normalization.transform(dataPoints)
 
-		return dataPoints
+	def getKnn(self, dataPoint):
+		"""
+		Returns the k nearest neighbours of the given dataPoint, found with the spatial index
 
-	@staticmethod
-	def placeDpInGrid(dataPoints):
+		:param dataPoint:
+		:return:	[{"distance": distance, "index": trainIndex}, ...] sorted by distance,
+					or None if the dataPoint is not calculated or the index can't find k neighbours
 		"""
-		Returns a dict that represents the buckets of data
-		{(quadrant tuple): [points in quadrant]}
 
-		the problem is that once in the quadrant, we do not have the dp index anymore, so we add it as a dict
-		{"dp": dataPoint, "index": dataPointIndex}
+		if np.isnan(dataPoint).any():
+			# not yet calculated dataPoints
+			return None
+
+		if instruments.enabled:
+			start = time.perf_counter()
 
-		:return:
-		"""
+		result = self.index.query(self.normalize(dataPoint), self.knnParams["k"])
 
-		print("Distributing dataPoints...")
+		if instruments.enabled:
+			instruments.addTime("knn query", start)
+			instruments.count("knn queries")
+			if result is None:
+				instruments.count("knn not enough nn")
 
-		gridDp = {}
+		if result is None:
+			return None
 
-		# place each dataPoint in its quadrant
-		for dataPointIndex in range(len(dataPoints)):
-			dataPoint = dataPoints[dataPointIndex]
+		indexes, distances = result
 
-			key = []
-			for i in range(len(dataPoint)):
-				if dataPoint[i] is None:
-					key = ["Not calculated dataPoints"]
-					break
+		return [{"distance": distance, "index": index} for index, distance in zip(indexes.tolist(), distances.tolist())]
 
-				key.append(int(dataPoint[i] // knnConfig["threshold"]))
+	def getKnnBatch(self, dataPoints, blockSize=None):
+		"""
+		Returns the k nearest neighbours of every given dataPoint at once
 
-			try:
-				gridDp[tuple(key)].append({"dp": dataPoint, "index": dataPointIndex})
-			except KeyError:
-				gridDp[tuple(key)] = [{"dp": dataPoint, "index": dataPointIndex}]
+		:param dataPoints:	(m, d) float matrix (for example the whole simDataPoints)
+		:param blockSize:	max number of distances calculated at once (default: knnParams["blockSize"])
+		:return:			(indexes, distances): (m, k) arrays sorted by distance,
+							the rows without knn have index -1 and distance inf
+		"""
 
-		print("Done!\n")
+		if blockSize is None:
+			blockSize = self.knnParams.get("blockSize")
 
-		return gridDp
+		if not instruments.enabled:
+			return self.index.queryBatch(self.normalize(dataPoints), self.knnParams["k"], blockSize)
 
-	def knn(self, dataPoints, dataPoint):
-		knn = []
+		start = time.perf_counter()
+		indexes, distances = self.index.queryBatch(self.normalize(dataPoints), self.knnParams["k"], blockSize)
+		instruments.addTime("knn batch", start)
 
-		# compare distances with each dataPoint in the training dataset
-		for dp in dataPoints:
-			trainDp = dp["dp"]
-			index = dp["index"]
+		calculated = ~np.isnan(dataPoints).any(axis=1)
+		instruments.count("knn queries", calculated.sum())
+		instruments.count("knn not enough nn", (calculated & (indexes[:, 0] == -1)).sum())
 
-			try:
-				# distance = euclideanSquaredDist(trainDp, dataPoint)
-				distance = euclideanDistance(trainDp, dataPoint)
-			except TypeError:
-				# the dp is not calculated yet
-				continue
+		return indexes, distances
 
-			neighbour = {"distance": distance, "index": index}
+	def getSimKnn(self, simIndex):
+		"""
+		Same as getKnn, but for the sim dataPoint at the given index, using the batch results
+		"""
 
-			# if the list is still empty, just append the neighbour
-			if len(knn) < self.knnParams["k"]:
-				knn.append(neighbour)
-				continue
+		if self.simKnn is None:
+			self.simKnn = self.getKnnBatch(self.simDataPoints)
 
-			# sort the neighbours (for easier access)
-			# lower distance first, higher at the end
-			knn = sorted(knn, key=lambda x: x["distance"])
+		indexes, distances = self.simKnn
 
-			# replace the worst neighbour with the better one
-			if distance < knn[-1]["distance"]:
-				knn[-1] = neighbour
+		if indexes[simIndex, 0] == -1:
+			return None
 
-		return knn
+		return [{"distance": distance, "index": index} for index, distance in zip(indexes[simIndex].tolist(), distances[simIndex].tolist())]
 
-	def getKnnGrid(self, dataPoint):
+	def simulatePosition(self, nn):
 		"""
-		This too returns k nearest neighbours of the given dataPoint, but it does much faster
-		It uses a grid system to divide data in buckets
+		Simulates the position of the given nearest neighbour.
+		Places a long and a short position at the given nn index.
+		If the tp of either positions gets hit, it returns the position.
+		If the sl of a position gets hit, it disables that position.
+		If both the sl get hit, it returns None.
+		If neither sl and tp get hit, it returns None.
+		If both sl and tp get hit in the same position, it returns None.
 
-		:param dataPoint:
-		:return:
+		The outcomes of every training kline are precomputed in the outcome table (see outcomeTable.py),
+		so this is just a lookup.
+
+		:param nn:
+		:return:	None or the position
 		"""
 
-		if None in dataPoint:
-			# not yet calculated dataPoints
-			return None
+		if instruments.enabled:
+			instruments.count("position simulations")
 
-		closeNn = self.getCloseNn(dataPoint)
+		posOpenIndex: int = nn["index"]
+		direction = int(self.outcomes.direction[posOpenIndex])
 
-		if closeNn is None:
+		if direction == INCONCLUSIVE:
 			return None
 
-		if len(closeNn) < self.knnParams["k"]:
-			# no enough nn
-			return None
+		return Position(
+			entryIndex=posOpenIndex,
+			exitIndex=int(self.outcomes.exitIndex[posOpenIndex]),
+			direction=direction,
+			entryPrice=self.trainKlines[posOpenIndex]["close"],
+			exitPrice=self.outcomes.exitPrice[posOpenIndex],
+			sl=self.positionParams["sl"],
+			tp=self.positionParams["tp"],
+			slPrice=None,
+			tpPrice=None
+		)
+
+
+class SlidingKnn(Knn):
+	def __init__(self, trainKlines, simKlines=None, horizon=None, knnParams=knnConfig, positionParams=positionSimConfig,
+				 actualPositionParams=actualPositionConfig, trainFeatures=None, simFeatures=None):
+		"""
+		Knn whose training klines keep growing: the new klines can be added with addTrainKlines (for example the
+		ones that closed in live mode), without rebuilding everything.
 
-		return self.knn(closeNn, dataPoint)
+		A training kline goes in the index only once it's mature, that is when the maxLength klines of its
+		simulated position are known, so its outcome can't change anymore.
+		The klines older than the horizon are expired from the index (they are still stored, they are small).
 
-	def getCloseNn(self, dataPoint):
+		:param horizon:			max age of the training klines, in the same unit as the timestamps (None: never expire).
+								The age is counted from the timestamp of the last added kline.
+		:param trainFeatures:	already calculated (dataPoints, valid) of the train klines (optional)
 		"""
-		I am ashamed. Don't judge me.
 
-		:param dataPoint:
-		:return:
+		self.knnParams = knnParams
+		self.positionParams = positionParams
+		self.actualPositionParams = actualPositionParams
+		self.horizon = horizon
+
+		# the features of a new kline depend on the klines before it, these are recalculated with it
+		self.featureLookback = 16
+
+		self.klineBuffers = {
+			key: GrowableArray(np.int64 if key == "timestamp" else np.float64) for key in klineColumns
+		}
+		self.dataPointBuffer = None
+		self.validBuffer = GrowableArray(bool)
+		self.outcomeBuffers = {
+			"direction": GrowableArray(np.int8),
+			"exitIndex": GrowableArray(np.int64),
+			"exitPrice": GrowableArray(np.float64)
+		}
+		self.numOfMature = 0
+		self.index = None
+		self.normalization = None
+
+		self.addTrainKlines(trainKlines, trainFeatures)
+		self.setSimKlines(simKlines, simFeatures)
+
+	def addTrainKlines(self, klines, features=None):
 		"""
+		Appends klines to the training ones, puts the klines that became mature in the index
+		and expires the ones older than the horizon.
+		Costs O(added klines * maxLength) plus the amortized index insert.
+
+		:param klines:		the new klines (KlineStore or list of klines), right after the last added one
+		:param features:	already calculated (dataPoints, valid) of the new klines (optional, for example a slice
+							of the features of all the klines), otherwise they are calculated with the klines before them
+		"""
+
+		if not isinstance(klines, KlineStore):
+			klines = KlineStore.fromRows(klines)
+
+		oldSize = len(self.klineBuffers["timestamp"])
+		for key, buffer in self.klineBuffers.items():
+			buffer.append(klines.columns[key])
 
-		closeNn = []
-
-		if len(dataPoint) == 1:
-			for offset1 in [-1, 0, 1]:
-				key = (
-					int(dataPoint[0] // knnConfig["threshold"]) + offset1,
-				)
-				try:
-					closeNn += self.gridDataPoints[key]
-				except KeyError:
-					# quadrant is empty (doesn't exist)
-					pass
-
-		elif len(dataPoint) == 2:
-			for offset1 in [-1, 0, 1]:
-				for offset2 in [-1, 0, 1]:
-					key = (
-						int(dataPoint[0] // knnConfig["threshold"]) + offset1,
-						int(dataPoint[1] // knnConfig["threshold"]) + offset2
-					)
-					try:
-						closeNn += self.gridDataPoints[key]
-					except KeyError:
-						# quadrant is empty (doesn't exist)
-						pass
-
-		elif len(dataPoint) == 3:
-			for offset1 in [-1, 0, 1]:
-				for offset2 in [-1, 0, 1]:
-					for offset3 in [-1, 0, 1]:
-						key = (
-							int(dataPoint[0] // knnConfig["threshold"]) + offset1,
-							int(dataPoint[1] // knnConfig["threshold"]) + offset2,
-							int(dataPoint[2] // knnConfig["threshold"]) + offset3
-						)
-						try:
-							closeNn += self.gridDataPoints[key]
-						except KeyError:
-							# quadrant is empty (doesn't exist)
-							pass
-
-		elif len(dataPoint) == 4:
-			for offset1 in [-1, 0, 1]:
-				for offset2 in [-1, 0, 1]:
-					for offset3 in [-1, 0, 1]:
-						for offset4 in [-1, 0, 1]:
-							key = (
-								int(dataPoint[0] // knnConfig["threshold"]) + offset1,
-								int(dataPoint[1] // knnConfig["threshold"]) + offset2,
-								int(dataPoint[2] // knnConfig["threshold"]) + offset3,
-								int(dataPoint[3] // knnConfig["threshold"]) + offset4
-							)
-							try:
-								closeNn += self.gridDataPoints[key]
-							except KeyError:
-								# quadrant is empty (doesn't exist)
-								pass
-
-		elif len(dataPoint) == 5:
-			for offset1 in [-1, 0, 1]:
-				for offset2 in [-1, 0, 1]:
-					for offset3 in [-1, 0, 1]:
-						for offset4 in [-1, 0, 1]:
-							for offset5 in [-1, 0, 1]:
-								key = (
-									int(dataPoint[0] // knnConfig["threshold"]) + offset1,
-									int(dataPoint[1] // knnConfig["threshold"]) + offset2,
-									int(dataPoint[2] // knnConfig["threshold"]) + offset3,
-									int(dataPoint[3] // knnConfig["threshold"]) + offset4,
-									int(dataPoint[4] // knnConfig["threshold"]) + offset5
-								)
-								try:
-									closeNn += self.gridDataPoints[key]
-								except KeyError:
-									# quadrant is empty (doesn't exist)
-									pass
+		self.trainKlines = KlineStore({key: buffer.array for key, buffer in self.klineBuffers.items()})
+		newSize = len(self.trainKlines)
 
+		if features is None:
+			# features of the new klines (with the klines before them)
+			start = max(0, oldSize - self.featureLookback)
+			dataPoints, valid = self.extractDataPoints(self.trainKlines[start:newSize])
+			dataPoints, valid = dataPoints[oldSize - start:], valid[oldSize - start:]
 		else:
-			raise Exception("Invalid dimension number!")
+			dataPoints, valid = features
 
-		return closeNn
+		if self.dataPointBuffer is None:
+			self.dataPointBuffer = GrowableArray(np.float64, dataPoints.shape[1:])
+		self.dataPointBuffer.append(dataPoints)
+		self.validBuffer.append(valid)
 
-	def simulatePosition(self, nn):
-		"""
-		Simulates the position of the given nearest neighbour.
-		Places a long and a short position at the given nn index.
-		If the tp of either positions gets hit, it returns the position.
-		If the sl of a position gets hit, it disables that position.
-		If both the sl get hit, it returns None.
-		If neither sl and tp get hit, it returns None.
-		If both sl and tp get hit in the same position, it returns None.
+		self.trainDataPoints = self.dataPointBuffer.array
+		self.trainValid = self.validBuffer.array
 
-		:param nn:
-		:return:	None or the position
+		# outcomes of the klines that became mature (their maxLength klines are known)
+		maxLength = self.positionParams["maxLength"]
+		numOfMature = max(self.numOfMature, newSize - maxLength + 1)
+
+		if numOfMature > self.numOfMature:
+			outcomes = simulateOutcomes(self.trainKlines[self.numOfMature:numOfMature + maxLength - 1], self.positionParams)
+			matured = slice(0, numOfMature - self.numOfMature)
+
+			self.outcomeBuffers["direction"].append(outcomes.direction[matured])
+			self.outcomeBuffers["exitIndex"].append(
+				np.where(outcomes.exitIndex[matured] != -1, outcomes.exitIndex[matured] + self.numOfMature, -1)
+			)
+			self.outcomeBuffers["exitPrice"].append(outcomes.exitPrice[matured])
+
+		self.outcomes = OutcomeTable(*(self.outcomeBuffers[key].array for key in ("direction", "exitIndex", "exitPrice")))
+
+		# put the mature klines in the index
+		matureValid = np.zeros(newSize, dtype=bool)
+		matureValid[:numOfMature] = self.trainValid[:numOfMature]
+
+		if self.index is None:
+			# the normalization is fitted on the first training klines only, so the space doesn't move later
+			self.normalization = fitNormalization(
+				self.knnParams.get("normalization"), self.trainDataPoints[matureValid]
+			)
+			self.index = SlidingWindowIndex(self.normalize(self.trainDataPoints), matureValid, self.knnParams)
+		else:
+			newIds = np.flatnonzero(matureValid[self.numOfMature:numOfMature]) + self.numOfMature
+			self.index.insert(newIds, self.normalize(self.trainDataPoints[newIds]))
+
+		self.numOfMature = numOfMature
+
+		# the sim knn depend on the training klines
+		self.simKnn = None
+
+		if self.horizon is not None:
+			oldest = self.trainKlines.timestamp[-1] - self.horizon
+			self.expireBefore(int(np.searchsorted(self.trainKlines.timestamp, oldest)))
+
+	def expireBefore(self, klineIndex):
+		"""
+		Removes the training klines before the given one from the index
 		"""
 
-		posOpenIndex: int = nn["index"]
-		entryPrice = self.trainKlines[posOpenIndex]["close"]
-
-		# long position params
-		longTp = entryPrice + (entryPrice / 100) * self.positionParams["tp"]
-		longSl = entryPrice - (entryPrice / 100) * self.positionParams["sl"]
-		longSlTriggered = False
-
-		# short position params
-		shortTp = entryPrice - (entryPrice / 100) * self.positionParams["tp"]
-		shortSl = entryPrice + (entryPrice / 100) * self.positionParams["sl"]
-		shortSlTriggered = False
-
-		# loop through every kline after the position opening and check if it hits the sl or tp
-		for posCurrIndex in range(self.positionParams["maxLength"]):
-			klineIndex = posCurrIndex + posOpenIndex
-
-			try:
-				currentLow = self.trainKlines[klineIndex]["low"]
-				currentHigh = self.trainKlines[klineIndex]["high"]
-			except IndexError:
-				# reached the end of the training klines
-				return None
-
-			# check stopLoss hits
-			if currentLow < longSl:
-				longSlTriggered = True
-
-			if currentHigh > shortSl:
-				shortSlTriggered = True
-
-			# check if both sl hit
-			if longSlTriggered and shortSlTriggered:
-				# this handles also big candles that go from tp to sl
-				# print("Both sl got hit!")
-				return None
-
-			# return short position
-			if currentLow < shortTp and not shortSlTriggered:
-				return Position(
-					entryIndex=posOpenIndex,
-					exitIndex=klineIndex,
-					direction=-1,
-					entryPrice=entryPrice,
-					exitPrice=shortTp,
-					sl=self.positionParams["sl"],
-					tp=self.positionParams["tp"],
-					slPrice=None,
-					tpPrice=None
-				)
-
-			# return long position
-			if currentHigh > longTp and not longSlTriggered:
-				return Position(
-					entryIndex=posOpenIndex,
-					exitIndex=klineIndex,
-					direction=1,
-					entryPrice=entryPrice,
-					exitPrice=longTp,
-					sl=self.positionParams["sl"],
-					tp=self.positionParams["tp"],
-					slPrice=None,
-					tpPrice=None
-				)
-
-		# if nothing happens, the position is too long (inconclusive)
-		# print(f"position is too long")
-		return None
+		self.index.expireBefore(klineIndex)
+		self.simKnn = None
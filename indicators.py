@@ -0,0 +1,263 @@
+"""
+Vectorized indicators.
+
+Every indicator is calculated over the whole kline series at once and returns an array with one value per kline.
+The values that can't be calculated yet (not enough klines before them) are NaN, instead of None.
+
+The rolling sums are done with cumulative sums, so every indicator is O(n), no matter the interval
+(the short windows are just added up, see directSumInterval).
+"""
+
+import numpy as np
+
+from klineStore import KlineStore
+
+
+# the windows up to this long are summed value by value (a numpy add per value of the window) instead of with
+# the cumulative sums: it's as fast for them, there is no drift, and RollingSum adds them up in the same order,
+# so the streaming features are the same as the batch ones to the last bit
+directSumInterval = 16
+
+
+def rollingSum(values, interval):
+	"""
+	Returns the sum of the last "interval" values for each index (NaN for the first interval - 1 indexes)
+
+	:param values: 		1D array
+	:param interval: 	length of the window
+	:return:
+	"""
+
+	values = np.asarray(values, dtype=np.float64)
+	result = np.full(len(values), np.nan)
+
+	if interval < 1:
+		raise Exception("The interval must be at least 1!")
+
+	if len(values) < interval:
+		return result
+
+	if interval <= directSumInterval:
+		windows = len(values) - interval + 1
+		total = values[:windows].copy()
+		for shift in range(1, interval):
+			total += values[shift:shift + windows]
+
+		result[interval - 1:] = total
+		return result
+
+	# center the values, so the cumulative sum doesn't grow huge and lose precision
+	offset = values.mean()
+	cumSum = np.empty(len(values) + 1)
+	cumSum[0] = 0
+	np.cumsum(values - offset, out=cumSum[1:])
+
+	result[interval - 1:] = cumSum[interval:] - cumSum[:-interval] + offset * interval
+
+	return result
+
+
+def smaArray(values, interval):
+	"""
+	Returns the sma of every value
+	"""
+
+	return rollingSum(values, interval) / interval
+
+
+def typicalPrice(klines):
+	return (klines.high + klines.low + klines.close) / 3
+
+
+def smaTypicalArray(klines, interval):
+	return smaArray(typicalPrice(klines), interval)
+
+
+def cciArray(klines, interval=20, blockSize=65536):
+	"""
+	Commodity channel index:
+	(typical price - sma of the typical price) / (0.015 * mean deviation)
+
+	The mean deviation is the mean of |typical price - sma| over the interval, which can't be done
+	with a cumulative sum, so it's done on a sliding window view in blocks (to limit the memory usage).
+	"""
+
+	typical = typicalPrice(klines)
+	movingAverage = smaArray(typical, interval)
+	meanDeviation = np.full(len(typical), np.nan)
+
+	if len(typical) >= interval:
+		windows = np.lib.stride_tricks.sliding_window_view(typical, interval)
+
+		for start in range(0, len(windows), blockSize):
+			block = windows[start:start + blockSize]
+			means = movingAverage[interval - 1 + start:interval - 1 + start + len(block)]
+			meanDeviation[interval - 1 + start:interval - 1 + start + len(block)] = np.abs(block - means[:, None]).mean(axis=1)
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		cci = (typical - movingAverage) / (0.015 * meanDeviation)
+
+	# a completely flat window has no deviation
+	cci[meanDeviation == 0] = 0
+
+	return cci
+
+
+def rsiArray(klines, interval=14, klineValue="close"):
+	"""
+	Relative strength index, with simple averages of the gains and losses (Cutler's rsi)
+	instead of Wilder's smoothing, so it can be calculated with rolling sums too.
+	The first valid value is at index = interval.
+	"""
+
+	values = klines.columns[klineValue]
+	change = np.diff(values, prepend=np.nan)
+
+	gains = rollingSum(np.where(change > 0, change, 0)[1:], interval)
+	losses = rollingSum(np.where(change < 0, -change, 0)[1:], interval)
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		rsi = 100 - 100 / (1 + gains / losses)
+
+	# no losses means max rsi
+	rsi[losses == 0] = 100
+
+	return np.concatenate(([np.nan], rsi))
+
+
+# DataPoint features
+#
+# Each feature is a function that takes the klines and returns one value per kline (NaN if it can't be calculated).
+# To add a feature (rsi, adx, ...) write its function and add it to the tuple passed to extractFeatures.
+
+
+def priceChange(klines):
+	return klines.close - klines.open
+
+
+def sma5Change(klines):
+	# like in price change, the difference of the close and open sma is used instead of the sma slope
+	return smaArray(klines.close, 5) - smaArray(klines.open, 5)
+
+
+def smat5Change(klines):
+	# the typical price has no open value, so here it is the actual slope
+	smat5 = smaTypicalArray(klines, 5)
+	return np.diff(smat5, prepend=np.nan)
+
+
+defaultFeatures = (priceChange, sma5Change, smat5Change)
+
+
+def extractFeatures(klines, features=defaultFeatures):
+	"""
+	Calculates every feature of every kline
+
+	:param klines:		KlineStore
+	:param features:	tuple of feature functions
+	:return:			(dataPoints, valid)
+						dataPoints: (n, d) float matrix, one row per kline
+						valid: (n,) bool mask, False where some feature can't be calculated (the row contains NaN)
+	"""
+
+	if not isinstance(klines, KlineStore):
+		klines = KlineStore.fromRows(klines)
+
+	dataPoints = np.empty((len(klines), len(features)))
+
+	for dimIndex, feature in enumerate(features):
+		dataPoints[:, dimIndex] = feature(klines)
+
+	valid = ~np.isnan(dataPoints).any(axis=1)
+
+	return dataPoints, valid
+
+
+# Streaming features
+#
+# In live mode the klines come one at a time, so the features can't be calculated over the whole array.
+# These keep the last values in fixed-size ring buffers and update the rolling sums with a few additions per kline.
+
+
+class RollingSum:
+	def __init__(self, interval, resyncEvery=100000):
+		"""
+		Sum of the last "interval" values, updated one value at a time
+
+		The windows up to directSumInterval long are added up from the buffer at every update, oldest value first,
+		like rollingSum does, so they give exactly the same sums. The longer ones keep a running sum.
+
+		:param interval: 	length of the window
+		:param resyncEvery:	only for the running sum: every how many updates it is recalculated from the buffer,
+							so that its rounding errors don't pile up over months of klines
+		"""
+
+		if interval < 1:
+			raise Exception("The interval must be at least 1!")
+
+		self.interval = interval
+		self.resyncEvery = resyncEvery
+
+		self.buffer = [0.0] * interval
+		self.position = 0
+		self.count = 0
+		self.total = 0.0
+
+	def update(self, value):
+		"""
+		Adds the value to the window
+
+		:return:	the sum of the window, NaN if there are not enough values yet
+		"""
+
+		if self.interval > directSumInterval:
+			self.total += value - self.buffer[self.position]
+
+		self.buffer[self.position] = value
+		self.position = (self.position + 1) % self.interval
+		self.count += 1
+
+		if self.interval <= directSumInterval:
+			# the oldest value is the one after the last written
+			self.total = 0.0
+			for bufferValue in self.buffer[self.position:] + self.buffer[:self.position]:
+				self.total += bufferValue
+		elif self.count % self.resyncEvery == 0:
+			self.total = sum(self.buffer)
+
+		if self.count < self.interval:
+			return np.nan
+
+		return self.total
+
+
+class StreamingFeatures:
+	def __init__(self):
+		"""
+		Incremental version of the defaultFeatures (price change, sma5 change and smat5 change).
+		Feeding it the klines one by one gives exactly the same dataPoints as extractFeatures
+		(the same operations in the same order, see RollingSum), so live mode decides like the backtest.
+		"""
+
+		self.closeSum = RollingSum(5)
+		self.openSum = RollingSum(5)
+		self.typicalSum = RollingSum(5)
+		self.lastSmat5 = np.nan
+
+	def update(self, kline):
+		"""
+		:param kline:	the last closed kline (anything with "open", "high", "low" and "close")
+		:return:		the dataPoint of the kline, with NaN for the features that can't be calculated yet
+		"""
+
+		openPrice = float(kline["open"])
+		closePrice = float(kline["close"])
+		typical = (float(kline["high"]) + float(kline["low"]) + closePrice) / 3
+
+		sma5Diff = self.closeSum.update(closePrice) / 5 - self.openSum.update(openPrice) / 5
+
+		smat5 = self.typicalSum.update(typical) / 5
+		smat5Diff = smat5 - self.lastSmat5
+		self.lastSmat5 = smat5
+
+		return np.array([closePrice - openPrice, sma5Diff, smat5Diff])
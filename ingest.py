@@ -0,0 +1,273 @@
+"""
+Ingestion of the monthly (or daily) Binance kline dumps into kline store files.
+
+Every dump (a csv, or the zip it's downloaded in, which doesn't need to be extracted) is parsed and validated in a
+worker process, then the main process appends it to the store of its symbol and interval (KlineStoreWriter).
+No process ever holds more than one file of klines, and the store is written directly in the binary format, so
+there's no merged csv to parse again.
+
+Validation of each file:
+	- rows with missing or non finite values, the wrong number of columns, or the high under the low, are dropped
+	- the timestamps are sorted if they're not, and the duplicated ones are dropped (the first one is kept)
+	- microsecond timestamps (the newer Binance dumps) are converted to milliseconds
+	- the klines that overlap the previous file of the same symbol are dropped
+	- the gaps (missing klines) are counted, but not filled
+
+	python ingest.py klineData/binanceData/ETHUSDT-1m-2023 klineData/binanceData/BTCUSDT-1m-2023
+	klines = getCryptoDataBinance("./klineData/binanceData/ETHUSDT-1m.klines")
+"""
+
+import argparse
+import io
+import itertools
+import os
+import re
+import warnings
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from klineStore import KlineStore, KlineStoreWriter, klineColumns, cacheExtension
+
+
+# SYMBOL-INTERVAL-YYYY-MM(-DD).csv or .zip
+dumpNamePattern = re.compile(r"^(?P<symbol>[A-Z0-9]+)-(?P<interval>\d+[smhdwM])-(?P<date>\d{4}-\d{2}(-\d{2})?)\.(csv|zip)$")
+
+intervalUnits = {"s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000, "w": 7 * 24 * 60 * 60 * 1000}
+
+
+def intervalToMs(interval):
+	"""
+	:param interval:	Binance interval ("1m", "15m", "4h", ...)
+	:return:			length of the interval in ms, None for the months (they're not all the same)
+	"""
+
+	if interval[-1] not in intervalUnits:
+		return None
+
+	return int(interval[:-1]) * intervalUnits[interval[-1]]
+
+
+def findDumps(paths):
+	"""
+	Finds the Binance dumps in the given files and folders (recursively)
+
+	:return:	{"SYMBOL-INTERVAL": [paths sorted by date]}
+	"""
+
+	filePaths = []
+	for path in paths:
+		if os.path.isdir(path):
+			for folder, _, fileNames in os.walk(path):
+				filePaths.extend(os.path.join(folder, fileName) for fileName in fileNames)
+		else:
+			filePaths.append(path)
+
+	groups = {}
+	for filePath in filePaths:
+		match = dumpNamePattern.match(os.path.basename(filePath))
+		if match is None:
+			continue
+
+		groups.setdefault(f"{match['symbol']}-{match['interval']}", []).append((match["date"], filePath))
+
+	# if both the zip and the extracted csv are there, only one of them is needed
+	return {
+		group: [filePath for _, filePath in {date: filePath for date, filePath in sorted(dumps)}.items()]
+		for group, dumps in sorted(groups.items())
+	}
+
+
+def openDump(filePath):
+	"""
+	Opens the csv of a dump as text, reading it straight from the zip if it's zipped
+	"""
+
+	if not filePath.endswith(".zip"):
+		return open(filePath)
+
+	archive = zipfile.ZipFile(filePath)
+	csvNames = [name for name in archive.namelist() if name.endswith(".csv")]
+	if len(csvNames) != 1:
+		archive.close()
+		raise Exception(f"{filePath} should contain exactly one csv, not {len(csvNames)}")
+
+	# the archive gets closed when the csv stream is garbage collected
+	return io.TextIOWrapper(archive.open(csvNames[0]))
+
+
+def parseDump(filePath):
+	"""
+	Parses and validates a single dump (in a worker process)
+
+	:return:	(columns, report): {kline column: array}, {"rows": ..., "invalid": ..., "duplicates": ..., "unsorted": ...}
+	"""
+
+	# a month of 1m klines is just a few MB of text
+	with openDump(filePath) as csvFile:
+		lines = csvFile.read().splitlines()
+
+	# some dumps have a header and some don't
+	if lines and not lines[0][:1].isdigit():
+		lines = lines[1:]
+
+	lines = [line for line in lines if line.strip()]
+	numOfRows = len(lines)
+
+	try:
+		data = np.loadtxt(lines, delimiter=",", usecols=(0, 1, 2, 3, 4, 5), dtype=np.float64, ndmin=2)
+	except ValueError:
+		# broken rows, the slower parser turns the bad values into NaNs and skips the rows with too few columns
+		# (they all get dropped below)
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore")
+			data = np.genfromtxt(
+				lines, delimiter=",", usecols=(0, 1, 2, 3, 4, 5), dtype=np.float64, ndmin=2, invalid_raise=False
+			)
+
+	if not len(data):
+		data = np.empty((0, 6))
+
+	valid = np.isfinite(data).all(axis=1) & (data[:, 2] >= data[:, 3])
+	data = data[valid]
+
+	timestamps = data[:, 0].astype(np.int64)
+	# microseconds to milliseconds
+	if len(timestamps) and timestamps[0] >= 10 ** 14:
+		timestamps //= 1000
+
+	unsorted = bool(np.any(np.diff(timestamps) < 0))
+	order = np.argsort(timestamps, kind="stable") if unsorted else np.arange(len(timestamps))
+
+	sortedTimestamps = timestamps[order]
+	unique = np.ones(len(sortedTimestamps), dtype=bool)
+	unique[1:] = sortedTimestamps[1:] != sortedTimestamps[:-1]
+	order = order[unique]
+
+	columns = {key: np.ascontiguousarray(data[order, i]) for i, key in enumerate(klineColumns)}
+	columns["timestamp"] = timestamps[order]
+
+	report = {
+		"rows": numOfRows,
+		# the skipped rows count as invalid too
+		"invalid": int(numOfRows - valid.sum()),
+		"duplicates": int(len(unique) - unique.sum()),
+		"unsorted": unsorted
+	}
+
+	return columns, report
+
+
+def countGaps(timestamps, interval, previousTimestamp=None):
+	"""
+	:return:	number of missing klines between the timestamps (and the previous one, if given)
+	"""
+
+	if interval is None or not len(timestamps):
+		return 0
+
+	if previousTimestamp is not None:
+		timestamps = np.concatenate(([previousTimestamp], timestamps))
+
+	steps = np.diff(timestamps) // interval
+	return int(np.sum(steps[steps > 1] - 1))
+
+
+def ingestBinance(paths, outputFolder=None, workers=None, append=False):
+	"""
+	Ingests all the Binance dumps in the paths into one store per symbol and interval,
+	parsing the dumps in parallel.
+
+	:param paths:			files and folders with the dumps (SYMBOL-INTERVAL-YYYY-MM.csv or .zip)
+	:param outputFolder:	where to write the stores (SYMBOL-INTERVAL.klines), by default next to the dumps
+	:param workers:			number of worker processes (default: one per cpu)
+	:param append:			add the klines to the existing stores (only the ones after their last kline)
+							instead of replacing them
+	:return:				{"SYMBOL-INTERVAL": report of the store}
+	"""
+
+	groups = findDumps(paths)
+	if not groups:
+		raise Exception(f"No Binance dumps found in {paths}")
+
+	if outputFolder is not None:
+		os.makedirs(outputFolder, exist_ok=True)
+
+	workers = workers or os.cpu_count()
+	jobs = [(group, filePath) for group, filePaths in groups.items() for filePath in filePaths]
+
+	reports = {}
+	writers = {}
+
+	try:
+		with ProcessPoolExecutor(workers) as executor:
+			# at most two dumps per worker are parsed or waiting to be written at once, so the memory stays bounded
+			pending = deque()
+			jobIterator = iter(jobs)
+
+			for group, filePath in itertools.islice(jobIterator, 2 * workers):
+				pending.append((group, filePath, executor.submit(parseDump, filePath)))
+
+			while pending:
+				group, filePath, future = pending.popleft()
+
+				nextJob = next(jobIterator, None)
+				if nextJob is not None:
+					pending.append((*nextJob, executor.submit(parseDump, nextJob[1])))
+
+				if group not in writers:
+					storePath = os.path.join(outputFolder or os.path.dirname(filePath), group + cacheExtension)
+					writers[group] = KlineStoreWriter(storePath, append)
+					reports[group] = {
+						"path": storePath, "files": 0, "failed": [], "klines": 0, "invalid": 0, "duplicates": 0,
+						"overlapping": 0, "gaps": 0
+					}
+
+				writer = writers[group]
+				report = reports[group]
+
+				try:
+					columns, fileReport = future.result()
+				except Exception as e:
+					print(f"Could not read file {filePath} because of error: {e}")
+					report["failed"].append(filePath)
+					continue
+
+				report["gaps"] += countGaps(columns["timestamp"], intervalToMs(group.split("-")[1]), writer.lastTimestamp)
+				report["overlapping"] += writer.append(KlineStore(columns))
+
+				report["files"] += 1
+				report["invalid"] += fileReport["invalid"]
+				report["duplicates"] += fileReport["duplicates"]
+
+				print(f"{os.path.basename(filePath)}: {len(columns['timestamp'])} klines")
+
+		for group, writer in writers.items():
+			writer.close()
+			reports[group]["klines"] = writer.numOfKlines
+	except BaseException:
+		for writer in writers.values():
+			writer.discard()
+		raise
+
+	for group, report in reports.items():
+		print(f"\n{group} -> {report['path']}")
+		for key in ("files", "klines", "invalid", "duplicates", "overlapping", "gaps"):
+			print(f"    {key:<12} {report[key]}")
+		if report["failed"]:
+			print(f"    {'failed':<12} {len(report['failed'])}")
+
+	return reports
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Ingests Binance kline dumps (csv or zip) into kline store files")
+	parser.add_argument("paths", nargs="+", help="dump files or folders with dumps")
+	parser.add_argument("--output", default=None, help="folder of the stores (default: next to the dumps)")
+	parser.add_argument("--workers", type=int, default=None)
+	parser.add_argument("--append", action="store_true", help="add to the existing stores instead of replacing them")
+	args = parser.parse_args()
+
+	ingestBinance(args.paths, args.output, args.workers, args.append)
@@ -0,0 +1,158 @@
+"""
+Opt-in instrumentation of the hot paths (knn, spatial indexes, position simulation and backtests).
+
+It's off by default, and then it costs a single "if instruments.enabled" in each instrumented function.
+When it's on it records:
+	- the wall time and number of calls of every stage (nested stages are counted in both)
+	- counters (candidates scanned by the indexes, knn queries, queries without enough nn, position simulations, ...)
+	- histograms in powers of 2 (the size of the grid buckets that get looked at, the candidates of each query)
+
+	with instruments.recording():
+		backtest = Backtest(simKlines, brain)
+	print(instruments.report())
+	instruments.dump("instruments.json")
+"""
+
+import contextlib
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class Instruments:
+	def __init__(self):
+		self.enabled = False
+		self.reset()
+
+	def reset(self):
+		self.times = defaultdict(float)
+		self.calls = defaultdict(int)
+		self.counters = defaultdict(int)
+		# {name: {bin: count}}, the bin b holds the values from 2^(b-1) to 2^b - 1 (0 holds the zeros)
+		self.histograms = defaultdict(lambda: defaultdict(int))
+
+	def enable(self):
+		self.enabled = True
+
+	def disable(self):
+		self.enabled = False
+
+	@contextlib.contextmanager
+	def recording(self, reset=True):
+		"""
+		Enables the instruments for the with block
+		"""
+
+		if reset:
+			self.reset()
+
+		self.enable()
+		try:
+			yield self
+		finally:
+			self.disable()
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""
+		Times the with block (only for the not so hot paths, the hot ones use addTime)
+		"""
+
+		if not self.enabled:
+			yield
+			return
+
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.addTime(name, start)
+
+	def addTime(self, name, start):
+		"""
+		:param start:	the time.perf_counter() at the start of the stage
+		"""
+
+		self.times[name] += time.perf_counter() - start
+		self.calls[name] += 1
+
+	def count(self, name, amount=1):
+		self.counters[name] += int(amount)
+
+	def addToHistogram(self, name, value):
+		self.histograms[name][int(value).bit_length()] += 1
+
+	def addManyToHistogram(self, name, values):
+		"""
+		Same as addToHistogram, for an array of (non negative) values
+		"""
+
+		values = np.asarray(values, dtype=np.int64)
+		if not len(values):
+			return
+
+		# bit length of every value
+		bins = np.where(values > 0, np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) + 1, 0)
+		for binIndex, binCount in enumerate(np.bincount(bins).tolist()):
+			if binCount:
+				self.histograms[name][binIndex] += binCount
+
+	def asDict(self):
+		return {
+			"stages": {name: {"seconds": self.times[name], "calls": self.calls[name]} for name in self.times},
+			"counters": dict(self.counters),
+			"histograms": {name: {str(b): c for b, c in sorted(bins.items())} for name, bins in self.histograms.items()},
+			"rates": self.rates()
+		}
+
+	def rates(self):
+		"""
+		The derived values of the counters
+		"""
+
+		rates = {}
+		queries = self.counters.get("knn queries", 0)
+
+		if queries:
+			rates["not enough nn rate"] = self.counters.get("knn not enough nn", 0) / queries
+			rates["candidates per query"] = self.counters.get("candidates scanned", 0) / queries
+
+		return rates
+
+	def dump(self, filePath):
+		with open(filePath, "w") as dumpFile:
+			json.dump(self.asDict(), dumpFile, indent=2)
+
+	def report(self):
+		lines = ["", "INSTRUMENTS", ""]
+
+		if self.times:
+			lines.append(f"{'stage':<28} {'calls':>10} {'total s':>10} {'mean ms':>10}")
+			for name in sorted(self.times, key=self.times.get, reverse=True):
+				calls = self.calls[name]
+				lines.append(f"{name:<28} {calls:>10} {self.times[name]:>10.4f} {self.times[name] / calls * 1000:>10.4f}")
+			lines.append("")
+
+		for name, value in sorted(self.counters.items()):
+			lines.append(f"{name:<28} {value:>10}")
+
+		for name, value in self.rates().items():
+			lines.append(f"{name:<28} {value:>10.4f}")
+
+		for name, bins in self.histograms.items():
+			lines.append("")
+			lines.append(f"{name}:")
+
+			total = sum(bins.values())
+			for b in sorted(bins):
+				low = 0 if b == 0 else 2 ** (b - 1)
+				high = 0 if b == 0 else 2 ** b - 1
+				lines.append(f"    {low:>8} - {high:<8} {bins[b]:>10} {'#' * round(40 * bins[b] / total)}")
+
+		return "\n".join(lines) + "\n"
+
+
+# the instruments used by every module
+instruments = Instruments()
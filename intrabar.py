@@ -0,0 +1,145 @@
+"""
+Intrabar resolution: which level gets hit first inside a kline, looked up in the lower timeframe klines.
+
+When a kline hits both the sl and the tp of a position (or both sl of the simulated long and short), its high
+and low don't say which one came first, so the backtests assume the sl and the knn discards the neighbour.
+The bigger the timeframe the more often it happens. With the 1m klines of the same period, the order can be
+resolved by looking at the 1m klines of just the ambiguous klines, instead of simulating everything on 1m.
+
+	intrabar = IntrabarResolver(klines15m, klines1m)
+	knn = Knn(trainKlines, simKlines, intrabar=IntrabarResolver(trainKlines, klines1m))
+	backtest = VectorBacktest(simKlines, knn, intrabar=IntrabarResolver(simKlines, klines1m))
+"""
+
+import numpy as np
+
+from outcomeTable import hashKlines
+
+
+class IntrabarResolver:
+	def __init__(self, klines, lowerKlines, interval=None):
+		"""
+		Maps every kline to the range of the lower klines inside it (the offset index), once.
+
+		:param klines:		the klines to resolve (KlineStore)
+		:param lowerKlines:	the lower timeframe klines of the same period (KlineStore, sorted, same timestamp unit)
+		:param interval:	length of a kline, in the unit of the timestamps (default: the most common step)
+		"""
+
+		timestamps = np.asarray(klines.timestamp, dtype=np.int64)
+
+		if interval is None:
+			if len(timestamps) < 2:
+				raise Exception("The interval of the klines must be given if there are less than 2 of them!")
+
+			steps, counts = np.unique(np.diff(timestamps), return_counts=True)
+			interval = int(steps[counts.argmax()])
+
+		self.klines = klines
+		self.lowerKlines = lowerKlines
+		self.interval = interval
+
+		lowerTimestamps = np.asarray(lowerKlines.timestamp, dtype=np.int64)
+
+		# the lower klines of kline i are lowerKlines[starts[i]:ends[i]]
+		self.starts = np.searchsorted(lowerTimestamps, timestamps, side="left")
+		self.ends = np.searchsorted(lowerTimestamps, timestamps + interval, side="left")
+
+		self.fingerprint = None
+
+	def __len__(self):
+		return len(self.starts)
+
+	def __getitem__(self, item):
+		"""
+		resolver[a:b] -> resolver of klines[a:b], sharing the offset index (no copy)
+		"""
+
+		if not isinstance(item, slice):
+			raise Exception("An IntrabarResolver can only be sliced!")
+
+		resolver = IntrabarResolver.__new__(IntrabarResolver)
+		resolver.klines = self.klines[item]
+		resolver.lowerKlines = self.lowerKlines
+		resolver.interval = self.interval
+		resolver.starts = self.starts[item]
+		resolver.ends = self.ends[item]
+		resolver.fingerprint = None
+
+		return resolver
+
+	@property
+	def maxLowerKlines(self):
+		"""
+		Max number of lower klines in a kline
+		"""
+
+		return int((self.ends - self.starts).max()) if len(self) else 0
+
+	def getFingerprint(self):
+		"""
+		Hash of the lower klines used by the resolver (for the outcome table cache)
+		"""
+
+		if self.fingerprint is None:
+			start = int(self.starts.min()) if len(self) else 0
+			end = int(self.ends.max()) if len(self) else 0
+			self.fingerprint = f"{hashKlines(self.lowerKlines[start:end])}-{self.interval}"
+
+		return self.fingerprint
+
+	def firstTouches(self, klineIndexes, levels, above):
+		"""
+		Finds, for every kline, the first of its lower klines that gets over (or under) the level.
+		Only the lower klines of the given klines are searched, all of them at once.
+
+		:param klineIndexes:	indexes of the klines (the ambiguous ones)
+		:param levels:			the level of each kline
+		:param above:			True (or a bool array): hit when the high is over the level, False: when the low is under it
+		:return:				(n,) int64 array, the offset of the first lower kline that hits the level,
+								the number of lower klines of the kline if none of them does
+		"""
+
+		klineIndexes = np.asarray(klineIndexes, dtype=np.int64)
+		starts = self.starts[klineIndexes]
+		lengths = self.ends[klineIndexes] - starts
+
+		touches = lengths.copy()
+		nonEmpty = np.flatnonzero(lengths)
+		if not len(nonEmpty):
+			return touches
+
+		# every lower kline of the klines, one segment after the other
+		segmentStarts = np.cumsum(lengths) - lengths
+		offsets = np.arange(lengths.sum()) - np.repeat(segmentStarts, lengths)
+		lowerIndexes = np.repeat(starts, lengths) + offsets
+
+		levels = np.repeat(np.broadcast_to(np.asarray(levels, dtype=np.float64), klineIndexes.shape), lengths)
+		above = np.repeat(np.broadcast_to(np.asarray(above, dtype=bool), klineIndexes.shape), lengths)
+
+		hit = np.where(
+			above,
+			self.lowerKlines.high[lowerIndexes] > levels,
+			self.lowerKlines.low[lowerIndexes] < levels
+		)
+
+		candidates = np.where(hit, offsets, np.repeat(lengths, lengths))
+		touches[nonEmpty] = np.minimum.reduceat(candidates, segmentStarts[nonEmpty])
+
+		return touches
+
+	def slFirst(self, klineIndexes, slPrices, tpPrices, directions):
+		"""
+		For positions that hit both their sl and tp in the given klines, is the sl hit first?
+		If they are hit in the same lower kline (or the lower klines are missing) it's still the sl.
+
+		:param directions:	1 (long) or -1 (short) of each position
+		:return:			(n,) bool array
+		"""
+
+		isLong = np.asarray(directions) == 1
+
+		slTouch = self.firstTouches(klineIndexes, slPrices, ~isLong)
+		tpTouch = self.firstTouches(klineIndexes, tpPrices, isLong)
+
+		return slTouch <= tpTouch
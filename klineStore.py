@@ -0,0 +1,373 @@
+"""
+Columnar storage for klines.
+
+Instead of a list of dicts (one dict per candle), every kline value is kept in its own contiguous numpy array:
+{"timestamp": [...], "open": [...], ...} (approach 3 in the README).
+The hot loops can then work on whole arrays, while klines[i]["close"] still works through a small view object.
+"""
+
+import contextlib
+import os
+import shutil
+import struct
+
+import numpy as np
+
+
+# the stored kline values, in the same order as in the csv files
+klineColumns = ("timestamp", "open", "high", "low", "close", "volume")
+
+
+class Kline:
+	"""
+	Read-only view of a single kline of a KlineStore.
+	It behaves like the old kline dict, so kline["close"] still works.
+	"""
+
+	__slots__ = ("store", "index")
+
+	def __init__(self, store, index):
+		self.store = store
+		self.index = index
+
+	def __getitem__(self, key):
+		return self.store.columns[key][self.index]
+
+	def __iter__(self):
+		return iter(klineColumns)
+
+	def __repr__(self):
+		return repr(self.asDict())
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def keys(self):
+		return klineColumns
+
+	def items(self):
+		return [(key, self[key]) for key in klineColumns]
+
+	def asDict(self):
+		return {key: self[key] for key in klineColumns}
+
+
+class KlineStore:
+	def __init__(self, columns: dict):
+		"""
+		:param columns: dict with an array for each of the klineColumns, all of the same length.
+						The arrays are not copied if they already have the right dtype (int64 timestamps, float64 values)
+		"""
+
+		self.columns = {}
+
+		for key in klineColumns:
+			dtype = np.int64 if key == "timestamp" else np.float64
+			self.columns[key] = np.asarray(columns[key], dtype=dtype)
+
+		lengths = {len(column) for column in self.columns.values()}
+		if len(lengths) > 1:
+			raise Exception("All the kline columns must have the same length!")
+
+		self.timestamp = self.columns["timestamp"]
+		self.open = self.columns["open"]
+		self.high = self.columns["high"]
+		self.low = self.columns["low"]
+		self.close = self.columns["close"]
+		self.volume = self.columns["volume"]
+
+	def __len__(self):
+		return len(self.timestamp)
+
+	def __getitem__(self, item):
+		"""
+		store[i]		-> Kline view (compatible with the old kline dict)
+		store[a:b]		-> KlineStore over views of the same arrays (no copy)
+		store["close"]	-> the whole close column
+		"""
+
+		if isinstance(item, str):
+			return self.columns[item]
+
+		if isinstance(item, slice):
+			return KlineStore({key: column[item] for key, column in self.columns.items()})
+
+		index = int(item)
+		length = len(self)
+		if index < 0:
+			index += length
+		if not 0 <= index < length:
+			raise IndexError("kline index out of range")
+
+		return Kline(self, index)
+
+	def __iter__(self):
+		for index in range(len(self)):
+			yield Kline(self, index)
+
+	def __str__(self):
+		return f"KlineStore with {len(self)} klines"
+
+	@classmethod
+	def fromRows(cls, rows):
+		"""
+		Builds a store from the old list of kline dicts
+
+		:param rows: [{"timestamp": ..., "open": ..., ...}, ...]
+		:return:
+		"""
+
+		return cls({key: [row[key] for row in rows] for key in klineColumns})
+
+
+class GrowableArray:
+	def __init__(self, dtype, rowShape=(), capacity=1024):
+		"""
+		Numpy array that can be appended to (for the klines that keep arriving).
+		When it's full its capacity doubles, so appending costs amortized O(1) per row.
+
+		:param rowShape:	shape of each row, () for a 1d array
+		"""
+
+		self.data = np.empty((capacity,) + tuple(rowShape), dtype=dtype)
+		self.size = 0
+
+	def __len__(self):
+		return self.size
+
+	def append(self, rows):
+		rows = np.asarray(rows, dtype=self.data.dtype)
+		newSize = self.size + len(rows)
+
+		if newSize > len(self.data):
+			data = np.empty((max(newSize, 2 * len(self.data)),) + self.data.shape[1:], dtype=self.data.dtype)
+			data[:self.size] = self.data[:self.size]
+			self.data = data
+
+		self.data[self.size:newSize] = rows
+		self.size = newSize
+
+	@property
+	def array(self):
+		"""
+		View of the filled part (it doesn't follow the next appends)
+		"""
+
+		return self.data[:self.size]
+
+
+def parseKlineCsv(filePath, usecols=(0, 1, 2, 3, 4, 5), skiprows=1):
+	"""
+	Parses a numeric kline csv in one go (no per-row python work).
+
+	:param filePath:	path of the csv file
+	:param usecols: 	indexes of the timestamp, open, high, low, close and volume columns
+	:param skiprows:	number of header rows to skip
+	:return:			KlineStore
+	"""
+
+	data = np.loadtxt(filePath, delimiter=",", skiprows=skiprows, usecols=usecols, dtype=np.float64, ndmin=2)
+
+	columns = {key: np.ascontiguousarray(data[:, i]) for i, key in enumerate(klineColumns)}
+	columns["timestamp"] = columns["timestamp"].astype(np.int64)
+
+	return KlineStore(columns)
+
+
+# Binary kline cache
+#
+# Layout of a cache file (little endian):
+# 	header (64 bytes):	magic, number of klines, source mtime (ns), source size
+# 	body:				one column after another, in the klineColumns order, 8 bytes per value
+#
+# The body is memory mapped when loaded, so a warm load doesn't read or parse anything and every process
+# that loads the same file shares the same physical pages.
+
+cacheMagic = b"KLINES01"
+cacheHeader = struct.Struct("<8sqqq")
+cacheHeaderSize = 64
+cacheExtension = ".klines"
+
+
+def getCachePath(sourcePath):
+	return sourcePath + cacheExtension
+
+
+def saveKlineCache(klines: KlineStore, cachePath, sourcePath):
+	"""
+	Writes the klines in the binary cache format.
+	The stat of the source file is saved too, so the cache can be invalidated when the source changes.
+
+	:param klines:		the klines to save
+	:param cachePath:	where to save the cache
+	:param sourcePath:	the file the klines were parsed from
+	"""
+
+	sourceStat = os.stat(sourcePath)
+	header = cacheHeader.pack(cacheMagic, len(klines), sourceStat.st_mtime_ns, sourceStat.st_size)
+
+	# write to a temporary file first, so other processes never map a half written cache
+	tmpPath = f"{cachePath}.{os.getpid()}.tmp"
+	with open(tmpPath, "wb") as cacheFile:
+		cacheFile.write(header.ljust(cacheHeaderSize, b"\0"))
+
+		for key in klineColumns:
+			dtype = "<i8" if key == "timestamp" else "<f8"
+			np.ascontiguousarray(klines.columns[key], dtype=dtype).tofile(cacheFile)
+
+	os.replace(tmpPath, cachePath)
+
+
+def loadKlineCache(cachePath, sourcePath=None):
+	"""
+	Memory maps a cache file.
+
+	:param cachePath:	path of the cache file
+	:param sourcePath:	if given, the cache is only valid if the source file has not changed since it was written
+	:return:			KlineStore or None if the cache is missing, stale or truncated
+	"""
+
+	try:
+		with open(cachePath, "rb") as cacheFile:
+			magic, numOfKlines, sourceMtime, sourceSize = cacheHeader.unpack(cacheFile.read(cacheHeader.size))
+	except (FileNotFoundError, struct.error):
+		return None
+
+	if magic != cacheMagic:
+		return None
+
+	if sourcePath is not None:
+		sourceStat = os.stat(sourcePath)
+		if sourceStat.st_mtime_ns != sourceMtime or sourceStat.st_size != sourceSize:
+			return None
+
+	if numOfKlines == 0:
+		return KlineStore({key: [] for key in klineColumns})
+
+	# a truncated body (a crash while it was copied, a full disk...) can't be mapped, the cache gets written again
+	if os.path.getsize(cachePath) < cacheHeaderSize + 8 * len(klineColumns) * numOfKlines:
+		return None
+
+	body = np.memmap(cachePath, dtype="<f8", mode="r", offset=cacheHeaderSize, shape=(len(klineColumns), numOfKlines))
+
+	columns = {key: body[i] for i, key in enumerate(klineColumns)}
+	columns["timestamp"] = body[0].view("<i8")
+
+	return KlineStore(columns)
+
+
+class KlineStoreWriter:
+	def __init__(self, storePath, append=False):
+		"""
+		Writes a kline store file (same format as the cache, without a source) a chunk of klines at a time,
+		so a store can be built from more klines than fit in memory.
+		Every column gets streamed to its own temporary file, and close() puts them one after another in the store.
+
+		:param storePath:	the store file
+		:param append:		if True and the store exists, the new klines are added after the ones already in it
+		"""
+
+		self.storePath = storePath
+		self.tmpPrefix = f"{storePath}.{os.getpid()}"
+		self.columnFiles = {key: open(f"{self.tmpPrefix}.{key}.tmp", "wb") for key in klineColumns}
+		self.numOfKlines = 0
+		self.lastTimestamp = None
+
+		if append:
+			existing = loadKlineCache(storePath)
+			if existing is not None and len(existing):
+				self.append(existing)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.discard()
+
+	def append(self, klines):
+		"""
+		Appends the klines after the ones already written.
+		The klines have to be sorted, the ones that are not after the last written timestamp are dropped
+		(the overlaps between consecutive files).
+
+		:param klines:	KlineStore
+		:return:		number of dropped klines
+		"""
+
+		timestamps = np.asarray(klines.timestamp)
+		start = 0
+		if self.lastTimestamp is not None:
+			start = int(np.searchsorted(timestamps, self.lastTimestamp, side="right"))
+
+		if start < len(timestamps):
+			for key in klineColumns:
+				dtype = "<i8" if key == "timestamp" else "<f8"
+				np.ascontiguousarray(klines.columns[key][start:], dtype=dtype).tofile(self.columnFiles[key])
+
+			self.numOfKlines += len(timestamps) - start
+			self.lastTimestamp = int(timestamps[-1])
+
+		return start
+
+	def close(self):
+		"""
+		Writes the store file (atomically, like saveKlineCache) and deletes the temporary files
+		"""
+
+		for columnFile in self.columnFiles.values():
+			columnFile.close()
+
+		# no source file, so its mtime and size are 0
+		header = cacheHeader.pack(cacheMagic, self.numOfKlines, 0, 0)
+
+		tmpPath = f"{self.tmpPrefix}.tmp"
+		with open(tmpPath, "wb") as storeFile:
+			storeFile.write(header.ljust(cacheHeaderSize, b"\0"))
+
+			for key in klineColumns:
+				with open(f"{self.tmpPrefix}.{key}.tmp", "rb") as columnFile:
+					shutil.copyfileobj(columnFile, storeFile, 1 << 24)
+
+		os.replace(tmpPath, self.storePath)
+		self.discard()
+
+	def discard(self):
+		"""
+		Deletes the temporary files without writing the store
+		"""
+
+		for key, columnFile in self.columnFiles.items():
+			columnFile.close()
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(f"{self.tmpPrefix}.{key}.tmp")
+
+
+def loadCached(sourcePath, parser, useCache=True):
+	"""
+	Returns the klines of the source file, using the binary cache if it is still valid.
+	If it's not, the source gets parsed and the cache (re)generated.
+
+	:param sourcePath:	the csv (or other) file with the klines
+	:param parser:		function that parses the source file into a KlineStore
+	:param useCache:	if False, the source is always parsed and no cache is written
+	:return:			KlineStore
+	"""
+
+	if not useCache:
+		return parser(sourcePath)
+
+	cachePath = getCachePath(sourcePath)
+
+	klines = loadKlineCache(cachePath, sourcePath)
+	if klines is not None:
+		return klines
+
+	saveKlineCache(parser(sourcePath), cachePath, sourcePath)
+
+	return loadKlineCache(cachePath, sourcePath)
@@ -0,0 +1,119 @@
+"""
+Live (streaming) decision path.
+
+In a backtest all the sim klines are known up front, so the dataPoints and the knn are calculated in one batch.
+In live mode the klines arrive one at a time, once they are closed: the features are updated incrementally
+(see StreamingFeatures) and the spatial index is queried for just that dataPoint.
+With a SlidingKnn, every closed kline is also added to the training klines (see SlidingKnn.addTrainKlines).
+"""
+
+import time
+
+from dataGetter import getCryptoDataBinance
+from decisionMaker import Knn, SlidingKnn
+from indicators import StreamingFeatures
+
+
+class LiveKnn:
+	def __init__(self, knn: Knn, latencyBudget=0.005):
+		"""
+		:param knn:				a Knn built on the training klines (simKlines can be None),
+								if it's a SlidingKnn the streamed klines become training klines too
+		:param latencyBudget:	seconds each kline is allowed to take, the klines that take longer are counted
+		"""
+
+		self.knn = knn
+		self.features = StreamingFeatures()
+		self.latencyBudget = latencyBudget
+
+		# index of the next kline (counted from the start of the stream)
+		self.klineIndex = 0
+		# the last predicted position, whose entry price is known only when the next kline opens
+		self.pendingPosition = None
+
+		self.latencyStats = {
+			"klines": 0,
+			"totLatency": 0,
+			"maxLatency": 0,
+			"overBudget": 0
+		}
+
+	def __str__(self):
+		klines = max(self.latencyStats["klines"], 1)
+
+		return f"""
+LIVE LATENCY
+
+klines:         {self.latencyStats["klines"]}
+mean latency:   {self.latencyStats["totLatency"] / klines * 1000:.3f} ms
+max latency:    {self.latencyStats["maxLatency"] * 1000:.3f} ms
+over budget:    {self.latencyStats["overBudget"]} ({self.latencyBudget * 1000:.1f} ms)
+"""
+
+	def warmUp(self, klines):
+		"""
+		Feeds the features with the klines before the start of the stream (without deciding anything),
+		so the first klines of the stream already have their dataPoints
+
+		:param klines:	the last closed klines before the stream
+		"""
+
+		for kline in klines:
+			self.features.update(kline)
+
+	def onKline(self, kline):
+		"""
+		Processes a closed kline and returns the position for the next one
+
+		:param kline:	the closed kline (dict or Kline with "open", "high", "low", "close")
+		:return:		{"predicted": position, "considered": [], "latency": seconds}
+						(the latency covers the features, the query and the prediction, not the training insert
+						of a SlidingKnn that comes after them)
+						the predicted position would be entered at the open of the next kline,
+						so its entry price is the close of this kline until the next one arrives
+		"""
+
+		start = time.perf_counter()
+
+		if self.pendingPosition is not None:
+			# now we know the actual entry price
+			self.pendingPosition.entryPrice = kline["open"]
+			self.pendingPosition = None
+
+		dataPoint = self.features.update(kline)
+		knn = self.knn.getKnn(dataPoint)
+		decision = self.knn.predictPosition(knn, self.klineIndex + 1, kline["close"])
+
+		self.pendingPosition = decision["predicted"]
+		self.klineIndex += 1
+
+		latency = time.perf_counter() - start
+		decision["latency"] = latency
+
+		self.latencyStats["klines"] += 1
+		self.latencyStats["totLatency"] += latency
+		self.latencyStats["maxLatency"] = max(self.latencyStats["maxLatency"], latency)
+		if latency > self.latencyBudget:
+			self.latencyStats["overBudget"] += 1
+
+		# the decision is already taken, the training insert only has to be done before the next kline
+		if isinstance(self.knn, SlidingKnn):
+			self.knn.addTrainKlines([kline])
+
+		return decision
+
+
+if __name__ == '__main__':
+	# replay the klines after the training ones, as if they were arriving live
+	klines = getCryptoDataBinance()
+
+	live = LiveKnn(Knn(klines[:500000]))
+	live.warmUp(klines[500000 - 10:500000])
+
+	positions = 0
+	for kline in klines[500000:]:
+		if live.onKline(kline)["predicted"] is not None:
+			positions += 1
+
+	print(f"{positions} positions predicted")
+	print(live)
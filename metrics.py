@@ -0,0 +1,135 @@
+"""
+Distance metrics between dataPoints, calculated with numpy for many points at once.
+
+Every metric is a sum (or a function of a sum) of the differences of each coordinate, so it only needs
+the absolute differences: fromDifferences((..., d) array) -> (...) distances.
+That's also what the spatial indexes use to skip the far away points, so every metric declares two bounds:
+	- lowerBound(excess):		the smallest distance a point can have from the query, given the minimum difference of
+								each coordinate (like the distance from the bounding box of a kd-tree node)
+	- coordinateBound(radius):	the biggest difference a coordinate can have between two points within the radius
+								(the grid uses it as the side of its cubes)
+
+	euclidean:			sqrt(sum(d^2))
+	squaredEuclidean:	sum(d^2), same neighbours as euclidean, but the threshold has a different scale
+	manhattan:			sum(|d|)
+	lorentzian:			sum(log(1 + |d|)), the big differences count less (see the TODO in the README)
+"""
+
+import numpy as np
+from abc import abstractmethod
+
+
+class Metric:
+	name = None
+
+	@abstractmethod
+	def fromDifferences(self, differences):
+		"""
+		:param differences:	(..., d) array of the absolute differences of each coordinate
+		:return:			(...) array of distances
+		"""
+
+	@abstractmethod
+	def coordinateBound(self, radius):
+		"""
+		Max absolute difference of a single coordinate between two points that are within the radius
+		"""
+
+	def lowerBound(self, excess):
+		"""
+		Min distance of a point whose coordinates differ at least by excess from the query.
+		The distance grows with every coordinate difference, so it's the distance of the excess itself.
+		"""
+
+		return self.fromDifferences(excess)
+
+	def distances(self, dataPoint, points):
+		"""
+		Distances of one dataPoint from each of the points
+
+		:param dataPoint:	(d,) array
+		:param points:		(n, d) matrix
+		:return:			(n,) array
+		"""
+
+		return self.fromDifferences(np.abs(points - dataPoint))
+
+	def pairwise(self, queries, points):
+		"""
+		Distances of every query from every point
+
+		:param queries:	(m, d) matrix
+		:param points:	(n, d) matrix
+		:return:		(m, n) matrix
+		"""
+
+		return self.fromDifferences(np.abs(queries[:, None, :] - points[None, :, :]))
+
+
+class SquaredEuclidean(Metric):
+	name = "squaredEuclidean"
+
+	def fromDifferences(self, differences):
+		return (differences ** 2).sum(axis=-1)
+
+	def coordinateBound(self, radius):
+		return np.sqrt(radius)
+
+	def pairwise(self, queries, points):
+		# |q - p|^2 = |q|^2 - 2 q.p + |p|^2, without the (m, n, d) differences
+		# (it loses some precision, so the distances of the chosen neighbours should be calculated again)
+		squared = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ points.T
+		squared += (points ** 2).sum(axis=1)
+
+		return np.maximum(squared, 0)
+
+
+class Euclidean(SquaredEuclidean):
+	name = "euclidean"
+
+	def fromDifferences(self, differences):
+		return np.sqrt(super().fromDifferences(differences))
+
+	def coordinateBound(self, radius):
+		return radius
+
+	def pairwise(self, queries, points):
+		return np.sqrt(super().pairwise(queries, points))
+
+
+class Manhattan(Metric):
+	name = "manhattan"
+
+	def fromDifferences(self, differences):
+		return differences.sum(axis=-1)
+
+	def coordinateBound(self, radius):
+		return radius
+
+
+class Lorentzian(Metric):
+	name = "lorentzian"
+
+	def fromDifferences(self, differences):
+		return np.log1p(differences).sum(axis=-1)
+
+	def coordinateBound(self, radius):
+		return np.expm1(radius)
+
+
+# the metrics that can be chosen with knnConfig["metric"]
+metrics = {metric.name: metric for metric in (Euclidean(), SquaredEuclidean(), Manhattan(), Lorentzian())}
+
+
+def getMetric(metric):
+	"""
+	:param metric:	name of the metric (see metrics) or a Metric
+	"""
+
+	if isinstance(metric, Metric):
+		return metric
+
+	if metric not in metrics:
+		raise Exception(f"Unknown metric: {metric} (must be one of {list(metrics)})")
+
+	return metrics[metric]
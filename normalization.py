@@ -0,0 +1,113 @@
+"""
+Normalization of the dataPoints (knnConfig["normalization"]).
+
+The features have very different scales: on BTC the price change and the sma deltas go from a few dollars
+to thousands, so the threshold (and the grid cubes) can be tiny for one dimension and huge for another.
+A normalization is fitted on the training dataPoints and then applied to every dataPoint that goes in the index
+or gets queried (training, sim and live), so they are all in the same space:
+	zscore:		(x - mean) / std of each dimension, the threshold is in standard deviations
+	quantile:	every coordinate is replaced by its quantile in the training dataPoints (from 0 to 1, interpolated
+				between the fitted quantiles), so the dimensions are uniform and the outliers don't stretch them.
+				The threshold is a fraction of the training dataPoints of each dimension.
+
+The NaN of the not calculated dataPoints stay NaN.
+"""
+
+import numpy as np
+from abc import abstractmethod
+
+
+class Normalization:
+	def __init__(self, points):
+		"""
+		:param points:	(n, d) float matrix of the valid training dataPoints
+		"""
+
+		points = np.asarray(points, dtype=np.float64)
+
+		if not len(points):
+			raise Exception("The normalization can't be fitted without valid dataPoints!")
+
+		self.fit(points)
+
+	@abstractmethod
+	def fit(self, points):
+		"""
+		Fits the normalization on the points (called once, by the constructor)
+		"""
+
+	@abstractmethod
+	def transform(self, points):
+		"""
+		:param points:	(..., d) float matrix
+		:return:		(..., d) float64 matrix of the normalized points
+		"""
+
+
+class ZScore(Normalization):
+	def fit(self, points):
+		self.mean = points.mean(axis=0)
+		self.std = points.std(axis=0)
+		# the constant dimensions are just centered
+		self.std[self.std == 0] = 1
+
+	def transform(self, points):
+		return (np.asarray(points, dtype=np.float64) - self.mean) / self.std
+
+
+class Quantile(Normalization):
+	def __init__(self, points, quantiles=1024):
+		"""
+		:param quantiles:	number of quantiles fitted in each dimension, the coordinates between them are interpolated
+		"""
+
+		self.quantiles = quantiles
+
+		super().__init__(points)
+
+	def fit(self, points):
+		levels = np.linspace(0, 1, self.quantiles + 1)
+		knots = np.quantile(points, levels, axis=0)
+
+		# the repeated values (discrete features) get the middle of their levels, np.interp needs increasing knots
+		self.knots = []
+		self.levels = []
+		for dim in range(points.shape[1]):
+			dimKnots, first, counts = np.unique(knots[:, dim], return_index=True, return_counts=True)
+			self.knots.append(dimKnots)
+			self.levels.append((levels[first] + levels[first + counts - 1]) / 2)
+
+	def transform(self, points):
+		points = np.asarray(points, dtype=np.float64)
+		normalized = np.empty(points.shape)
+
+		for dim, (knots, levels) in enumerate(zip(self.knots, self.levels)):
+			if len(knots) == 1:
+				normalized[..., dim] = np.where(np.isnan(points[..., dim]), np.nan, 0.5)
+			else:
+				normalized[..., dim] = np.interp(points[..., dim], knots, levels)
+
+		return normalized
+
+
+# the normalizations that can be chosen with knnConfig["normalization"]
+normalizations = {
+	"zscore": ZScore,
+	"quantile": Quantile
+}
+
+
+def fitNormalization(name, points):
+	"""
+	:param name:	name of the normalization (see normalizations), None for no normalization
+	:param points:	(n, d) float matrix of the valid training dataPoints
+	:return:		the fitted Normalization, None if name is None
+	"""
+
+	if name is None:
+		return None
+
+	if name not in normalizations:
+		raise Exception(f"Unknown normalization: {name} (must be one of {list(normalizations)})")
+
+	return normalizations[name](points)
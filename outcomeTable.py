@@ -0,0 +1,232 @@
+"""
+Precomputed outcomes of the simulated positions.
+
+The knn simulates a long and a short position at every nearest neighbour (see Knn.simulatePosition).
+The result only depends on the training klines and the position config, so it is calculated once for every
+training kline, with numpy, and then the knn only has to look it up.
+
+The tables are saved in klineData/outcomeCache, keyed by a hash of the training klines and one of the config.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from instrumentation import instruments
+
+
+outcomeCacheDir = "./klineData/outcomeCache"
+
+# directions in the table
+LONG = 1
+SHORT = -1
+INCONCLUSIVE = 0
+
+
+class OutcomeTable:
+	def __init__(self, direction, exitIndex, exitPrice):
+		"""
+		:param direction:	(n,) int8 array, 1 (long), -1 (short) or 0 (inconclusive) for each training kline
+		:param exitIndex:	(n,) int64 array, index of the kline that hit the tp (-1 if inconclusive)
+		:param exitPrice:	(n,) float array, the tp price of the winning position (NaN if inconclusive)
+		"""
+
+		self.direction = direction
+		self.exitIndex = exitIndex
+		self.exitPrice = exitPrice
+
+	def __len__(self):
+		return len(self.direction)
+
+
+def resolveTies(intrabar, firsts, levels, aboves, never):
+	"""
+	Refines the first hits of the levels that are hit in the same kline as another level,
+	with the lower kline that hits them first (see IntrabarResolver). The other hits are not looked at.
+
+	:param firsts:	the offsets (from the opening kline) of the first hit of each level, never if not hit
+	:param levels:	the price of each level, for every opening kline
+	:param aboves:	for each level, if it's hit by the high (True) or by the low (False)
+	:return:		(*refined firsts, scale), the refined first hits are offset * scale + offset of the lower kline,
+					so they compare the same way as before, except that the ties are broken
+	"""
+
+	scale = intrabar.maxLowerKlines + 1
+	numOfKlines = len(firsts[0])
+
+	refined = []
+	for i, (first, level, above) in enumerate(zip(firsts, levels, aboves)):
+		tied = np.zeros(numOfKlines, dtype=bool)
+		for j, other in enumerate(firsts):
+			if j != i:
+				tied |= first == other
+		tied &= first != never
+
+		openings = np.flatnonzero(tied)
+		lowerOffsets = np.zeros(numOfKlines, dtype=np.int64)
+		lowerOffsets[openings] = intrabar.firstTouches(openings + first[openings], level[openings], above)
+
+		if instruments.enabled:
+			instruments.count("intrabar resolutions", len(openings))
+
+		refined.append(first * scale + lowerOffsets)
+
+	return (*refined, scale)
+
+
+def simulateOutcomes(klines, positionParams, intrabar=None):
+	"""
+	Simulates the positions of every kline at once. The rules are the same as Knn.simulatePosition:
+	a long and a short position are opened at the close of the kline, and for each of the next maxLength klines
+	(starting from the opening one):
+		- if the low is under the long sl (or the high over the short sl), that position is disabled
+		- if both positions are disabled, the outcome is inconclusive
+		- if the low is under the short tp and the short is not disabled, the outcome is short
+		- if the high is over the long tp and the long is not disabled, the outcome is long
+	If nothing happens in maxLength klines (or the klines end), the outcome is inconclusive.
+
+	Instead of walking forward from every kline, the first kline that hits each level is searched for all the
+	klines at once (one vectorized step per kline of maxLength).
+
+	When an IntrabarResolver of the klines is given, the levels hit in the same kline are ordered by their first hit
+	in the lower timeframe klines, so the ambiguous klines aren't inconclusive (or short) by default anymore.
+	The ones that are still tied (hit in the same lower kline) follow the rules above.
+
+	:param klines:			KlineStore
+	:param positionParams:	dict with "sl", "tp" and "maxLength"
+	:param intrabar:		IntrabarResolver of the klines (optional)
+	:return:				OutcomeTable
+	"""
+
+	if instruments.enabled:
+		start = time.perf_counter()
+
+	numOfKlines = len(klines)
+	maxLength = positionParams["maxLength"]
+
+	entryPrice = np.asarray(klines.close)
+	low = np.asarray(klines.low)
+	high = np.asarray(klines.high)
+
+	# same formulas as in simulatePosition, so the comparisons give exactly the same results
+	longTp = entryPrice + (entryPrice / 100) * positionParams["tp"]
+	longSl = entryPrice - (entryPrice / 100) * positionParams["sl"]
+	shortTp = entryPrice - (entryPrice / 100) * positionParams["tp"]
+	shortSl = entryPrice + (entryPrice / 100) * positionParams["sl"]
+
+	# first offset (from the opening kline) at which each level gets hit, maxLength if never
+	never = maxLength
+	firstLongSl = np.full(numOfKlines, never, dtype=np.int64)
+	firstShortSl = np.full(numOfKlines, never, dtype=np.int64)
+	firstLongTp = np.full(numOfKlines, never, dtype=np.int64)
+	firstShortTp = np.full(numOfKlines, never, dtype=np.int64)
+
+	for offset in range(min(maxLength, numOfKlines)):
+		openings = slice(0, numOfKlines - offset)
+		currentLow = low[offset:]
+		currentHigh = high[offset:]
+
+		for first, hit in (
+			(firstLongSl, currentLow < longSl[openings]),
+			(firstShortSl, currentHigh > shortSl[openings]),
+			(firstShortTp, currentLow < shortTp[openings]),
+			(firstLongTp, currentHigh > longTp[openings])
+		):
+			firstView = first[openings]
+			firstView[hit & (firstView == never)] = offset
+
+	if intrabar is not None:
+		# the ties get ordered by the lower kline that hits each level first
+		firstLongSl, firstShortSl, firstShortTp, firstLongTp, scale = resolveTies(
+			intrabar, (firstLongSl, firstShortSl, firstShortTp, firstLongTp), (longSl, shortSl, shortTp, longTp),
+			(False, True, False, True), never
+		)
+		never *= scale
+	else:
+		scale = 1
+
+	# a tp only counts if it's hit before the sl of the same position
+	shortAt = np.where(firstShortTp < firstShortSl, firstShortTp, never)
+	longAt = np.where(firstLongTp < firstLongSl, firstLongTp, never)
+	bothSlAt = np.maximum(firstLongSl, firstShortSl)
+
+	# in the same kline, both sl are checked first, then the short tp and then the long tp
+	direction = np.full(numOfKlines, INCONCLUSIVE, dtype=np.int8)
+	isShort = (shortAt < never) & (shortAt < bothSlAt) & (shortAt <= longAt)
+	isLong = (longAt < never) & (longAt < bothSlAt) & (longAt < shortAt)
+	direction[isShort] = SHORT
+	direction[isLong] = LONG
+
+	exitOffset = np.where(isShort, shortAt, longAt) // scale
+	exitIndex = np.where(direction != INCONCLUSIVE, np.arange(numOfKlines) + exitOffset, -1)
+
+	exitPrice = np.full(numOfKlines, np.nan)
+	exitPrice[isShort] = shortTp[isShort]
+	exitPrice[isLong] = longTp[isLong]
+
+	if instruments.enabled:
+		instruments.addTime("simulate outcomes", start)
+		instruments.count("outcomes simulated", numOfKlines)
+
+	return OutcomeTable(direction, exitIndex, exitPrice)
+
+
+def hashKlines(klines):
+	"""
+	Fingerprint of the klines, used to know if a saved table belongs to them
+	"""
+
+	digest = hashlib.sha1()
+	digest.update(str(len(klines)).encode())
+
+	for column in (klines.timestamp, klines.high, klines.low, klines.close):
+		digest.update(np.ascontiguousarray(column).tobytes())
+
+	return digest.hexdigest()[:16]
+
+
+def hashConfig(positionParams):
+	return hashlib.sha1(json.dumps(positionParams, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def getOutcomeTable(klines, positionParams, cacheDir=outcomeCacheDir, useCache=True, intrabar=None):
+	"""
+	Returns the outcome table of the klines for the given position config, loading it from the cache
+	if it was already calculated.
+
+	:param klines:			the training klines
+	:param positionParams:	the position config (positionSimConfig)
+	:param cacheDir:		directory of the saved tables
+	:param useCache:		if False, the table is always calculated and not saved
+	:param intrabar:		IntrabarResolver of the klines (optional, see simulateOutcomes)
+	:return:				OutcomeTable
+	"""
+
+	if not useCache:
+		return simulateOutcomes(klines, positionParams, intrabar)
+
+	tableName = f"{hashKlines(klines)}-{hashConfig(positionParams)}"
+	if intrabar is not None:
+		tableName += f"-{intrabar.getFingerprint()}"
+
+	cachePath = os.path.join(cacheDir, f"{tableName}.npz")
+
+	try:
+		with np.load(cachePath) as table:
+			if instruments.enabled:
+				instruments.count("outcome table cache hits")
+			return OutcomeTable(table["direction"], table["exitIndex"], table["exitPrice"])
+	except (FileNotFoundError, KeyError, ValueError):
+		pass
+
+	outcomes = simulateOutcomes(klines, positionParams, intrabar)
+
+	os.makedirs(cacheDir, exist_ok=True)
+	tmpPath = f"{cachePath}.{os.getpid()}.tmp.npz"
+	np.savez(tmpPath, direction=outcomes.direction, exitIndex=outcomes.exitIndex, exitPrice=outcomes.exitPrice)
+	os.replace(tmpPath, cachePath)
+
+	return outcomes
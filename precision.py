@@ -0,0 +1,106 @@
+"""
+Storage precision of the dataPoints in the spatial indexes (knnConfig["precision"]).
+
+The dataPoints are calculated in float64, but the indexes don't need all of it to find the nn,
+and with smaller points the training sets of more symbols fit in memory at once:
+	float64:	8 bytes per coordinate, exact
+	float32:	4 bytes per coordinate, ~7 significant digits
+	int16:		2 bytes per coordinate, fixed point: every dimension is mapped from its range in the training
+				dataPoints to the int16 values, so each coordinate is off by at most half a step (range / 65534 / 2)
+
+The indexes keep their points encoded and decode them to float64 only when they calculate distances, one block
+of points at a time, so the queries and the distances are still float64.
+See approxEval.comparePrecisions to check how many positions change compared to float64.
+"""
+
+import numpy as np
+
+
+class PointEncoding:
+	dtype = np.float64
+
+	def encode(self, points):
+		"""
+		:param points:	(n, d) float matrix
+		:return:		(n, d) contiguous matrix of self.dtype
+		"""
+
+		return np.ascontiguousarray(points, dtype=self.dtype)
+
+	def decode(self, points):
+		"""
+		:param points:	(..., d) matrix of encoded points
+		:return:		(..., d) float64 matrix (not a copy with float64)
+		"""
+
+		return np.asarray(points, dtype=np.float64)
+
+
+class Float32Encoding(PointEncoding):
+	dtype = np.float32
+
+
+class FixedPointEncoding(PointEncoding):
+	dtype = np.int16
+
+	# the codes go from -steps to steps (-32768 is not used, so the range is symmetric)
+	steps = 32767
+
+	def __init__(self, points):
+		"""
+		Fits the offset and the scale of every dimension on the range of the points
+
+		:param points:	(n, d) float matrix, the points that will be encoded (without NaN)
+		"""
+
+		points = np.asarray(points, dtype=np.float64)
+
+		if len(points):
+			low = points.min(axis=0)
+			high = points.max(axis=0)
+		else:
+			low = high = np.zeros(points.shape[1])
+
+		self.offset = (high + low) / 2
+		self.scale = (high - low) / (2 * self.steps)
+		# the constant dimensions are all encoded as 0
+		self.scale[self.scale == 0] = 1
+
+	def encode(self, points):
+		codes = np.rint((np.asarray(points, dtype=np.float64) - self.offset) / self.scale)
+
+		return np.ascontiguousarray(np.clip(codes, -self.steps, self.steps), dtype=self.dtype)
+
+	def decode(self, points):
+		return points * self.scale + self.offset
+
+	@property
+	def maxError(self):
+		"""
+		Max error of each coordinate, (d,) array
+		"""
+
+		return self.scale / 2
+
+
+# the precisions that can be chosen with knnConfig["precision"]
+precisions = {
+	"float64": lambda points: PointEncoding(),
+	"float32": lambda points: Float32Encoding(),
+	"int16": FixedPointEncoding
+}
+
+
+def getEncoding(precision, points):
+	"""
+	:param precision:	name of the precision (see precisions) or an already fitted PointEncoding
+	:param points:		(n, d) float matrix, the points that will be encoded (to fit the fixed point)
+	"""
+
+	if isinstance(precision, PointEncoding):
+		return precision
+
+	if precision not in precisions:
+		raise Exception(f"Unknown precision: {precision} (must be one of {list(precisions)})")
+
+	return precisions[precision](points)
@@ -0,0 +1,97 @@
+"""
+Resampling of the klines to higher timeframes (1m -> 5m, 15m, 1h, 4h, ...).
+
+The klines are grouped in buckets aligned on the timestamps (a 4h bucket starts at 00:00, 04:00, ... UTC, like on
+Binance), and each bucket is reduced with numpy in one go: first open, max high, min low, last close, summed volume.
+A missing kline doesn't shift the buckets, the bucket just has fewer klines in it.
+
+Every resampled timeframe is cached next to the source file (source.5m.klines, ...), in the same binary format
+as the cache of the source, so it's only calculated once and loading it doesn't touch the base klines.
+"""
+
+import numpy as np
+
+from klineStore import KlineStore, getCachePath, saveKlineCache, loadKlineCache
+
+
+# length of the timeframes in seconds
+timeframes = {
+	"1m": 60,
+	"3m": 3 * 60,
+	"5m": 5 * 60,
+	"15m": 15 * 60,
+	"30m": 30 * 60,
+	"1h": 60 * 60,
+	"2h": 2 * 60 * 60,
+	"4h": 4 * 60 * 60,
+	"6h": 6 * 60 * 60,
+	"12h": 12 * 60 * 60,
+	"1d": 24 * 60 * 60
+}
+
+
+def resampleKlines(klines, timeframe, unitsPerSecond=1000):
+	"""
+	Resamples the (sorted) klines to a higher timeframe
+
+	:param klines:			KlineStore
+	:param timeframe:		one of the timeframes ("15m", "1h", ...)
+	:param unitsPerSecond:	unit of the timestamps (1000 for ms like Binance, 1 for seconds like Dukascopy)
+	:return:				KlineStore, with the timestamp of the start of each bucket
+	"""
+
+	if timeframe not in timeframes:
+		raise Exception(f"Unknown timeframe: {timeframe} (must be one of {list(timeframes)})")
+
+	period = timeframes[timeframe] * unitsPerSecond
+	timestamps = np.asarray(klines.timestamp, dtype=np.int64)
+
+	if len(timestamps) > 1 and np.median(np.diff(timestamps)) > period:
+		raise Exception(f"Can't resample the klines to {timeframe}, their timeframe is higher!")
+
+	if not len(timestamps):
+		return KlineStore({key: [] for key in klines.columns})
+
+	buckets = timestamps - timestamps % period
+
+	# index of the first kline of every bucket
+	starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+	ends = np.concatenate((starts[1:], [len(timestamps)]))
+
+	return KlineStore({
+		"timestamp": buckets[starts],
+		"open": np.asarray(klines.open)[starts],
+		"high": np.maximum.reduceat(klines.high, starts),
+		"low": np.minimum.reduceat(klines.low, starts),
+		"close": np.asarray(klines.close)[ends - 1],
+		"volume": np.add.reduceat(klines.volume, starts)
+	})
+
+
+def getTimeframeCachePath(sourcePath, timeframe):
+	return getCachePath(f"{sourcePath}.{timeframe}")
+
+
+def loadTimeframe(sourcePath, loadBase, timeframe, unitsPerSecond=1000, useCache=True):
+	"""
+	Returns the klines of the source file resampled to the timeframe, using the cache if it is still valid
+	(the source file has not changed since it was written)
+
+	:param sourcePath:	the file of the base klines
+	:param loadBase:	function without arguments that returns the base klines (only called if there's no cache)
+	:param timeframe:	one of the timeframes
+	:return:			KlineStore
+	"""
+
+	if not useCache:
+		return resampleKlines(loadBase(), timeframe, unitsPerSecond)
+
+	cachePath = getTimeframeCachePath(sourcePath, timeframe)
+
+	klines = loadKlineCache(cachePath, sourcePath)
+	if klines is not None:
+		return klines
+
+	saveKlineCache(resampleKlines(loadBase(), timeframe, unitsPerSecond), cachePath, sourcePath)
+
+	return loadKlineCache(cachePath, sourcePath)
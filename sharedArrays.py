@@ -0,0 +1,73 @@
+"""
+Numpy arrays in shared memory, so worker processes can use the klines and dataPoints without copying them.
+
+The parent process copies the arrays in shared memory once with SharedArrays, and sends its spec
+(names, shapes and dtypes, which is small and picklable) to the workers, that get the arrays with attachArrays.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedArrays:
+	def __init__(self, arrays: dict):
+		"""
+		Copies the arrays in shared memory blocks
+
+		:param arrays:	{name: numpy array}
+		"""
+
+		self.blocks = []
+		self.spec = {}
+		self.arrays = {}
+
+		for name, array in arrays.items():
+			array = np.ascontiguousarray(array)
+
+			# shared memory blocks can't be empty
+			block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+			sharedArray = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+			sharedArray[...] = array
+
+			self.blocks.append(block)
+			self.spec[name] = (block.name, array.shape, array.dtype.str)
+			self.arrays[name] = sharedArray
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.release()
+
+	def release(self):
+		"""
+		Frees the shared memory, the arrays can't be used anymore after this
+		"""
+
+		self.arrays = {}
+
+		for block in self.blocks:
+			block.close()
+			block.unlink()
+
+		self.blocks = []
+
+
+def attachArrays(spec):
+	"""
+	Returns the shared arrays described by the spec (in a worker process)
+
+	:param spec:	SharedArrays.spec
+	:return:		({name: numpy array}, blocks), the blocks must be kept alive as long as the arrays are used
+	"""
+
+	arrays = {}
+	blocks = []
+
+	for name, (blockName, shape, dtype) in spec.items():
+		block = shared_memory.SharedMemory(name=blockName)
+
+		arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+		blocks.append(block)
+
+	return arrays, blocks
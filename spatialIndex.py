@@ -0,0 +1,1467 @@
+"""
+Spatial indexes used by the knn to find the nearest neighbours of a dataPoint.
+
+Every index is built once over the training dataPoints (only the valid ones) and answers
+k nearest and radius queries with the indexes of the training dataPoints and their distances.
+
+	GridIndex:			the threshold grid (see "Splitting the space into a grid" in the README)
+	KdTree:				exact kd-tree, works for any number of dimensions
+	BruteForceIndex:	compares every query with every point, in numpy blocks (fastest for big batches of queries)
+	IvfIndex:			approximate, only compares the points of the lists closest to the query (see approxEval.py)
+	ShardedIndex:		splits the points between processes, each with one of the other indexes, and merges their results
+
+SlidingWindowIndex wraps one of them, for a training window where dataPoints are inserted and expired over time.
+
+Every index can also answer a whole batch of queries at once with queryBatch.
+The distances are measured with the metric of the index (see metrics.py, default: euclidean).
+The points can be stored in float32 or int16 fixed point to save memory (see precision.py, default: float64).
+"""
+
+import contextlib
+import heapq
+import io
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+import numpy as np
+from abc import abstractmethod
+
+from instrumentation import instruments
+from klineStore import GrowableArray
+from metrics import getMetric
+from precision import getEncoding
+from sharedArrays import SharedArrays, attachArrays
+
+
+class SpatialIndex:
+	def __init__(self, dataPoints, valid, metric="euclidean", precision="float64"):
+		"""
+		:param dataPoints:	(n, d) float matrix of the training dataPoints
+		:param valid:		(n,) bool mask, the not valid dataPoints are not indexed
+		:param metric:		name of the distance metric (see metrics.py)
+		:param precision:	how the points are stored (see precision.py)
+		"""
+
+		self.metric = getMetric(metric)
+		self.ids = np.flatnonzero(valid)
+
+		validPoints = dataPoints[self.ids]
+		self.encoding = getEncoding(precision, validPoints)
+		# the points are stored encoded, getPoints decodes them
+		self.points = self.encoding.encode(validPoints)
+		self.dimensions = dataPoints.shape[1]
+
+		# the ids below this one are expired, the queries skip them (see expireBefore)
+		self.minId = 0
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+	def close(self):
+		"""
+		Frees what the index holds outside of this object (only the sharded index has something: its processes)
+		"""
+
+	def expireBefore(self, minId):
+		"""
+		Expires the training dataPoints with an id lower than minId, without rebuilding the index:
+		they are still in the index, but the queries skip them
+		"""
+
+		self.minId = max(self.minId, minId)
+
+	def getPoints(self, positions=slice(None)):
+		"""
+		Returns the points at the positions (in self.points) as a float64 matrix
+		"""
+
+		return self.encoding.decode(self.points[positions])
+
+	def alivePositions(self, positions):
+		"""
+		Returns the positions (in self.points) that are not expired
+		"""
+
+		if self.minId:
+			return positions[self.ids[positions] >= self.minId]
+
+		return positions
+
+	@abstractmethod
+	def query(self, dataPoint, k):
+		"""
+		Returns the k nearest neighbours of the dataPoint
+
+		:return:	(indexes, distances) sorted by distance, the indexes are the ones of the training dataPoints.
+					None if the index can't find k neighbours.
+		"""
+
+	@abstractmethod
+	def queryRadius(self, dataPoint, radius):
+		"""
+		Returns every neighbour within the radius of the dataPoint
+
+		:return:	(indexes, distances) sorted by distance
+		"""
+
+	def queryBatch(self, dataPoints, k, blockSize=None):
+		"""
+		Returns the k nearest neighbours of every dataPoint of the batch
+
+		:param dataPoints:	(m, d) float matrix, the rows with NaN are skipped
+		:param k:			number of neighbours
+		:param blockSize:	max number of distances calculated at once (not used by every index)
+		:return:			(indexes, distances): (m, k) arrays sorted by distance,
+							the rows without a result have index -1 and distance inf
+		"""
+
+		indexes = np.full((len(dataPoints), k), -1, dtype=np.int64)
+		distances = np.full((len(dataPoints), k), np.inf)
+
+		for row in np.flatnonzero(~np.isnan(dataPoints).any(axis=1)):
+			result = self.query(dataPoints[row], k)
+
+			if result is not None:
+				indexes[row] = result[0]
+				distances[row] = result[1]
+
+		return indexes, distances
+
+	@staticmethod
+	def sortedResult(ids, distances, k=None):
+		"""
+		Sorts the candidates by distance and keeps the best k (all of them if k is None)
+		"""
+
+		if k is not None and len(distances) > k:
+			best = np.argpartition(distances, k - 1)[:k]
+			ids = ids[best]
+			distances = distances[best]
+
+		order = np.argsort(distances, kind="stable")
+
+		return ids[order], distances[order]
+
+
+class GridIndex(SpatialIndex):
+	def __init__(self, dataPoints, valid, threshold, metric="euclidean", precision="float64", cellSize="threshold",
+				 targetOccupancy=32, maxReach=2):
+		"""
+		The space is split in cubes, big enough that two points within the threshold are at most one cube apart
+		(with the euclidean distance the side is the threshold itself, see Metric.coordinateBound).
+		A query only looks at the dataPoint's cube and the adjacent ones (3^d cubes), so the neighbours that are
+		further away than the threshold might not be found. That's fine since the knn discards them anyway.
+
+		With cellSize "adaptive" the side of every dimension is chosen from the data: where the points are dense
+		compared to the threshold, the dimension is split in cells reach times smaller, and the query looks at the
+		reach cells on each side, so it still finds every neighbour within the threshold but scans a smaller
+		box around the dataPoint (2 + 1/reach thresholds wide instead of 3). See occupancyStats to check it.
+
+		:param threshold:		max distance of the neighbours that must be found
+		:param cellSize:		"threshold" (every side is the threshold) or "adaptive"
+		:param targetOccupancy:	only for "adaptive": about how many points a cell should have
+		:param maxReach:		only for "adaptive": max number of cells a side of the threshold is split in
+		"""
+
+		super().__init__(dataPoints, valid, metric, precision)
+
+		if threshold <= 0:
+			raise Exception("The threshold must be greater than 0!")
+
+		self.threshold = threshold
+		bound = float(self.metric.coordinateBound(threshold))
+
+		if cellSize == "threshold":
+			self.reach = np.ones(self.dimensions, dtype=np.int64)
+		elif cellSize == "adaptive":
+			self.reach = self.adaptiveReach(bound, targetOccupancy, maxReach)
+		else:
+			raise Exception(f"Unknown cell size: {cellSize} (must be \"threshold\" or \"adaptive\")")
+
+		# (d,) side of the cells of every dimension
+		self.cellSide = bound / self.reach
+		# (cells, d) offsets of the cells a query looks at
+		self.offsets = np.array(list(itertools.product(*(range(-reach, reach + 1) for reach in self.reach.tolist()))))
+		self.gridDataPoints = self.placeDpInGrid()
+
+		# the slots of self.points that hold no point (the expired ones), they get reused by insert
+		self.freePositions = []
+		# the positions of the points in id order, for insert and expireBefore (see trackIds)
+		self.idOrderPositions = None
+		self.idOrderIds = None
+		self.idOrderStart = 0
+
+	def __len__(self):
+		return len(self.ids) - len(self.freePositions)
+
+	def adaptiveReach(self, bound, targetOccupancy, maxReach, sampleSize=256, seed=0):
+		"""
+		In how many cells the threshold is split in every dimension.
+		The points are spread on about (n / targetOccupancy)^(1/d) cells per dimension (over their interquartile
+		range, so the outliers don't count), and the dimensions where the threshold is wider than those cells can be
+		split, up to maxReach times. Smaller cells mean less candidates but more buckets to look up, so the split
+		(1, 2, ... up to maxReach) is chosen by the cost of the queries on a sample of the points (see lookupCost).
+		"""
+
+		reach = np.ones(self.dimensions, dtype=np.int64)
+
+		if not len(self.points):
+			return reach
+
+		points = self.getPoints()
+		low, high = np.percentile(points, [25, 75], axis=0)
+		spread = np.where(high > low, high - low, points.max(axis=0) - points.min(axis=0))
+
+		cellsPerDimension = max(1.0, (len(points) / targetOccupancy) ** (1 / self.dimensions))
+		wantedSide = spread / cellsPerDimension
+
+		# the constant dimensions have a single cell anyway
+		varying = wantedSide > 0
+		reach[varying] = np.minimum(np.ceil(bound / wantedSide[varying]), maxReach)
+		reach = np.maximum(reach, 1)
+
+		rng = np.random.default_rng(seed)
+		sample = points[rng.choice(len(points), min(sampleSize, len(points)), replace=False)]
+
+		bestReach, bestCost = None, np.inf
+		for split in range(1, int(reach.max()) + 1):
+			splitReach = np.minimum(reach, split)
+			lookups = int(np.prod(2 * splitReach + 1))
+			cost = lookups * self.lookupCost + self.meanCandidates(points, sample, bound / splitReach, splitReach)
+
+			if cost < bestCost:
+				bestReach, bestCost = splitReach, cost
+
+		return bestReach
+
+	# a bucket lookup costs about as much as calculating the distances of this many candidates
+	lookupCost = 5
+
+	@staticmethod
+	def meanCandidates(points, queries, cellSide, reach):
+		"""
+		Mean number of candidates of the queries with the given cells, without building the grid
+		"""
+
+		uniqueKeys, counts = np.unique(np.floor(points / cellSide).astype(np.int64), axis=0, return_counts=True)
+		buckets = dict(zip(map(tuple, uniqueKeys.tolist()), counts.tolist()))
+		offsets = np.array(list(itertools.product(*(range(-r, r + 1) for r in reach.tolist()))))
+
+		# the cells of every query, (queries * cells, d)
+		cells = (np.floor(queries / cellSide).astype(np.int64)[:, None, :] + offsets).reshape(-1, len(reach))
+		total = sum(buckets.get(cell, 0) for cell in map(tuple, cells.tolist()))
+
+		return total / len(queries)
+
+	def placeDpInGrid(self):
+		"""
+		Returns a dict that represents the buckets of data
+		{(quadrant tuple): array of the positions (in self.points) of the points in the quadrant}
+		The points are reordered by quadrant, so the points of a bucket are next to each other in memory
+		(the candidates of a query are a few contiguous blocks instead of random rows).
+		"""
+
+		if not len(self.points):
+			return {}
+
+		print("Distributing dataPoints...")
+
+		keys = np.floor(self.getPoints() / self.cellSide).astype(np.int64)
+
+		# sort the points by quadrant, so each bucket is a contiguous slice
+		order = np.lexsort(keys.T[::-1])
+		sortedKeys = keys[order]
+
+		changes = np.flatnonzero((sortedKeys[1:] != sortedKeys[:-1]).any(axis=1)) + 1
+		starts = np.concatenate(([0], changes))
+		ends = np.concatenate((changes, [len(order)]))
+
+		self.points = self.points[order]
+		self.ids = self.ids[order]
+		positions = np.arange(len(order))
+
+		gridDp = {}
+		for start, end in zip(starts.tolist(), ends.tolist()):
+			gridDp[tuple(sortedKeys[start].tolist())] = positions[start:end]
+
+		print("Done!\n")
+
+		return gridDp
+
+	def trackIds(self):
+		"""
+		Sorts the positions by id, the first time a point is inserted or expired
+		(the ids only grow after that, so they stay sorted)
+		"""
+
+		if self.idOrderIds is not None:
+			return
+
+		order = np.argsort(self.ids, kind="stable")
+		self.idOrderPositions = GrowableArray(np.int64)
+		self.idOrderPositions.append(order)
+		self.idOrderIds = GrowableArray(np.int64)
+		self.idOrderIds.append(self.ids[order])
+		self.idOrderStart = 0
+
+	def insert(self, ids, dataPoints):
+		"""
+		Puts new points straight in their buckets, the grid doesn't need to be rebuilt.
+		They take the slots of the expired points, self.points only grows when there are none left (by an eighth
+		at least, so it stays amortized O(1) without doubling the memory of a window a bit bigger than the first one).
+
+		:param ids:			their ids, increasing and greater than every id in the index
+		:param dataPoints:	(m, d) float matrix, without NaN
+		"""
+
+		ids = np.asarray(ids, dtype=np.int64)
+		if not len(ids):
+			return
+
+		self.trackIds()
+
+		if len(self.idOrderIds) and ids[0] <= self.idOrderIds.array[-1]:
+			raise Exception("The ids must be inserted in increasing order!")
+
+		missing = len(ids) - len(self.freePositions)
+		if missing > 0:
+			size = len(self.points)
+			capacity = size + max(missing, size // 8, 1024)
+
+			points = np.empty((capacity, self.dimensions), dtype=self.points.dtype)
+			points[:size] = self.points
+			self.points = points
+			self.ids = np.concatenate((self.ids, np.full(capacity - size, -1, dtype=np.int64)))
+			self.freePositions.extend(range(capacity - 1, size - 1, -1))
+
+		positions = np.array(self.freePositions[-len(ids):][::-1], dtype=np.int64)
+		del self.freePositions[-len(ids):]
+
+		self.points[positions] = self.encoding.encode(dataPoints)
+		self.ids[positions] = ids
+
+		# the keys come from the stored points, like in placeDpInGrid
+		keys = np.floor(self.getPoints(positions) / self.cellSide).astype(np.int64)
+		for position, key in zip(positions.tolist(), map(tuple, keys.tolist())):
+			bucket = self.gridDataPoints.get(key)
+			self.gridDataPoints[key] = np.array([position]) if bucket is None else np.append(bucket, position)
+
+		self.idOrderPositions.append(positions)
+		self.idOrderIds.append(ids)
+
+	def expireBefore(self, minId):
+		"""
+		Takes the expired points out of their buckets, so the queries don't even see them
+		(and their slots in self.points can be reused by insert)
+		"""
+
+		super().expireBefore(minId)
+		self.trackIds()
+
+		start = self.idOrderStart
+		end = start + int(np.searchsorted(self.idOrderIds.array[start:], self.minId))
+		if end == start:
+			return
+
+		expired = self.idOrderPositions.array[start:end].copy()
+		self.idOrderStart = end
+
+		keys = np.floor(self.getPoints(expired) / self.cellSide).astype(np.int64)
+		for key in set(map(tuple, keys.tolist())):
+			bucket = self.gridDataPoints[key]
+			bucket = bucket[self.ids[bucket] >= self.minId]
+
+			if len(bucket):
+				self.gridDataPoints[key] = bucket
+			else:
+				del self.gridDataPoints[key]
+
+		self.ids[expired] = -1
+		self.freePositions.extend(expired.tolist())
+
+		# drop the expired start of the id order once it's most of it, so it doesn't grow forever
+		if self.idOrderStart > len(self.idOrderIds) // 2:
+			for name in ("idOrderPositions", "idOrderIds"):
+				remaining = getattr(self, name).array[self.idOrderStart:]
+				array = GrowableArray(np.int64, capacity=max(1024, 2 * len(remaining)))
+				array.append(remaining)
+				setattr(self, name, array)
+
+			self.idOrderStart = 0
+
+	def getCloseNn(self, dataPoint):
+		"""
+		Returns the positions (in self.points) of all the points in the dataPoint's quadrant and the adjacent ones
+		"""
+
+		key = np.floor(np.asarray(dataPoint) / self.cellSide).astype(np.int64)
+		cells = map(tuple, (key + self.offsets).tolist())
+
+		buckets = [bucket for bucket in map(self.gridDataPoints.get, cells) if bucket is not None]
+
+		if instruments.enabled:
+			instruments.count("grid buckets visited", len(buckets))
+			instruments.addManyToHistogram("grid bucket size", [len(bucket) for bucket in buckets])
+
+		if not buckets:
+			return np.empty(0, dtype=np.int64)
+
+		return np.concatenate(buckets)
+
+	def occupancyStats(self, percentiles=(50, 90, 99), sampleSize=1000, seed=0):
+		"""
+		How the points are spread in the buckets, and how many candidates a query scans
+		(measured with queries on a sample of the points, so in the dense zones where the queries usually are)
+
+		:return:	{"buckets", "points", "reach", "maxBucket", "meanBucket", "p50Bucket", ...,
+					"meanCandidates", "maxCandidates"}
+		"""
+
+		sizes = np.array([len(bucket) for bucket in self.gridDataPoints.values()], dtype=np.int64)
+		if not len(sizes):
+			sizes = np.zeros(1, dtype=np.int64)
+
+		# the free slots (see insert) and the expired points are not in the buckets
+		live = np.flatnonzero(self.ids >= self.minId)
+
+		stats = {
+			"buckets": len(self.gridDataPoints),
+			"points": len(live),
+			"reach": self.reach.tolist(),
+			"maxBucket": int(sizes.max()),
+			"meanBucket": float(sizes.mean())
+		}
+
+		for percentile in percentiles:
+			stats[f"p{percentile}Bucket"] = float(np.percentile(sizes, percentile))
+
+		rng = np.random.default_rng(seed)
+		sample = rng.choice(live, min(sampleSize, len(live)), replace=False)
+		candidates = np.array([len(self.getCloseNn(point)) for point in self.getPoints(sample)], dtype=np.int64)
+
+		stats["meanCandidates"] = float(candidates.mean()) if len(candidates) else 0.0
+		stats["maxCandidates"] = int(candidates.max()) if len(candidates) else 0
+
+		return stats
+
+	def distancesTo(self, dataPoint, positions):
+		return self.metric.distances(dataPoint, self.getPoints(positions))
+
+	def query(self, dataPoint, k):
+		closeNn = self.alivePositions(self.getCloseNn(dataPoint))
+
+		if instruments.enabled:
+			instruments.count("candidates scanned", len(closeNn))
+			instruments.addToHistogram("candidates per query", len(closeNn))
+
+		if len(closeNn) < k:
+			# no enough nn
+			return None
+
+		positions, distances = self.sortedResult(closeNn, self.distancesTo(dataPoint, closeNn), k)
+
+		return self.ids[positions], distances
+
+	def queryRadius(self, dataPoint, radius):
+		if radius > self.threshold:
+			raise Exception("The grid can only answer radius queries up to the threshold!")
+
+		closeNn = self.alivePositions(self.getCloseNn(dataPoint))
+		distances = self.distancesTo(dataPoint, closeNn)
+		inside = distances <= radius
+
+		positions, distances = self.sortedResult(closeNn[inside], distances[inside])
+
+		return self.ids[positions], distances
+
+
+class KdTree(SpatialIndex):
+	def __init__(self, dataPoints, valid, leafSize=32, metric="euclidean", precision="float64"):
+		"""
+		Exact kd-tree.
+		Each node splits its points in two halves on the median of the dimension with the biggest spread.
+		The leaves hold up to leafSize points, which are compared all at once with numpy.
+		Every node also keeps the bounding box of its points, which is used to skip the nodes that
+		can't contain a better neighbour.
+
+		:param leafSize:	max number of points in a leaf
+		"""
+
+		super().__init__(dataPoints, valid, metric, precision)
+
+		self.leafSize = leafSize
+
+		# node arrays (a node is an index into them)
+		self.nodeStart = []
+		self.nodeEnd = []
+		self.nodeLeft = []
+		self.nodeRight = []
+		self.nodeMin = []
+		self.nodeMax = []
+
+		# the points get reordered so that every node is a contiguous slice of them
+		self.order = np.arange(len(self.points))
+
+		if len(self.points):
+			self.buildNode(0, len(self.points))
+
+		self.nodeMin = np.array(self.nodeMin)
+		self.nodeMax = np.array(self.nodeMax)
+		self.points = self.points[self.order]
+		self.ids = self.ids[self.order]
+
+	def buildNode(self, start, end):
+		node = len(self.nodeStart)
+		nodePoints = self.getPoints(self.order[start:end])
+
+		self.nodeStart.append(start)
+		self.nodeEnd.append(end)
+		self.nodeLeft.append(-1)
+		self.nodeRight.append(-1)
+		self.nodeMin.append(nodePoints.min(axis=0))
+		self.nodeMax.append(nodePoints.max(axis=0))
+
+		if end - start <= self.leafSize:
+			return node
+
+		# split on the median of the widest dimension
+		splitDim = int(np.argmax(self.nodeMax[node] - self.nodeMin[node]))
+		middle = (end - start) // 2
+		partition = np.argpartition(nodePoints[:, splitDim], middle)
+		self.order[start:end] = self.order[start:end][partition]
+
+		self.nodeLeft[node] = self.buildNode(start, start + middle)
+		self.nodeRight[node] = self.buildNode(start + middle, end)
+
+		return node
+
+	def boxDistance(self, dataPoint, node):
+		"""
+		Distance of the dataPoint to the bounding box of the node (0 if it's inside)
+		"""
+
+		excess = np.maximum(self.nodeMin[node] - dataPoint, 0) + np.maximum(dataPoint - self.nodeMax[node], 0)
+
+		return self.metric.lowerBound(excess)
+
+	def leafDistances(self, dataPoint, node):
+		start = self.nodeStart[node]
+		end = self.nodeEnd[node]
+		positions = self.alivePositions(np.arange(start, end))
+
+		if instruments.enabled:
+			instruments.count("candidates scanned", len(positions))
+			instruments.count("kdtree leaves visited")
+
+		return positions, self.metric.distances(dataPoint, self.getPoints(positions))
+
+	def query(self, dataPoint, k):
+		if len(self.points) < k:
+			return None
+
+		dataPoint = np.asarray(dataPoint, dtype=np.float64)
+
+		bestPositions = np.empty(0, dtype=np.int64)
+		bestDistances = np.empty(0)
+		worstDistance = np.inf
+
+		# best first search, the closest boxes get visited first
+		toVisit = [(0.0, 0)]
+		while toVisit:
+			boxDist, node = heapq.heappop(toVisit)
+
+			if boxDist > worstDistance:
+				# every other box is further away too
+				break
+
+			if self.nodeLeft[node] == -1:
+				positions, distances = self.leafDistances(dataPoint, node)
+				bestPositions, bestDistances = self.sortedResult(
+					np.concatenate((bestPositions, positions)), np.concatenate((bestDistances, distances)), k
+				)
+				if len(bestDistances) == k:
+					worstDistance = bestDistances[-1]
+				continue
+
+			for child in (self.nodeLeft[node], self.nodeRight[node]):
+				childDist = self.boxDistance(dataPoint, child)
+				if childDist <= worstDistance:
+					heapq.heappush(toVisit, (childDist, child))
+
+		if len(bestDistances) < k:
+			# too many expired points
+			return None
+
+		return self.ids[bestPositions], bestDistances
+
+	def queryRadius(self, dataPoint, radius):
+		dataPoint = np.asarray(dataPoint, dtype=np.float64)
+
+		foundPositions = []
+		foundDistances = []
+
+		toVisit = [0] if len(self.points) else []
+		while toVisit:
+			node = toVisit.pop()
+
+			if self.boxDistance(dataPoint, node) > radius:
+				continue
+
+			if self.nodeLeft[node] == -1:
+				positions, distances = self.leafDistances(dataPoint, node)
+				inside = distances <= radius
+				foundPositions.append(positions[inside])
+				foundDistances.append(distances[inside])
+				continue
+
+			toVisit.append(self.nodeLeft[node])
+			toVisit.append(self.nodeRight[node])
+
+		if not foundPositions:
+			return np.empty(0, dtype=np.int64), np.empty(0)
+
+		positions, distances = self.sortedResult(np.concatenate(foundPositions), np.concatenate(foundDistances))
+
+		return self.ids[positions], distances
+
+
+class BruteForceIndex(SpatialIndex):
+	def __init__(self, dataPoints, valid, blockSize=2 ** 22, metric="euclidean", precision="float64"):
+		"""
+		Exact knn by comparing each query with every point.
+		The distances are calculated in blocks of queries x points with numpy, and the best k of each block are
+		selected with a partial sort (argpartition), so at most blockSize distances are kept in memory.
+
+		:param blockSize:	max number of distances calculated at once
+		"""
+
+		super().__init__(dataPoints, valid, metric, precision)
+
+		self.blockSize = blockSize
+
+	def query(self, dataPoint, k):
+		if len(self.points) < k:
+			return None
+
+		indexes, distances = self.queryBatch(np.asarray(dataPoint, dtype=np.float64)[None, :], k)
+
+		if indexes[0, 0] == -1:
+			return None
+
+		return indexes[0], distances[0]
+
+	def queryRadius(self, dataPoint, radius):
+		dataPoint = np.asarray(dataPoint, dtype=np.float64)
+
+		foundPositions = []
+		foundDistances = []
+
+		for start in range(0, len(self.points), self.blockSize):
+			distances = self.metric.distances(dataPoint, self.getPoints(slice(start, start + self.blockSize)))
+			inside = self.alivePositions(np.flatnonzero(distances <= radius) + start) - start
+			foundPositions.append(inside + start)
+			foundDistances.append(distances[inside])
+
+		if not foundPositions:
+			return np.empty(0, dtype=np.int64), np.empty(0)
+
+		positions, distances = self.sortedResult(np.concatenate(foundPositions), np.concatenate(foundDistances))
+
+		return self.ids[positions], distances
+
+	def queryBatch(self, dataPoints, k, blockSize=None):
+		blockSize = blockSize or self.blockSize
+		dataPoints = np.asarray(dataPoints, dtype=np.float64)
+
+		indexes = np.full((len(dataPoints), k), -1, dtype=np.int64)
+		distances = np.full((len(dataPoints), k), np.inf)
+
+		queryRows = np.flatnonzero(~np.isnan(dataPoints).any(axis=1))
+		numOfPoints = len(self.points)
+
+		if numOfPoints < k or len(queryRows) == 0:
+			return indexes, distances
+
+		if instruments.enabled:
+			instruments.count("candidates scanned", len(queryRows) * numOfPoints)
+
+		# a block is (queries x points), with at most blockSize distances
+		pointBlock = min(numOfPoints, blockSize)
+		queryBlock = max(1, blockSize // pointBlock)
+
+		for queryStart in range(0, len(queryRows), queryBlock):
+			rows = queryRows[queryStart:queryStart + queryBlock]
+			queries = dataPoints[rows]
+
+			bestPositions = np.empty((len(rows), 0), dtype=np.int64)
+			bestBlockDistances = np.empty((len(rows), 0))
+
+			for pointStart in range(0, numOfPoints, pointBlock):
+				pointEnd = min(pointStart + pointBlock, numOfPoints)
+
+				blockDistances = self.metric.pairwise(queries, self.getPoints(slice(pointStart, pointEnd)))
+
+				if self.minId:
+					blockDistances[:, self.ids[pointStart:pointEnd] < self.minId] = np.inf
+
+				positions = np.broadcast_to(np.arange(pointStart, pointEnd), blockDistances.shape)
+				if blockDistances.shape[1] > k:
+					best = np.argpartition(blockDistances, k - 1, axis=1)[:, :k]
+					positions = np.take_along_axis(positions, best, axis=1)
+					blockDistances = np.take_along_axis(blockDistances, best, axis=1)
+
+				# merge with the best ones of the previous blocks
+				bestPositions = np.concatenate((bestPositions, positions), axis=1)
+				bestBlockDistances = np.concatenate((bestBlockDistances, blockDistances), axis=1)
+				if bestBlockDistances.shape[1] > k:
+					best = np.argpartition(bestBlockDistances, k - 1, axis=1)[:, :k]
+					bestPositions = np.take_along_axis(bestPositions, best, axis=1)
+					bestBlockDistances = np.take_along_axis(bestBlockDistances, best, axis=1)
+
+			# the block distances can lose some precision (see SquaredEuclidean.pairwise),
+			# so the distances of the winners are calculated exactly
+			bestDistances = self.metric.fromDifferences(np.abs(self.getPoints(bestPositions) - queries[:, None, :]))
+			if self.minId:
+				bestDistances[self.ids[bestPositions] < self.minId] = np.inf
+
+			order = np.argsort(bestDistances, axis=1, kind="stable")
+			indexes[rows] = self.ids[np.take_along_axis(bestPositions, order, axis=1)]
+			distances[rows] = np.take_along_axis(bestDistances, order, axis=1)
+
+		if self.minId:
+			# the rows that found expired points didn't find k neighbours
+			notFound = np.isinf(distances).any(axis=1)
+			indexes[notFound] = -1
+			distances[notFound] = np.inf
+
+		return indexes, distances
+
+
+class IvfIndex(SpatialIndex):
+	def __init__(self, dataPoints, valid, lists=None, probes=8, metric="euclidean", iterations=10, seed=0,
+				 blockSize=2 ** 22, precision="float64"):
+		"""
+		Approximate knn with an inverted file: the points are grouped in lists around centroids (found with k-means),
+		and a query only compares the points of the lists with the closest centroids.
+		The neighbours that are in the other lists are missed, so it's faster but not exact:
+		the more lists are probed, the more accurate (and slower) it gets (see approxEval.py to measure it).
+
+		:param lists:		number of lists (default: sqrt of the number of points)
+		:param probes:		number of lists compared for each query, the accuracy knob
+		:param iterations:	k-means iterations
+		:param seed:		seed of the k-means initialization, so the index is always the same
+		:param blockSize:	max number of distances calculated at once
+		"""
+
+		super().__init__(dataPoints, valid, metric, precision)
+
+		self.numOfLists = max(1, min(len(self.points), lists or int(np.sqrt(len(self.points)))))
+		self.probes = max(1, min(probes, self.numOfLists))
+		self.blockSize = blockSize
+
+		if not len(self.points):
+			self.centroids = np.empty((0, self.dimensions))
+			self.listStarts = np.zeros(1, dtype=np.int64)
+			return
+
+		self.centroids = self.trainCentroids(iterations, seed)
+
+		# sort the points by list, so each list is a contiguous slice
+		assignment = self.nearestCentroids(self.getPoints(), 1)[:, 0]
+		order = np.argsort(assignment, kind="stable")
+		self.points = self.points[order]
+		self.ids = self.ids[order]
+		self.listStarts = np.searchsorted(assignment[order], np.arange(self.numOfLists + 1))
+
+	def trainCentroids(self, iterations, seed):
+		"""
+		K-means on a sample of the points
+		"""
+
+		rng = np.random.default_rng(seed)
+		sample = self.getPoints(rng.choice(len(self.points), min(len(self.points), 64 * self.numOfLists), replace=False))
+		centroids = sample[:self.numOfLists].copy()
+
+		for _ in range(iterations):
+			assignment = self.nearestCentroids(sample, 1, centroids)[:, 0]
+			counts = np.bincount(assignment, minlength=self.numOfLists)
+
+			sums = np.column_stack([
+				np.bincount(assignment, weights=sample[:, dim], minlength=self.numOfLists) for dim in range(self.dimensions)
+			])
+
+			# the empty clusters keep their centroid
+			filled = counts > 0
+			centroids[filled] = sums[filled] / counts[filled, None]
+
+		return centroids
+
+	def nearestCentroids(self, points, count, centroids=None):
+		"""
+		Returns the (m, count) closest centroids of each point (not sorted)
+		"""
+
+		if centroids is None:
+			centroids = self.centroids
+
+		nearest = np.empty((len(points), count), dtype=np.int64)
+		rowBlock = max(1, self.blockSize // len(centroids))
+
+		for start in range(0, len(points), rowBlock):
+			distances = self.metric.pairwise(points[start:start + rowBlock], centroids)
+
+			if count == 1:
+				nearest[start:start + rowBlock] = distances.argmin(axis=1)[:, None]
+			elif count < len(centroids):
+				nearest[start:start + rowBlock] = np.argpartition(distances, count - 1, axis=1)[:, :count]
+			else:
+				nearest[start:start + rowBlock] = np.argsort(distances, axis=1)[:, :count]
+
+		return nearest
+
+	def listPositions(self, lists):
+		return np.concatenate([np.arange(self.listStarts[l], self.listStarts[l + 1]) for l in lists])
+
+	def query(self, dataPoint, k):
+		if len(self.points) < k:
+			return None
+
+		dataPoint = np.asarray(dataPoint, dtype=np.float64)
+		positions = self.alivePositions(self.listPositions(self.nearestCentroids(dataPoint[None, :], self.probes)[0]))
+
+		if instruments.enabled:
+			instruments.count("candidates scanned", len(positions))
+			instruments.addToHistogram("candidates per query", len(positions))
+
+		if len(positions) < k:
+			# no enough nn in the probed lists
+			return None
+
+		positions, distances = self.sortedResult(positions, self.metric.distances(dataPoint, self.getPoints(positions)), k)
+
+		return self.ids[positions], distances
+
+	def queryRadius(self, dataPoint, radius):
+		dataPoint = np.asarray(dataPoint, dtype=np.float64)
+		positions = self.alivePositions(self.listPositions(self.nearestCentroids(dataPoint[None, :], self.probes)[0]))
+		distances = self.metric.distances(dataPoint, self.getPoints(positions))
+		inside = distances <= radius
+
+		positions, distances = self.sortedResult(positions[inside], distances[inside])
+
+		return self.ids[positions], distances
+
+	def queryBatch(self, dataPoints, k, blockSize=None):
+		"""
+		Same as the default queryBatch, but it goes list by list: every list is compared at once with all the
+		queries that probe it
+		"""
+
+		blockSize = blockSize or self.blockSize
+		dataPoints = np.asarray(dataPoints, dtype=np.float64)
+
+		indexes = np.full((len(dataPoints), k), -1, dtype=np.int64)
+		distances = np.full((len(dataPoints), k), np.inf)
+
+		queryRows = np.flatnonzero(~np.isnan(dataPoints).any(axis=1))
+
+		if len(self.points) < k or len(queryRows) == 0:
+			return indexes, distances
+
+		queries = dataPoints[queryRows]
+		bestPositions = np.zeros((len(queries), k), dtype=np.int64)
+		bestDistances = np.full((len(queries), k), np.inf)
+
+		# the queries of each list
+		probes = self.nearestCentroids(queries, self.probes).ravel()
+		probeOrder = np.argsort(probes, kind="stable")
+		probeRows = probeOrder // self.probes
+		probeStarts = np.searchsorted(probes[probeOrder], np.arange(self.numOfLists + 1))
+
+		for l in range(self.numOfLists):
+			start, end = self.listStarts[l], self.listStarts[l + 1]
+			listRows = probeRows[probeStarts[l]:probeStarts[l + 1]]
+			if start == end or not len(listRows):
+				continue
+
+			rowBlock = max(1, blockSize // (end - start))
+			listPoints = self.getPoints(slice(start, end))
+
+			if instruments.enabled:
+				instruments.count("candidates scanned", len(listRows) * (end - start))
+
+			for blockStart in range(0, len(listRows), rowBlock):
+				rows = listRows[blockStart:blockStart + rowBlock]
+				listDistances = self.metric.pairwise(queries[rows], listPoints)
+
+				if self.minId:
+					listDistances[:, self.ids[start:end] < self.minId] = np.inf
+
+				# merge with the best ones of the lists before
+				candidatePositions = np.concatenate(
+					(bestPositions[rows], np.broadcast_to(np.arange(start, end), listDistances.shape)), axis=1
+				)
+				candidateDistances = np.concatenate((bestDistances[rows], listDistances), axis=1)
+
+				best = np.argpartition(candidateDistances, k - 1, axis=1)[:, :k]
+				bestPositions[rows] = np.take_along_axis(candidatePositions, best, axis=1)
+				bestDistances[rows] = np.take_along_axis(candidateDistances, best, axis=1)
+
+		# exact distances of the winners (see BruteForceIndex.queryBatch)
+		found = ~np.isinf(bestDistances)
+		bestDistances = np.where(
+			found, self.metric.fromDifferences(np.abs(self.getPoints(bestPositions) - queries[:, None, :])), np.inf
+		)
+
+		order = np.argsort(bestDistances, axis=1, kind="stable")
+		indexes[queryRows] = self.ids[np.take_along_axis(bestPositions, order, axis=1)]
+		distances[queryRows] = np.take_along_axis(bestDistances, order, axis=1)
+
+		# less than k neighbours in the probed lists
+		notFound = np.isinf(distances).any(axis=1)
+		indexes[notFound] = -1
+		distances[notFound] = np.inf
+
+		return indexes, distances
+
+
+def shardQueryBatch(index, dataPoints, k, blockSize=None, alive=None):
+	"""
+	Like index.queryBatch, but the rows that have less than k neighbours in the shard keep the ones they have,
+	since the other shards (or the inserted dataPoints of a SlidingWindowIndex) might have the rest.
+	With the grid those are the points of the adjacent cubes, with the other indexes every point that is not expired
+	(a shard only runs out of neighbours when most of it is expired).
+
+	:param alive:	number of points of the index that are not expired, if the caller already knows it
+	"""
+
+	queryRows = ~np.isnan(dataPoints).any(axis=1)
+
+	if isinstance(index, GridIndex):
+		indexes = np.full((len(dataPoints), k), -1, dtype=np.int64)
+		distances = np.full((len(dataPoints), k), np.inf)
+
+		for row in np.flatnonzero(queryRows):
+			closeNn = index.alivePositions(index.getCloseNn(dataPoints[row]))
+			positions, rowDistances = index.sortedResult(closeNn, index.distancesTo(dataPoints[row], closeNn), k)
+
+			indexes[row, :len(positions)] = index.ids[positions]
+			distances[row, :len(positions)] = rowDistances
+
+		return indexes, distances
+
+	if alive is None:
+		# the kdtree and the ivf reorder their ids, so they are not sorted
+		alive = int(np.count_nonzero(index.ids >= index.minId))
+
+	if alive >= k:
+		indexes, distances = index.queryBatch(dataPoints, k, blockSize)
+	else:
+		indexes = np.full((len(dataPoints), k), -1, dtype=np.int64)
+		distances = np.full((len(dataPoints), k), np.inf)
+
+		if not alive:
+			return indexes, distances
+
+	for row in np.flatnonzero(queryRows & (indexes[:, 0] == -1)):
+		ids, rowDistances = index.queryRadius(dataPoints[row], np.inf)
+
+		indexes[row, :min(len(ids), k)] = ids[:k]
+		distances[row, :min(len(ids), k)] = rowDistances[:k]
+
+	return indexes, distances
+
+
+def shardWorker(spec, start, end, knnParams, connection):
+	"""
+	Process of a shard: builds the index of the training dataPoints from start to end and answers the queries
+	of the ShardedIndex until it gets "stop"
+	"""
+
+	arrays, blocks = attachArrays(spec)
+
+	try:
+		valid = np.zeros(len(arrays["valid"]), dtype=bool)
+		valid[start:end] = arrays["valid"][start:end]
+
+		# the ids of the shard are the ones of all the training dataPoints, so its results don't need to be mapped
+		with contextlib.redirect_stdout(io.StringIO()):
+			index = buildIndex(arrays["dataPoints"], valid, knnParams)
+
+		connection.send("ready")
+
+		while True:
+			request = connection.recv()
+
+			try:
+				if request[0] == "stop":
+					break
+				elif request[0] == "queryBatch":
+					connection.send(shardQueryBatch(index, *request[1:]))
+				elif request[0] == "queryRadius":
+					connection.send(index.queryRadius(*request[1:]))
+				elif request[0] == "expireBefore":
+					index.expireBefore(request[1])
+					connection.send(None)
+			except Exception:
+				connection.send(("error", traceback.format_exc()))
+	finally:
+		connection.close()
+		for block in blocks:
+			block.close()
+
+
+class ShardedIndex(SpatialIndex):
+	def __init__(self, dataPoints, valid, knnParams, shards=None, shardIndex="kdtree"):
+		"""
+		Splits the training dataPoints in shards, each with its own index in its own process, so the queries use
+		every core. The dataPoints are put in shared memory once, every process builds the index of its slice.
+		Every query goes to all the shards at once, and their k nearest neighbours are merged into the best k.
+		With an exact shard index (kdtree, brute or grid) the results are the same as the unsharded index.
+
+		Call close() when it's not needed anymore, to stop the processes and free the shared memory.
+
+		:param knnParams:	the params of the shard indexes (metric, threshold, ...)
+		:param shards:		number of shards (and processes), default: one per cpu
+		:param shardIndex:	the index of each shard (any index except "sharded")
+		"""
+
+		# the points are only in the shards
+		self.metric = getMetric(knnParams.get("metric", "euclidean"))
+		self.ids = np.flatnonzero(valid)
+		self.points = None
+		self.dimensions = dataPoints.shape[1]
+		self.minId = 0
+
+		shards = max(1, min(shards or os.cpu_count(), len(self.ids)))
+
+		# the encoding is fitted on all the points, so every shard stores them the same way (int16 fits a range)
+		precision = knnParams.get("precision", "float64")
+		shardParams = dict(knnParams, index=shardIndex, precision=getEncoding(precision, dataPoints[self.ids]))
+
+		# with float32 the shared dataPoints are already the ones the shards store
+		sharedType = np.float32 if precision == "float32" else np.float64
+		self.sharedArrays = SharedArrays({"dataPoints": np.asarray(dataPoints, dtype=sharedType), "valid": valid})
+
+		# the shards are contiguous slices of the valid dataPoints, with the same number of them
+		self.connections = []
+		self.processes = []
+		for shardIds in np.array_split(self.ids, shards):
+			start, end = (int(shardIds[0]), int(shardIds[-1]) + 1) if len(shardIds) else (0, 0)
+
+			connection, workerConnection = multiprocessing.Pipe()
+			process = multiprocessing.Process(
+				target=shardWorker, args=(self.sharedArrays.spec, start, end, shardParams, workerConnection), daemon=True
+			)
+			process.start()
+			workerConnection.close()
+
+			self.connections.append(connection)
+			self.processes.append(process)
+
+		# the shards are built in parallel
+		for connection in self.connections:
+			connection.recv()
+
+	def close(self):
+		for connection, process in zip(self.connections, self.processes):
+			with contextlib.suppress(OSError):
+				connection.send(("stop",))
+			process.join()
+			connection.close()
+
+		self.connections = []
+		self.processes = []
+		self.sharedArrays.release()
+
+	def askShards(self, *request):
+		"""
+		Sends the request to every shard, then waits for all the answers
+		"""
+
+		if not self.connections:
+			raise Exception("The sharded index was closed!")
+
+		for connection in self.connections:
+			connection.send(request)
+
+		answers = [connection.recv() for connection in self.connections]
+
+		for answer in answers:
+			if isinstance(answer, tuple) and len(answer) == 2 and isinstance(answer[0], str) and answer[0] == "error":
+				raise Exception(f"A shard failed:\n{answer[1]}")
+
+		return answers
+
+	def expireBefore(self, minId):
+		super().expireBefore(minId)
+		self.askShards("expireBefore", minId)
+
+	@staticmethod
+	def mergeTopK(results, k):
+		"""
+		Merges the k nearest neighbours of every shard into the k nearest neighbours of all of them
+
+		:param results:	[(indexes, distances)] of every shard, (m, k) arrays
+		:return:		(indexes, distances), the rows with less than k neighbours in total have index -1 and distance inf
+		"""
+
+		indexes = np.concatenate([result[0] for result in results], axis=1)
+		distances = np.concatenate([result[1] for result in results], axis=1)
+
+		if distances.shape[1] > k:
+			best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+			indexes = np.take_along_axis(indexes, best, axis=1)
+			distances = np.take_along_axis(distances, best, axis=1)
+
+		order = np.argsort(distances, axis=1, kind="stable")
+		indexes = np.take_along_axis(indexes, order, axis=1)
+		distances = np.take_along_axis(distances, order, axis=1)
+
+		notFound = np.isinf(distances).any(axis=1)
+		indexes[notFound] = -1
+		distances[notFound] = np.inf
+
+		return indexes, distances
+
+	def query(self, dataPoint, k):
+		indexes, distances = self.queryBatch(np.asarray(dataPoint, dtype=np.float64)[None, :], k)
+
+		if indexes[0, 0] == -1:
+			return None
+
+		return indexes[0], distances[0]
+
+	def queryRadius(self, dataPoint, radius):
+		results = self.askShards("queryRadius", np.asarray(dataPoint, dtype=np.float64), radius)
+
+		return self.sortedResult(
+			np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+		)
+
+	def queryBatch(self, dataPoints, k, blockSize=None):
+		if instruments.enabled:
+			start = time.perf_counter()
+
+		result = self.mergeTopK(self.askShards("queryBatch", np.asarray(dataPoints, dtype=np.float64), k, blockSize), k)
+
+		if instruments.enabled:
+			instruments.addTime("sharded query", start)
+
+		return result
+
+
+# the indexes that can be chosen with knnConfig["index"]
+spatialIndexes = {
+	"grid": lambda dataPoints, valid, knnParams: GridIndex(
+		dataPoints, valid, knnParams["threshold"], knnParams.get("metric", "euclidean"),
+		knnParams.get("precision", "float64"), knnParams.get("cellSize", "threshold"),
+		knnParams.get("targetOccupancy", 32), knnParams.get("maxReach", 2)
+	),
+	"kdtree": lambda dataPoints, valid, knnParams: KdTree(
+		dataPoints, valid, knnParams.get("leafSize", 32), knnParams.get("metric", "euclidean"),
+		knnParams.get("precision", "float64")
+	),
+	"brute": lambda dataPoints, valid, knnParams: BruteForceIndex(
+		dataPoints, valid, knnParams.get("blockSize", 2 ** 22), knnParams.get("metric", "euclidean"),
+		knnParams.get("precision", "float64")
+	),
+	"ivf": lambda dataPoints, valid, knnParams: IvfIndex(
+		dataPoints, valid, knnParams.get("lists"), knnParams.get("probes", 8), knnParams.get("metric", "euclidean"),
+		blockSize=knnParams.get("blockSize", 2 ** 22), precision=knnParams.get("precision", "float64")
+	),
+	"sharded": lambda dataPoints, valid, knnParams: ShardedIndex(
+		dataPoints, valid, knnParams, knnParams.get("shards"), knnParams.get("shardIndex", "kdtree")
+	)
+}
+
+
+def buildIndex(dataPoints, valid, knnParams):
+	"""
+	Builds the spatial index chosen in the knn params ("index", default: grid), with the metric of the knn params
+	("metric", default: euclidean)
+	"""
+
+	indexName = knnParams.get("index", "grid")
+
+	if indexName not in spatialIndexes:
+		raise Exception(f"Unknown spatial index: {indexName}")
+
+	return spatialIndexes[indexName](dataPoints, valid, knnParams)
+
+
+class SlidingWindowIndex(SpatialIndex):
+	def __init__(self, dataPoints, valid, knnParams, bufferSize=4096, maxPartSize=2 ** 15):
+		"""
+		Index over a training window that moves: new dataPoints can be inserted and the old ones expired,
+		without ever rebuilding the whole index.
+
+		With the grid the new dataPoints go straight in their buckets and the expired ones are taken out of them
+		(see GridIndex.insert and GridIndex.expireBefore), so both cost O(1) per dataPoint.
+
+		The other indexes can't take new points, so the dataPoints are split in parts, each a static index over
+		consecutive ids (the logarithmic method):
+			- the new dataPoints wait in a buffer of up to bufferSize, which is compared one by one (with numpy)
+			- a full buffer becomes a new part, merged right away with the newest parts that are at most twice its
+			  size (as long as the merged part isn't bigger than maxPartSize), so the parts get bigger going back
+			  in time: about n / maxPartSize full parts and O(log(maxPartSize / bufferSize)) smaller ones
+			- the expiry drops the oldest parts once they are all expired, and builds again the ones that are more
+			  than half expired with their live dataPoints
+		A dataPoint is built again O(log(maxPartSize / bufferSize)) times in total, and a kline never costs more
+		than building one part of maxPartSize, whatever the size of the window.
+		A query asks every part (and the buffer) for its k nearest, and merges them.
+
+		With a reduced precision (see precision.py) every part fits its own encoding, but the grid keeps the one of
+		the first dataPoints: with int16 the inserted coordinates outside of its range are clipped.
+
+		:param dataPoints:		(n, d) float matrix, the ids are the row numbers
+		:param valid:			(n,) bool mask of the dataPoints to put in the index right away
+		:param knnParams:		used to build the grid or the parts (see buildIndex), any index except "sharded"
+		:param bufferSize:		number of new dataPoints that are compared one by one before they become a part
+		:param maxPartSize:		max number of dataPoints of a part (also the size of the parts of the first dataPoints)
+		"""
+
+		if knnParams.get("index", "grid") == "sharded":
+			# every part would need its own processes
+			raise Exception("The sliding window index can't use the sharded index, choose the index of the shards instead!")
+
+		# the points are in the grid or in the parts
+		self.metric = getMetric(knnParams.get("metric", "euclidean"))
+		self.ids = np.flatnonzero(valid)
+		self.points = None
+		self.dimensions = dataPoints.shape[1]
+		self.minId = 0
+
+		self.knnParams = knnParams
+		self.bufferSize = bufferSize
+		self.maxPartSize = maxPartSize
+		self.lastId = int(self.ids[-1]) if len(self.ids) else -1
+
+		# the ids are inserted in increasing order, so they stay sorted
+		self.bufferIds = GrowableArray(np.int64)
+		self.bufferPoints = GrowableArray(np.float64, (self.dimensions,))
+
+		if knnParams.get("index", "grid") == "grid":
+			self.grid = buildIndex(dataPoints, valid, knnParams)
+			# now rather than at the first insert, which is usually in the middle of a live decision
+			self.grid.trackIds()
+			self.parts = []
+		else:
+			self.grid = None
+			# from the oldest to the newest
+			self.parts = [
+				self.buildPart(partIds, dataPoints[partIds])
+				for partIds in np.array_split(self.ids, max(1, -(-len(self.ids) // maxPartSize))) if len(partIds)
+			]
+
+	def __len__(self):
+		return len(self.liveIds())
+
+	def buildPart(self, ids, points):
+		"""
+		Builds the static index of a part
+
+		:param ids:		(n,) increasing ids of the dataPoints
+		:param points:	(n, d) float matrix of the dataPoints
+		"""
+
+		part = buildIndex(points, np.ones(len(points), dtype=bool), self.knnParams)
+		# the part is built over the rows of points, so its ids are remapped to the real ones
+		part.ids = ids[part.ids]
+		part.minId = self.minId
+		part.sortedIds = ids
+
+		return part
+
+	def partContent(self, part):
+		"""
+		Ids (increasing) and float64 points of the live dataPoints of a part
+		"""
+
+		positions = np.flatnonzero(part.ids >= self.minId)
+		positions = positions[np.argsort(part.ids[positions], kind="stable")]
+
+		return part.ids[positions], part.getPoints(positions)
+
+	def aliveInPart(self, part):
+		return len(part.sortedIds) - int(np.searchsorted(part.sortedIds, self.minId))
+
+	def liveIds(self):
+		if self.grid is not None:
+			return np.sort(self.grid.ids[self.grid.ids >= self.minId])
+
+		ids = [part.sortedIds[np.searchsorted(part.sortedIds, self.minId):] for part in self.parts]
+		ids.append(self.bufferIds.array[np.searchsorted(self.bufferIds.array, self.minId):])
+
+		return np.concatenate(ids)
+
+	def flushBuffer(self):
+		"""
+		Turns the live dataPoints of the buffer into a part, merged with the newest parts that are at most
+		twice its size (as long as the merged part is not bigger than maxPartSize)
+		"""
+
+		start = np.searchsorted(self.bufferIds.array, self.minId)
+		ids = self.bufferIds.array[start:].copy()
+		points = self.bufferPoints.array[start:].copy()
+
+		self.bufferIds = GrowableArray(np.int64)
+		self.bufferPoints = GrowableArray(np.float64, (self.dimensions,))
+
+		for chunk in range(0, len(ids), self.maxPartSize):
+			chunkIds = ids[chunk:chunk + self.maxPartSize]
+			chunkPoints = points[chunk:chunk + self.maxPartSize]
+
+			size = len(chunkIds)
+			merged = 0
+			for part in reversed(self.parts):
+				partSize = self.aliveInPart(part)
+				if 2 * size < partSize or size + partSize > self.maxPartSize:
+					break
+
+				size += partSize
+				merged += 1
+
+			if merged:
+				contents = [self.partContent(part) for part in self.parts[-merged:]]
+				del self.parts[-merged:]
+
+				chunkIds = np.concatenate([content[0] for content in contents] + [chunkIds])
+				chunkPoints = np.concatenate([content[1] for content in contents] + [chunkPoints])
+
+			self.parts.append(self.buildPart(chunkIds, chunkPoints))
+
+	def compact(self):
+		"""
+		Turns the buffer into a part right away (before a big batch of queries, so they don't all go through the
+		buffered dataPoints one by one). The grid has no buffer.
+		"""
+
+		if self.grid is None and len(self.bufferIds):
+			self.flushBuffer()
+
+	def insert(self, ids, dataPoints):
+		"""
+		Adds dataPoints to the index
+
+		:param ids:			their ids, greater than every id inserted before
+		:param dataPoints:	(m, d) float matrix
+		"""
+
+		ids = np.asarray(ids, dtype=np.int64)
+		if not len(ids):
+			return
+
+		if ids[0] <= self.lastId:
+			raise Exception("The ids must be inserted in increasing order!")
+
+		self.lastId = int(ids[-1])
+
+		if self.grid is not None:
+			self.grid.insert(ids, dataPoints)
+			return
+
+		self.bufferIds.append(ids)
+		self.bufferPoints.append(dataPoints)
+
+		if len(self.bufferIds) >= self.bufferSize:
+			self.flushBuffer()
+
+	def expireBefore(self, minId):
+		super().expireBefore(minId)
+
+		if self.grid is not None:
+			self.grid.expireBefore(self.minId)
+			return
+
+		for part in self.parts:
+			part.expireBefore(self.minId)
+
+		# the parts are in id order, so the expired ones are the first ones
+		while self.parts and self.parts[0].sortedIds[-1] < self.minId:
+			self.parts.pop(0)
+
+		for position, part in enumerate(self.parts):
+			alive = self.aliveInPart(part)
+			if alive == len(part.sortedIds):
+				break
+
+			if 2 * alive < len(part.sortedIds):
+				self.parts[position] = self.buildPart(*self.partContent(part))
+
+	def bufferResult(self, dataPoints, k, blockSize=None):
+		"""
+		k nearest neighbours of every dataPoint among the live buffered dataPoints, (m, k) arrays like
+		shardQueryBatch (the rows keep the neighbours they have even if they are less than k)
+		"""
+
+		indexes = np.full((len(dataPoints), k), -1, dtype=np.int64)
+		distances = np.full((len(dataPoints), k), np.inf)
+
+		start = np.searchsorted(self.bufferIds.array, self.minId)
+		bufferIds = self.bufferIds.array[start:]
+		bufferPoints = self.bufferPoints.array[start:]
+		found = min(k, len(bufferIds))
+
+		rows = np.flatnonzero(~np.isnan(dataPoints).any(axis=1)) if found else np.empty(0, dtype=np.int64)
+		queryBlock = max(1, (blockSize or 2 ** 22) // len(bufferIds)) if found else 1
+
+		for blockStart in range(0, len(rows), queryBlock):
+			blockRows = rows[blockStart:blockStart + queryBlock]
+			blockDistances = self.metric.fromDifferences(np.abs(dataPoints[blockRows][:, None, :] - bufferPoints))
+
+			best = np.argpartition(blockDistances, found - 1, axis=1)[:, :found]
+			indexes[blockRows, :found] = bufferIds[best]
+			distances[blockRows, :found] = np.take_along_axis(blockDistances, best, axis=1)
+
+		return indexes, distances
+
+	def query(self, dataPoint, k):
+		if self.grid is not None:
+			return self.grid.query(dataPoint, k)
+
+		indexes, distances = self.queryBatch(np.asarray(dataPoint, dtype=np.float64)[None, :], k)
+
+		if indexes[0, 0] == -1:
+			return None
+
+		return indexes[0], distances[0]
+
+	def queryBatch(self, dataPoints, k, blockSize=None):
+		if self.grid is not None:
+			return self.grid.queryBatch(dataPoints, k, blockSize)
+
+		# every part keeps the neighbours it has even if they are less than k, the other parts might have the rest
+		results = [shardQueryBatch(part, dataPoints, k, blockSize, self.aliveInPart(part)) for part in self.parts]
+
+		if len(self.bufferIds):
+			results.append(self.bufferResult(dataPoints, k, blockSize))
+
+		if not results:
+			return np.full((len(dataPoints), k), -1, dtype=np.int64), np.full((len(dataPoints), k), np.inf)
+
+		return ShardedIndex.mergeTopK(results, k)
+
+	def queryRadius(self, dataPoint, radius):
+		if self.grid is not None:
+			return self.grid.queryRadius(dataPoint, radius)
+
+		dataPoint = np.asarray(dataPoint, dtype=np.float64)
+		results = [part.queryRadius(dataPoint, radius) for part in self.parts]
+
+		start = np.searchsorted(self.bufferIds.array, self.minId)
+		bufferDistances = self.metric.distances(dataPoint, self.bufferPoints.array[start:])
+		inside = bufferDistances <= radius
+		results.append((self.bufferIds.array[start:][inside], bufferDistances[inside]))
+
+		return self.sortedResult(
+			np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+		)
@@ -0,0 +1,197 @@
+"""
+Parameter sweep: runs a backtest for every combination of the given parameters, in parallel.
+
+The klines and their dataPoints are calculated once and put in shared memory, so the worker processes
+don't copy them. Every combination gets its own copy of the config dicts (knnConfig, positionSimConfig and
+actualPositionConfig with the swept values), so the workers never read or change the module-level ones.
+The results of all the combinations are written in one csv table.
+"""
+
+import contextlib
+import copy
+import csv
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import knnConfig, positionSimConfig, actualPositionConfig
+from dataGetter import getCryptoDataBinance
+from decisionMaker import Knn
+from indicators import extractFeatures
+from klineStore import KlineStore, klineColumns
+from loadingBar import loadingBar
+from sharedArrays import SharedArrays, attachArrays
+from vectorBacktest import VectorBacktest
+
+
+# the configs that can be swept, by the name used in the parameter grid
+sweepConfigs = {
+    "knn": knnConfig,
+    "positionSim": positionSimConfig,
+    "actualPosition": actualPositionConfig
+}
+
+# the data of the worker process, set by initWorker
+workerData = {}
+
+
+def getCombinations(paramGrid):
+    """
+    Returns every combination of the parameter grid.
+
+    :param paramGrid:   {"knn": {"k": [3, 5], "threshold": [0.5, 1]}, "positionSim": {"sl": [0.1, 0.2]}, ...}
+    :return:            [{"knn": {...}, "positionSim": {...}, "actualPosition": {...}}, ...]
+                        each one is a full copy of the configs, with the swept values in it
+    """
+
+    sweptKeys = []
+    for configName, params in paramGrid.items():
+        if configName not in sweepConfigs:
+            raise Exception(f"Unknown config: {configName} (must be one of {list(sweepConfigs)})")
+
+        for key in params:
+            sweptKeys.append((configName, key))
+
+    combinations = []
+    for values in itertools.product(*[paramGrid[configName][key] for configName, key in sweptKeys]):
+        combination = {configName: copy.deepcopy(config) for configName, config in sweepConfigs.items()}
+
+        for (configName, key), value in zip(sweptKeys, values):
+            combination[configName][key] = value
+
+        combinations.append(combination)
+
+    return combinations
+
+
+def shareKlines(prefix, klines, features):
+    arrays = {f"{prefix} {key}": klines.columns[key] for key in klineColumns}
+    arrays[f"{prefix} dataPoints"] = features[0]
+    arrays[f"{prefix} valid"] = features[1]
+
+    return arrays
+
+
+def attachedKlines(prefix, arrays):
+    klines = KlineStore({key: arrays[f"{prefix} {key}"] for key in klineColumns})
+    features = (arrays[f"{prefix} dataPoints"], arrays[f"{prefix} valid"])
+
+    return klines, features
+
+
+def initWorker(spec):
+    arrays, blocks = attachArrays(spec)
+
+    # the blocks have to stay alive as long as the arrays are used
+    workerData["blocks"] = blocks
+    workerData["train"] = attachedKlines("train", arrays)
+    workerData["sim"] = attachedKlines("sim", arrays)
+
+
+def runCombination(combination, maxOpenPositions):
+    """
+    Runs the backtest of one combination (in a worker process)
+
+    :return:    the stats of the backtest
+    """
+
+    start = time.time()
+    trainKlines, trainFeatures = workerData["train"]
+    simKlines, simFeatures = workerData["sim"]
+
+    # the workers don't print anything, the progress is shown by the main process
+    with contextlib.redirect_stdout(io.StringIO()):
+        brain = Knn(
+            trainKlines, simKlines,
+            knnParams=combination["knn"],
+            positionParams=combination["positionSim"],
+            actualPositionParams=combination["actualPosition"],
+            trainFeatures=trainFeatures,
+            simFeatures=simFeatures
+        )
+        with brain:
+            backtest = VectorBacktest(
+                simKlines, brain, maxOpenPositions=maxOpenPositions, positionParams=combination["actualPosition"]
+            )
+
+    stats = backtest.stats
+
+    return {
+        "netProfit": stats["netProfit"],
+        "profitFactor": stats["profitFactor"],
+        "grossProfit": stats["grossProfit"],
+        "grossLoss": stats["grossLoss"],
+        "maxDrawdown": stats["maxDrawdown"],
+        "positions": len(stats["totPositions"]),
+        "longPositions": len(stats["longPositions"]),
+        "shortPositions": len(stats["shortPositions"]),
+        "winningPositions": len(stats["winningPositions"]),
+        "losingPositions": len(stats["losingPositions"]),
+        "seconds": round(time.time() - start, 3)
+    }
+
+
+def runSweep(trainKlines, simKlines, paramGrid, resultsPath="sweepResults.csv", workers=None, maxOpenPositions=1):
+    """
+    Backtests every combination of the parameter grid on a pool of processes.
+
+    :param trainKlines:         the training klines (KlineStore)
+    :param simKlines:           the simulation klines (KlineStore)
+    :param paramGrid:           the values to try for each parameter (see getCombinations)
+    :param resultsPath:         where to write the results table (csv)
+    :param workers:             number of processes (default: number of cpus)
+    :param maxOpenPositions:    passed to the backtest
+    :return:                    the rows of the results table, in the same order as the combinations
+    """
+
+    combinations = getCombinations(paramGrid)
+    sweptKeys = [(configName, key) for configName, params in paramGrid.items() for key in params]
+
+    print(f"Sweeping {len(combinations)} combinations...")
+
+    # the dataPoints don't depend on the parameters, so they are calculated only once
+    arrays = shareKlines("train", trainKlines, extractFeatures(trainKlines))
+    arrays.update(shareKlines("sim", simKlines, extractFeatures(simKlines)))
+
+    rows = [None] * len(combinations)
+
+    with SharedArrays(arrays) as sharedArrays:
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=initWorker, initargs=(sharedArrays.spec,)) as executor:
+            futures = {
+                executor.submit(runCombination, combination, maxOpenPositions): index
+                for index, combination in enumerate(combinations)
+            }
+
+            for done, future in enumerate(as_completed(futures)):
+                index = futures[future]
+                row = {f"{configName}.{key}": combinations[index][configName][key] for configName, key in sweptKeys}
+                row.update(future.result())
+                rows[index] = row
+
+                loadingBar(done + 1, len(combinations), "Sweep:")
+
+    print("\nDone!\n")
+
+    with open(resultsPath, "w", newline="") as resultsFile:
+        writer = csv.DictWriter(resultsFile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"Results written to {resultsPath}")
+
+    return rows
+
+
+if __name__ == '__main__':
+    klines = getCryptoDataBinance()
+
+    runSweep(
+        klines[:500000],
+        klines[509200:519280],
+        {
+            "knn": {"k": [3, 5, 7], "threshold": [0.5, 1, 2], "sameDirectionRatio": [0.6, 0.8, 1]},
+            "positionSim": {"sl": [0.1, 0.2], "tp": [0.2, 0.3], "maxLength": [25, 50]}
+        }
+    )
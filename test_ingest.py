@@ -0,0 +1,45 @@
+"""
+Checks of the Binance dump ingestion (python -m pytest test_ingest.py)
+"""
+
+import os
+
+from ingest import parseDump, ingestBinance
+
+
+def writeDump(folder, numOfKlines, brokenRow=None):
+	"""
+	Writes a 1m dump with numOfKlines klines, with brokenRow (a line of text) in the middle of them
+	"""
+
+	lines = [
+		f"{1672531200000 + i * 60000},100.0,101.0,99.0,100.5,12.5,{1672531259999 + i * 60000},1250.0,10,6.0,600.0,0"
+		for i in range(numOfKlines)
+	]
+	if brokenRow is not None:
+		lines.insert(numOfKlines // 2, brokenRow)
+
+	filePath = os.path.join(folder, "BTCUSDT-1m-2023-01.csv")
+	with open(filePath, "w") as csvFile:
+		csvFile.write("\n".join(lines) + "\n")
+
+	return filePath
+
+
+def test_shortRowIsDropped(tmp_path):
+	columns, report = parseDump(writeDump(str(tmp_path), 2900, "garbage,row"))
+
+	assert len(columns["timestamp"]) == 2900
+	assert report["invalid"] == 1
+
+
+def test_monthWithShortRowIsIngested(tmp_path):
+	writeDump(str(tmp_path), 2900, "garbage,row")
+
+	reports = ingestBinance([str(tmp_path)], workers=1)
+	report = reports["BTCUSDT-1m"]
+
+	assert report["failed"] == []
+	assert report["files"] == 1
+	assert report["klines"] == 2900
+	assert report["invalid"] == 1
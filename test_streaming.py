@@ -0,0 +1,46 @@
+"""
+Checks that live mode decides like the backtest (python -m pytest test_streaming.py)
+"""
+
+import numpy as np
+
+from dataGetter import getSyntheticData
+from decisionMaker import Knn
+from indicators import extractFeatures, StreamingFeatures
+from liveMode import LiveKnn
+
+
+def test_streamingFeaturesMatchBatch():
+	klines = getSyntheticData(20000, 7)
+	dataPoints, valid = extractFeatures(klines)
+
+	features = StreamingFeatures()
+	streamed = np.array([features.update(kline) for kline in klines])
+
+	# bit for bit, a rounding difference can flip a neighbour or the threshold check
+	assert np.array_equal(np.isnan(streamed), np.isnan(dataPoints))
+	assert np.array_equal(streamed[valid], dataPoints[valid])
+
+
+def test_liveDecisionsMatchGetPosition():
+	klines = getSyntheticData(12000, 7)
+	trainSize = 10000
+	# the sim klines start with the klines the live features are warmed up with
+	warmUp = 10
+
+	simKlines = klines[trainSize - warmUp:]
+	knn = Knn(klines[:trainSize], simKlines)
+	live = LiveKnn(Knn(klines[:trainSize]))
+	live.warmUp(klines[trainSize - warmUp:trainSize])
+
+	decided = 0
+	for simIndex in range(warmUp, len(simKlines) - 1):
+		expected = knn.getPosition(simKlines, simIndex)["predicted"]
+		predicted = live.onKline(simKlines[simIndex])["predicted"]
+
+		assert (expected is None) == (predicted is None)
+		if expected is not None:
+			assert predicted.direction == expected.direction
+			decided += 1
+
+	assert decided
@@ -0,0 +1,203 @@
+"""
+Compact format for the results of a backtest.
+
+Pickling a Backtest saves everything it points to: the sim klines, the decision maker with all the training
+klines and its index, and every Position object. Here only the results are saved, in columns:
+    - the trade log: one array per Position attribute (plus if the trade was won or lost)
+    - the equity curve (the net profit after every kline)
+    - the scalar stats and the backtest params
+    - the sim klines (optional), so the chart can be plotted again
+in an uncompressed .npz file, which numpy reads and writes at disk speed.
+
+    saveBacktest(backtest, "backtest.npz")
+    backtest = loadBacktest("backtest.npz")
+    print(backtest)
+    backtest.plot()
+"""
+
+import json
+
+import numpy as np
+
+from klineStore import KlineStore, klineColumns
+from tradingClasses import Backtest, Position
+
+
+# the columns of the trade log, with their type and the value that stands for None
+tradeColumns = {
+    "entryIndex": (np.int64, -1),
+    "exitIndex": (np.int64, -1),
+    "entryPrice": (np.float64, np.nan),
+    "exitPrice": (np.float64, np.nan),
+    "direction": (np.int8, 0),
+    "sl": (np.float64, np.nan),
+    "tp": (np.float64, np.nan),
+    "slPrice": (np.float64, np.nan),
+    "tpPrice": (np.float64, np.nan)
+}
+
+# the result column of the trade log
+WON = 1
+LOST = -1
+OPEN = 0
+
+# the stats that are single values
+scalarStats = ("duration", "profitFactor", "maxDrawdown", "grossProfit", "grossLoss", "commission", "netProfit",
+               "percentProfitable")
+
+
+def tradeLogFromPositions(positions, winning=(), losing=()):
+    """
+    Returns the columns of the trade log of the positions
+
+    :param positions:   the positions, in the order they were opened
+    :param winning:     the positions that hit the tp
+    :param losing:      the positions that hit the sl
+    :return:            {column: array}
+    """
+
+    tradeLog = {}
+
+    for column, (dtype, missing) in tradeColumns.items():
+        values = [getattr(position, column) for position in positions]
+        tradeLog[column] = np.array([missing if value is None else value for value in values], dtype=dtype)
+
+    wonIds = {id(position) for position in winning}
+    lostIds = {id(position) for position in losing}
+    tradeLog["result"] = np.array(
+        [WON if id(position) in wonIds else LOST if id(position) in lostIds else OPEN for position in positions],
+        dtype=np.int8
+    )
+
+    return tradeLog
+
+
+def positionsFromTradeLog(tradeLog):
+    """
+    Rebuilds the Position objects of the trade log
+    """
+
+    columns = []
+    for column, (dtype, missing) in tradeColumns.items():
+        values = tradeLog[column].tolist()
+
+        if missing != missing:
+            # NaN is not equal to itself
+            columns.append([None if value != value else value for value in values])
+        else:
+            columns.append([None if value == missing else value for value in values])
+
+    return [Position(**dict(zip(tradeColumns, values))) for values in zip(*columns)]
+
+
+def saveBacktest(backtest, filePath, includeKlines=True):
+    """
+    Saves the results of the backtest in the compact format
+
+    :param backtest:        a Backtest (or VectorBacktest) that already ran
+    :param filePath:        where to save it (.npz)
+    :param includeKlines:   if False the sim klines are not saved, so the results can't be plotted with the chart
+    """
+
+    stats = backtest.stats
+    tradeLog = tradeLogFromPositions(stats["totPositions"], stats["winningPositions"], stats["losingPositions"])
+
+    meta = {
+        "stats": {key: stats[key] for key in scalarStats},
+        "commissionFee": backtest.commissionFee,
+        "maxOpenPositions": backtest.maxOpenPositions,
+        "positionSize": backtest.positionSize,
+        "numOfKlines": len(backtest.klines)
+    }
+
+    arrays = {f"trade {column}": values for column, values in tradeLog.items()}
+    arrays["netProfits"] = np.asarray(stats["netProfits"], dtype=np.float64)
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+
+    if includeKlines:
+        klines = backtest.klines
+        if not isinstance(klines, KlineStore):
+            klines = KlineStore.fromRows(klines)
+
+        for key in klineColumns:
+            arrays[f"kline {key}"] = klines.columns[key]
+
+    with open(filePath, "wb") as backtestFile:
+        np.savez(backtestFile, **arrays)
+
+
+class SavedBacktest(Backtest):
+    def __init__(self, klines, stats, commissionFee, maxOpenPositions, positionSize, numOfKlines):
+        """
+        The results of a saved backtest (see loadBacktest), it can be printed and plotted like the Backtest
+        that was saved, but it doesn't run anything
+
+        :param klines:  the sim klines, None if they were not saved
+        """
+
+        self.klines = klines
+        self.decisionMaker = None
+
+        self.commissionFee = commissionFee
+        self.maxOpenPositions = maxOpenPositions
+        self.positionSize = positionSize
+        self.numOfKlines = numOfKlines
+
+        self.stats = stats
+
+    def __str__(self):
+        if self.klines is None:
+            # the report shows the number of klines tested
+            self.klines = range(self.numOfKlines)
+            try:
+                return super().__str__()
+            finally:
+                self.klines = None
+
+        return super().__str__()
+
+    def plot(self):
+        if self.klines is None:
+            raise Exception("The klines were not saved with the backtest, so the chart can't be plotted!")
+
+        super().plot()
+
+    def runBacktest(self):
+        return self.stats
+
+
+def loadBacktest(filePath):
+    """
+    Loads a backtest saved with saveBacktest
+
+    :return:    SavedBacktest
+    """
+
+    with np.load(filePath) as saved:
+        meta = json.loads(saved["meta"].tobytes().decode())
+        tradeLog = {column: saved[f"trade {column}"] for column in list(tradeColumns) + ["result"]}
+        netProfits = saved["netProfits"]
+
+        klines = None
+        if "kline timestamp" in saved.files:
+            klines = KlineStore({key: saved[f"kline {key}"] for key in klineColumns})
+
+    positions = positionsFromTradeLog(tradeLog)
+    result = tradeLog["result"]
+    direction = tradeLog["direction"]
+
+    stats = dict(meta["stats"])
+    stats["totPositions"] = positions
+    stats["longPositions"] = [position for position, d in zip(positions, direction.tolist()) if d == 1]
+    stats["shortPositions"] = [position for position, d in zip(positions, direction.tolist()) if d == -1]
+
+    # the winning and losing lists are in the order the positions were closed in
+    closed = np.flatnonzero(result != OPEN)
+    closed = closed[np.argsort(tradeLog["exitIndex"][closed], kind="stable")]
+    stats["winningPositions"] = [positions[i] for i in closed.tolist() if result[i] == WON]
+    stats["losingPositions"] = [positions[i] for i in closed.tolist() if result[i] == LOST]
+    stats["netProfits"] = netProfits.tolist()
+
+    return SavedBacktest(
+        klines, stats, meta["commissionFee"], meta["maxOpenPositions"], meta["positionSize"], meta["numOfKlines"]
+    )
@@ -2,16 +2,23 @@
 The classes that are used primarily for plotting and displaying info.
 """
 
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import Rectangle
+import time
+
+from matplotlib.collections import LineCollection, PolyCollection
 import matplotlib.pyplot as plt
+import numpy as np
 
 from config import positionSimConfig
+from instrumentation import instruments
+from klineStore import KlineStore
 from loadingBar import loadingBar
 
 
 class Chart:
     def __init__(self, klines: list, indicators=(), positions=(), plotIndicators=True, plotPositions=True):
+        if not isinstance(klines, KlineStore):
+            klines = KlineStore.fromRows(klines)
+
         self.klines = klines
         self.indicators = indicators
         self.positions = positions
@@ -22,9 +29,18 @@ class Chart:
         self.bearishColor = "red"
         self.rangingColor = "yellow"
 
+        # about how many pixels each drawn candle gets, the klines are aggregated when there's less room than that
+        self.pixelsPerCandle = 3
+        # if True, the price axis follows the visible candles when zooming or panning
+        self.fitPrices = True
+
         self.plotIndicators = plotIndicators
         self.plotPositions = plotPositions
 
+        self.bodies = None
+        self.wicks = None
+        self.drawnView = None
+
     def __str__(self):
         return f"""
 CHART INFO
@@ -33,33 +49,96 @@ num of klines: {len(self.klines)}
 some other info here maybe :>
 """
 
+    def aggregate(self, start, end, bucketSize):
+        """
+        Aggregates the klines from start to end in buckets of bucketSize klines (like a higher timeframe)
+
+        :return:    (starts, ends, open, high, low, close) of every bucket
+        """
+
+        starts = np.arange(start, end, bucketSize)
+        ends = np.minimum(starts + bucketSize, end)
+
+        openPrices = self.klines.open[starts]
+        closePrices = self.klines.close[ends - 1]
+        high = np.maximum.reduceat(self.klines.high[start:end], starts - start)
+        low = np.minimum.reduceat(self.klines.low[start:end], starts - start)
+
+        return starts, ends, openPrices, high, low, closePrices
+
+    def updateCandles(self, ax):
+        """
+        Draws the candles of the visible klines, aggregated so that there are at most about as many candles as
+        the axis has room for. Called again every time the x limits change (zoom and pan).
+        """
+
+        numOfKlines = len(self.klines)
+        left, right = ax.get_xlim()
+        start = max(0, int(np.floor(left + 0.5)))
+        end = min(numOfKlines, int(np.ceil(right + 0.5)))
+
+        if start >= end:
+            return
+
+        maxCandles = max(1, int(ax.bbox.width / self.pixelsPerCandle))
+        bucketSize = max(1, int(np.ceil((end - start) / maxCandles)))
+
+        # the buckets always start at multiples of their size, so they don't change while panning
+        start -= start % bucketSize
+
+        if self.drawnView == (start, end, bucketSize):
+            return
+        self.drawnView = (start, end, bucketSize)
+
+        starts, ends, openPrices, high, low, closePrices = self.aggregate(start, end, bucketSize)
+        height = closePrices - openPrices
+
+        colors = np.where(height > 0, self.bullishColor, np.where(height < 0, self.bearishColor, self.rangingColor))
+        height = np.where(height == 0, self.lineHeight, height)
+
+        # bodies: one rectangle per candle, from the open to the close
+        x0 = starts - 0.5
+        x1 = ends - 0.5
+        bodies = np.empty((len(starts), 4, 2))
+        bodies[:, :, 0] = np.column_stack((x0, x0, x1, x1))
+        bodies[:, :, 1] = np.column_stack((openPrices, openPrices + height, openPrices + height, openPrices))
+
+        # wicks: one line per candle, from the low to the high (the ranging ones don't have it)
+        hasWick = closePrices != openPrices
+        center = (starts + ends - 1) / 2
+        wicks = np.empty((hasWick.sum(), 2, 2))
+        wicks[:, 0, 0] = wicks[:, 1, 0] = center[hasWick]
+        wicks[:, 0, 1] = low[hasWick]
+        wicks[:, 1, 1] = high[hasWick]
+
+        self.bodies.set_verts(bodies)
+        self.bodies.set_facecolor(colors)
+        self.wicks.set_segments(wicks)
+        self.wicks.set_color(colors[hasWick])
+
+        if self.fitPrices:
+            margin = (high.max() - low.min()) * 0.05
+            ax.set_ylim(low.min() - margin, high.max() + margin)
+
     def plot(self, ax):
-        bullish = []
-        bearish = []
-        ranging = []
-
-        for index in range(len(self.klines)):
-            kline = self.klines[index]
-
-            coords = (index - 0.5, kline["open"])  # (index, openPrice)
-            width = 1  # 1, because each index is large 1
-            height = kline["close"] - kline["open"]  # closePrice - openPrice
-
-            coordsHl = (((index + 0.5) - self.hlWidth / 2) - 0.5, kline["low"])
-            heightHl = kline["high"] - kline["low"]
-
-            if height > 0:
-                bullish.append(Rectangle(coords, width, height))
-                bullish.append(Rectangle(coordsHl, self.hlWidth, heightHl))
-            elif height < 0:
-                bearish.append(Rectangle(coords, width, height))
-                bearish.append(Rectangle(coordsHl, self.hlWidth, heightHl))
-            else:
-                ranging.append(Rectangle(coords, width, self.lineHeight))
+        """
+        Plots the candles with two collections (bodies and wicks), which are redrawn on zoom,
+        so even a whole year of klines stays interactive
+        """
 
-        ax.add_collection(PatchCollection(bullish, edgecolor="none", facecolor=self.bullishColor))
-        ax.add_collection(PatchCollection(bearish, edgecolor="none", facecolor=self.bearishColor))
-        ax.add_collection(PatchCollection(ranging, edgecolor="none", facecolor=self.rangingColor))
+        self.bodies = PolyCollection([], edgecolor="none")
+        self.wicks = LineCollection([], linewidths=1)
+        self.drawnView = None
+
+        ax.add_collection(self.bodies)
+        ax.add_collection(self.wicks)
+
+        if len(self.klines):
+            ax.set_xlim(-0.5, len(self.klines) - 0.5)
+            ax.set_ylim(self.klines.low.min(), self.klines.high.max())
+            self.updateCandles(ax)
+
+        ax.callbacks.connect("xlim_changed", self.updateCandles)
 
         # plot indicators
         if self.plotIndicators:
@@ -68,13 +147,7 @@ some other info here maybe :>
 
         # plot positions
         if self.plotPositions and self.positions:
-            for position in self.positions:
-                if position is None:
-                    continue
-
-                position.plot(ax)
-
-        ax.errorbar(0, 1)
+            plotPositions(ax, self.positions)
 
 
 class Indicator:
@@ -89,6 +162,9 @@ class Indicator:
 
 
 class Position:
+    # a backtest can have thousands of positions, with slots they take less memory and are faster to create
+    __slots__ = ("entryIndex", "exitIndex", "entryPrice", "direction", "sl", "tp", "slPrice", "tpPrice", "exitPrice")
+
     def __init__(self, entryIndex, exitIndex, entryPrice, direction, sl, tp, slPrice, tpPrice, exitPrice):
         self.entryIndex = entryIndex
         self.exitIndex = exitIndex
@@ -105,50 +181,64 @@ class Position:
                 f"\tEntry price: {self.entryPrice}\n\tExit price: {self.exitPrice}\n\tExit index: {self.exitIndex}")
 
     def plot(self, ax):
-        positionSquareOpacity = 0.5
+        plotPositions(ax, [self])
+
 
-        if self.exitIndex:
-            width = self.exitIndex - self.entryIndex + 0.5
-        else:
-            width = positionSimConfig["maxLength"]
-        origin = (self.entryIndex - 0.5, self.entryPrice)
+def plotPositions(ax, positions, opacity=0.5):
+    """
+    Plots the tp (green) and sl (red) zones of all the positions at once, with one collection for each color.
+    A position without an exit is drawn as long as positionSimConfig["maxLength"].
+    """
 
-        greenRects = []
-        redRects = []
+    positions = [position for position in positions if position is not None]
+    if not positions:
+        return
 
-        if self.direction == 1:
-            upperLimit = (self.entryPrice * self.tp) / 100
-            lowerLimit = (self.entryPrice * self.sl) / -100
+    entryIndexes = np.array([position.entryIndex for position in positions], dtype=np.float64)
+    exitIndexes = np.array([position.exitIndex if position.exitIndex else np.nan for position in positions])
+    entryPrices = np.array([position.entryPrice for position in positions], dtype=np.float64)
+    directions = np.array([position.direction for position in positions])
+    tps = np.array([position.tp for position in positions], dtype=np.float64)
+    sls = np.array([position.sl for position in positions], dtype=np.float64)
 
-            greenRects.append(Rectangle(origin, width, upperLimit))
-            redRects.append(Rectangle(origin, width, lowerLimit))
+    if not np.isin(directions, (1, -1)).all():
+        raise Exception("Invalid direction")
 
-        elif self.direction == -1:
-            upperLimit = (self.entryPrice * self.sl) / 100
-            lowerLimit = (self.entryPrice * self.tp) / -100
+    widths = np.where(np.isnan(exitIndexes), positionSimConfig["maxLength"], exitIndexes - entryIndexes + 0.5)
 
-            greenRects.append(Rectangle(origin, width, lowerLimit))
-            redRects.append(Rectangle(origin, width, upperLimit))
+    # the tp is above the entry for the longs and below for the shorts, the sl the other way around
+    tpHeights = (entryPrices * tps) / 100 * directions
+    slHeights = (entryPrices * sls) / -100 * directions
 
-        else:
-            raise Exception("Invalid direction")
+    x0 = entryIndexes - 0.5
+    x1 = x0 + widths
 
-        ax.add_collection(
-            PatchCollection(greenRects, edgecolor="none", facecolor="green", alpha=positionSquareOpacity)
-        )
-        ax.add_collection(PatchCollection(redRects, edgecolor="none", facecolor="red", alpha=positionSquareOpacity))
+    for heights, color in ((tpHeights, "green"), (slHeights, "red")):
+        rects = np.empty((len(positions), 4, 2))
+        rects[:, :, 0] = np.column_stack((x0, x0, x1, x1))
+        rects[:, :, 1] = np.column_stack((entryPrices, entryPrices + heights, entryPrices + heights, entryPrices))
+
+        ax.add_collection(PolyCollection(rects, edgecolor="none", facecolor=color, alpha=opacity))
 
 
 class Backtest:
-    def __init__(self, klines: list, decisionMaker, commissionFee=0.1, maxOpenPositions=1, positionSize=100):
+    def __init__(self, klines: list, decisionMaker, commissionFee=0.1, maxOpenPositions=1, positionSize=100,
+                 intrabar=None):
+        """
+        :param intrabar:    IntrabarResolver of the klines (see intrabar.py), when a kline hits both the sl and the tp
+                            of a position, it tells which one was hit first. Without it, it's always the sl
+        """
+
         self.klines = klines
         self.decisionMaker = decisionMaker
+        self.intrabar = intrabar
 
         self.commissionFee = commissionFee
         self.maxOpenPositions = maxOpenPositions
         self.positionSize = positionSize
 
-        self.stats = self.runBacktest()
+        with instruments.stage("backtest"):
+            self.stats = self.runBacktest()
 
     def __str__(self):
         return f"""
@@ -237,8 +327,14 @@ class Backtest:
                 predictedPos = None
 
             else:
+                if instruments.enabled:
+                    start = time.perf_counter()
+
                 predictedPos = self.decisionMaker.getPosition(self.klines, klineIndex)["predicted"]
 
+                if instruments.enabled:
+                    instruments.addTime("getPosition", start)
+
             # skip None positions
             if predictedPos is not None:
                 # append the position to the correct lists
@@ -256,14 +352,21 @@ class Backtest:
                 predictedPos.tpPrice = predictedPos.entryPrice + (predictedPos.entryPrice / 100) * predictedPos.tp * predictedPos.direction
                 predictedPos.slPrice = predictedPos.entryPrice - (predictedPos.entryPrice / 100) * predictedPos.sl * predictedPos.direction
 
-            # simulate positions
-            for openPos in openPositions:
+            # simulate positions (on a copy, since the closed ones get removed from the list)
+            for openPos in list(openPositions):
                 if openPos.entryIndex > klineIndex:
                     # this is because position open in the next candle
                     continue
 
+                slHit = (openPos.direction == 1 and self.klines[klineIndex]["low"] < openPos.slPrice) or (openPos.direction == -1 and self.klines[klineIndex]["high"] > openPos.slPrice)
+                tpHit = (openPos.direction == 1 and self.klines[klineIndex]["high"] > openPos.tpPrice) or (openPos.direction == -1 and self.klines[klineIndex]["low"] < openPos.tpPrice)
+
+                # both in the same kline, look in the lower timeframe which one came first
+                if slHit and tpHit and self.intrabar is not None:
+                    slHit = bool(self.intrabar.slFirst([klineIndex], [openPos.slPrice], [openPos.tpPrice], [openPos.direction])[0])
+
                 # check sl
-                if (openPos.direction == 1 and self.klines[klineIndex]["low"] < openPos.slPrice) or (openPos.direction == -1 and self.klines[klineIndex]["high"] > openPos.slPrice):
+                if slHit:
                     openPos.exitIndex = klineIndex
                     openPos.exitPrice = openPos.slPrice
                     stats["losingPositions"].append(openPos)
@@ -275,7 +378,7 @@ class Backtest:
                     openPositions.remove(openPos)
 
                 # check tp
-                elif (openPos.direction == 1 and self.klines[klineIndex]["high"] > openPos.tpPrice) or (openPos.direction == -1 and self.klines[klineIndex]["low"] < openPos.tpPrice):
+                elif tpHit:
                     openPos.exitIndex = klineIndex
                     openPos.exitPrice = openPos.tpPrice
                     stats["winningPositions"].append(openPos)
@@ -0,0 +1,237 @@
+"""
+Vectorized backtest engine.
+
+Instead of going through every kline, it takes the entry signals of all the klines at once
+and resolves the exit of each trade by searching forward over the high/low arrays (for all the trades at once).
+Then only the signals need to be walked through, to know which trades get taken.
+The equity curve, drawdown and stats are then built from the trade arrays.
+
+The results are the same as Backtest.runBacktest, so the two engines can be swapped.
+"""
+
+import bisect
+import heapq
+import numpy as np
+
+from config import actualPositionConfig
+from instrumentation import instruments
+from tradingClasses import Backtest, Position
+
+
+class VectorBacktest(Backtest):
+    def __init__(self, klines, decisionMaker=None, signals=None, commissionFee=0.1, maxOpenPositions=1,
+                 positionSize=100, positionParams=None, intrabar=None):
+        """
+        :param klines:          the simulation klines (KlineStore)
+        :param decisionMaker:   used to get the signals, if they are not given
+        :param signals:         (n,) array with 1 (long), -1 (short) or 0 for every kline,
+                                the position is entered at the open of the next kline
+        :param positionParams:  sl and tp of the positions (in percents), default: the actualPositionParams of the
+                                decision maker (the ones Backtest would use), or actualPositionConfig without one
+        :param intrabar:        IntrabarResolver of the klines, to know if the sl or the tp came first when
+                                both are hit in the same kline (otherwise it's the sl)
+        """
+
+        if signals is None:
+            signals = decisionMaker.getSignals(klines)
+
+        if positionParams is None:
+            positionParams = getattr(decisionMaker, "actualPositionParams", None) or actualPositionConfig
+
+        self.signals = np.asarray(signals)
+        self.positionParams = positionParams
+
+        super().__init__(klines, decisionMaker, commissionFee, maxOpenPositions, positionSize, intrabar)
+
+    def findExits(self, entryIndexes, directions, slPrices, tpPrices, blockSize=2 ** 22):
+        """
+        Searches, for every position at once, the first kline (from the entry one) that hits its sl or tp.
+        The klines after the entries are compared in windows that double in size, and only the positions that
+        are still open get compared in the next window, so most of the work is done in the first few windows.
+
+        :param blockSize:   max number of klines compared at once (positions x window)
+        :return:            (exitIndexes, slHits), the exit index is -1 if the position never closes
+        """
+
+        numOfKlines = len(self.klines)
+        low = self.klines.low
+        high = self.klines.high
+
+        exitIndexes = np.full(len(entryIndexes), -1, dtype=np.int64)
+        slHits = np.zeros(len(entryIndexes), dtype=bool)
+
+        remaining = np.arange(len(entryIndexes))
+        offset = 0
+        window = 16
+
+        while len(remaining) and offset < numOfKlines:
+            window = max(1, min(window, blockSize // len(remaining)))
+
+            starts = entryIndexes[remaining] + offset
+            klineIndexes = starts[:, None] + np.arange(window)
+            inRange = klineIndexes < numOfKlines
+            klineIndexes = np.minimum(klineIndexes, numOfKlines - 1)
+
+            isLong = directions[remaining][:, None] == 1
+            sl = slPrices[remaining][:, None]
+            tp = tpPrices[remaining][:, None]
+            lows = low[klineIndexes]
+            highs = high[klineIndexes]
+
+            slHit = np.where(isLong, lows < sl, highs > sl) & inRange
+            tpHit = np.where(isLong, highs > tp, lows < tp) & inRange
+
+            hit = slHit | tpHit
+            closed = hit.any(axis=1)
+            first = hit.argmax(axis=1)[closed]
+
+            # the sl is checked first, like in the kline by kline backtest
+            exitIndexes[remaining[closed]] = starts[closed] + first
+            slHits[remaining[closed]] = slHit[closed, first]
+
+            if self.intrabar is not None:
+                # the ones that hit both in the same kline get resolved with the lower timeframe
+                both = np.flatnonzero(slHit[closed, first] & tpHit[closed, first])
+                positions = remaining[closed][both]
+                slHits[positions] = self.intrabar.slFirst(
+                    exitIndexes[positions], slPrices[positions], tpPrices[positions], directions[positions]
+                )
+
+            remaining = remaining[~closed]
+            offset += window
+            window *= 2
+
+        return exitIndexes, slHits
+
+    def runBacktest(self):
+        stats = {
+            "longPositions": [],
+            "shortPositions": [],
+            "totPositions": [],
+            "winningPositions": [],
+            "losingPositions": [],
+            "duration": 0,
+            "profitFactor": 0,
+            "maxDrawdown": 0,
+            "grossProfit": 0,
+            "grossLoss": 0,
+            "commission": 0,
+            "netProfit": 0,
+            "percentProfitable": 0,
+            "netProfits": []
+        }
+
+        numOfKlines = len(self.klines)
+        sl = self.positionParams["sl"]
+        tp = self.positionParams["tp"]
+
+        # the last kline can't have a signal, since there is no next kline to enter in
+        signalIndexes = np.flatnonzero(self.signals[:numOfKlines - 1])
+
+        # the trade of every signal, as if it was taken
+        directions = self.signals[signalIndexes].astype(np.int64)
+        entryIndexes = signalIndexes + 1
+        entryPrices = self.klines.open[entryIndexes]
+        slPrices = entryPrices - (entryPrices / 100) * sl * directions
+        tpPrices = entryPrices + (entryPrices / 100) * tp * directions
+        with instruments.stage("find exits"):
+            signalExits, signalSlHits = self.findExits(entryIndexes, directions, slPrices, tpPrices)
+
+        # take the trades: a signal is taken if less than maxOpenPositions are open at its kline.
+        # A position is open from the kline of its signal up to (and including) its exit kline,
+        # a position that never closes stays open until the end.
+        openUntil = np.where(signalExits != -1, signalExits, numOfKlines).tolist()
+        signalKlines = signalIndexes.tolist()
+
+        taken = []
+        openExits = []
+        i = 0
+        while i < len(signalKlines):
+            # close the positions that exited before this kline
+            while openExits and openExits[0] < signalKlines[i]:
+                heapq.heappop(openExits)
+
+            if len(openExits) >= self.maxOpenPositions:
+                # jump straight to the first signal after the next exit
+                i = bisect.bisect_right(signalKlines, openExits[0], lo=i)
+                continue
+
+            taken.append(i)
+            heapq.heappush(openExits, openUntil[i])
+            i += 1
+
+        taken = np.array(taken, dtype=np.int64)
+        exits = signalExits[taken]
+        slHits = signalSlHits[taken]
+
+        entries = []
+        for entryIndex, entryPrice, direction, slPrice, tpPrice, exitIndex, slHit in zip(
+            entryIndexes[taken].tolist(), entryPrices[taken].tolist(), directions[taken].tolist(),
+            slPrices[taken].tolist(), tpPrices[taken].tolist(), exits.tolist(), slHits.tolist()
+        ):
+            position = Position(
+                entryIndex=entryIndex,
+                exitIndex=None,
+                entryPrice=entryPrice,
+                direction=direction,
+                sl=sl,
+                tp=tp,
+                slPrice=slPrice,
+                tpPrice=tpPrice,
+                exitPrice=None
+            )
+            entries.append(position)
+
+            stats["totPositions"].append(position)
+
+            if direction == 1:
+                stats["longPositions"].append(position)
+            else:
+                stats["shortPositions"].append(position)
+
+            if exitIndex != -1:
+                position.exitIndex = exitIndex
+                position.exitPrice = slPrice if slHit else tpPrice
+
+        # the closed positions in the order they were closed in (kline, then opening order)
+        closed = np.flatnonzero(exits != -1)
+        closed = closed[np.argsort(exits[closed], kind="stable")]
+
+        profits = np.where(slHits[closed], (self.positionSize * sl) / -100, (self.positionSize * tp) / 100)
+
+        for tradeIndex, slHit in zip(closed.tolist(), slHits[closed].tolist()):
+            if slHit:
+                stats["losingPositions"].append(entries[tradeIndex])
+            else:
+                stats["winningPositions"].append(entries[tradeIndex])
+
+        # np.cumsum adds one value at a time, so the sums are the same as the kline by kline ones
+        if len(closed):
+            netProfitAfter = np.cumsum(profits)
+            stats["netProfit"] = float(netProfitAfter[-1])
+
+            losses = profits[slHits[closed]]
+            wins = profits[~slHits[closed]]
+            stats["grossLoss"] = float(np.cumsum(losses)[-1]) if len(losses) else 0
+            stats["grossProfit"] = float(np.cumsum(wins)[-1]) if len(wins) else 0
+
+            # equity curve: the net profit after the last position closed at or before each kline
+            lastClosed = np.searchsorted(exits[closed], np.arange(numOfKlines), side="right") - 1
+            netProfits = np.where(lastClosed >= 0, netProfitAfter[np.maximum(lastClosed, 0)], 0.0)
+        else:
+            netProfits = np.zeros(numOfKlines)
+
+        stats["netProfits"] = netProfits.tolist()
+
+        # drawdown from the highest net profit so far (starting from 0)
+        if numOfKlines:
+            maxNetProfits = np.maximum(np.maximum.accumulate(netProfits), 0)
+            stats["maxDrawdown"] = min(float((netProfits - maxNetProfits).min()), 0)
+
+        # update stats
+        try:
+            stats["profitFactor"] = abs(stats["grossProfit"] / stats["grossLoss"])
+        except ZeroDivisionError:
+            stats["profitFactor"] = 99.99
+
+        return stats
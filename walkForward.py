@@ -0,0 +1,140 @@
+"""
+Walk-forward backtest: the klines are split in folds, each one trained on the klines before it and
+backtested on its own klines, like the model would have been used in real time.
+
+    fold 0:  [ train            ][ test 0 ]
+    fold 1:       [ train            ][ test 1 ]
+    fold 2:            [ train            ][ test 2 ]
+
+The folds overlap a lot, so nothing gets calculated from scratch for each one:
+    - the features of all the klines are calculated once, the train and test klines of every fold are slices of them
+    - a single SlidingKnn moves forward from fold to fold: only the klines of the last test fold are added to it
+      (their outcomes are simulated once) and the ones that left the train window are expired from its index,
+      which is never rebuilt as a whole (see SlidingWindowIndex)
+A training kline goes in the index only when its simulated position can't see the test klines,
+so the outcomes never peek into the future.
+"""
+
+import csv
+import time
+
+from config import knnConfig, positionSimConfig, actualPositionConfig
+from dataGetter import getCryptoDataBinance
+from decisionMaker import SlidingKnn
+from indicators import extractFeatures
+from vectorBacktest import VectorBacktest
+
+
+def getFolds(numOfKlines, folds, trainSize, anchored=False):
+    """
+    Returns the (trainStart, trainEnd, testEnd) of every fold, the test klines go from trainEnd to testEnd
+
+    :param numOfKlines:     number of klines to split
+    :param folds:           number of folds
+    :param trainSize:       number of train klines (of the first fold, if anchored)
+    :param anchored:        if True the train klines always start from the first kline (growing window),
+                            otherwise the train window moves forward with the folds
+    """
+
+    testSize = (numOfKlines - trainSize) // folds
+
+    if trainSize <= 0 or testSize <= 0:
+        raise Exception(f"Can't split {numOfKlines} klines in {folds} folds with {trainSize} train klines!")
+
+    splits = []
+    for fold in range(folds):
+        trainEnd = trainSize + fold * testSize
+        trainStart = 0 if anchored else trainEnd - trainSize
+
+        splits.append((trainStart, trainEnd, trainEnd + testSize))
+
+    return splits
+
+
+def walkForward(klines, folds=12, trainSize=None, anchored=False, resultsPath=None, backtestClass=VectorBacktest,
+                maxOpenPositions=1, knnParams=knnConfig, positionParams=positionSimConfig,
+                actualPositionParams=actualPositionConfig):
+    """
+    Runs the knn and a backtest on every fold
+
+    :param klines:          all the klines (KlineStore)
+    :param folds:           number of test folds
+    :param trainSize:       number of train klines (default: half of the klines)
+    :param anchored:        see getFolds
+    :param resultsPath:     where to write the results of every fold (csv), None to not write them
+    :param backtestClass:   VectorBacktest or Backtest (kline by kline, same results but way slower)
+    :return:                (rows, backtests): the stats of every fold and its backtest
+    """
+
+    if trainSize is None:
+        trainSize = len(klines) // 2
+
+    splits = getFolds(len(klines), folds, trainSize, anchored)
+
+    print(f"Walk-forward over {folds} folds...")
+
+    dataPoints, valid = extractFeatures(klines)
+
+    knn = None
+    rows = []
+    backtests = []
+
+    for fold, (trainStart, trainEnd, testEnd) in enumerate(splits):
+        start = time.time()
+
+        if knn is None:
+            # the first fold starts from the first kline, so the ids of the knn are the kline indexes
+            knn = SlidingKnn(klines[:trainEnd], knnParams=knnParams, positionParams=positionParams,
+                             actualPositionParams=actualPositionParams,
+                             trainFeatures=(dataPoints[:trainEnd], valid[:trainEnd]))
+        else:
+            added = slice(len(knn.trainKlines), trainEnd)
+            knn.addTrainKlines(klines[added], (dataPoints[added], valid[added]))
+            knn.expireBefore(trainStart)
+
+        testKlines = klines[trainEnd:testEnd]
+        knn.setSimKlines(testKlines, (dataPoints[trainEnd:testEnd], valid[trainEnd:testEnd]))
+
+        if issubclass(backtestClass, VectorBacktest):
+            # Backtest gets the sl and tp from the positions of the knn, the vectorized one needs them
+            backtest = backtestClass(testKlines, knn, maxOpenPositions=maxOpenPositions,
+                                     positionParams=actualPositionParams)
+        else:
+            backtest = backtestClass(testKlines, knn, maxOpenPositions=maxOpenPositions)
+        backtests.append(backtest)
+        stats = backtest.stats
+
+        rows.append({
+            "fold": fold,
+            "trainStart": trainStart,
+            "trainEnd": trainEnd,
+            "testEnd": testEnd,
+            "netProfit": stats["netProfit"],
+            "profitFactor": stats["profitFactor"],
+            "maxDrawdown": stats["maxDrawdown"],
+            "positions": len(stats["totPositions"]),
+            "winningPositions": len(stats["winningPositions"]),
+            "losingPositions": len(stats["losingPositions"]),
+            "seconds": round(time.time() - start, 3)
+        })
+
+        print(f"Fold {fold}: {len(stats['totPositions'])} pos | {stats['netProfit']:.2f}€ | {rows[-1]['seconds']}s")
+
+    print(f"\nTotal net profit: {sum(row['netProfit'] for row in rows):.2f}€\n")
+
+    if resultsPath is not None:
+        with open(resultsPath, "w", newline="") as resultsFile:
+            writer = csv.DictWriter(resultsFile, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+        print(f"Results written to {resultsPath}")
+
+    return rows, backtests
+
+
+if __name__ == '__main__':
+    klines = getCryptoDataBinance()
+
+    # half a year of training, then 12 folds over the rest
+    walkForward(klines, folds=12, trainSize=259200, resultsPath="walkForwardResults.csv")